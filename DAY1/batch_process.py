@@ -0,0 +1,230 @@
+"""Day 1 批次處理：以多行程對整個資料夾執行 step02 / 03 / 05 / 06"""
+from __future__ import annotations
+from collections import Counter
+from dataclasses import dataclass
+from multiprocessing import Pool
+from pathlib import Path
+from typing import Callable, Iterator
+import argparse
+import hashlib
+import os
+import threading
+import time
+import cv2
+import numpy as np
+
+from image_source import IMAGE_CACHE, IMAGES_DIR, read_image
+from step02_to_grayscale import to_grayscale
+from step03_resize_image import resize_to_width
+from step05_detect_edges import detect_edges
+from step06_detect_circles import detect_circles
+
+# Author: harry123180
+
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png", ".bmp"}
+DEFAULT_INPUTS = [
+    IMAGES_DIR / "frontlit_detail",
+    IMAGES_DIR / "backlit_silhouette",
+    IMAGES_DIR / "lowlight_ambient",
+]
+# 行程池最多同時持有「行程數 × 這個數」批（每批 chunksize 張）還沒取回結果的工作
+PENDING_CHUNKS_PER_WORKER = 2
+
+
+def _run_grayscale(image: np.ndarray) -> tuple[np.ndarray, str]:
+    return to_grayscale(image), ""
+
+
+def _run_resize(image: np.ndarray) -> tuple[np.ndarray, str]:
+    return resize_to_width(image), ""
+
+
+def _run_edges(image: np.ndarray) -> tuple[np.ndarray, str]:
+    return detect_edges(image), ""
+
+
+def _run_circles(image: np.ndarray) -> tuple[np.ndarray, str]:
+    annotated, count = detect_circles(image)
+    return annotated, f"{count} circles"
+
+
+@dataclass(frozen=True)
+class BatchStep:
+    """一個可批次執行的步驟：讀取旗標 + 處理函式"""
+
+    name: str
+    read_flags: int
+    run: Callable[[np.ndarray], tuple[np.ndarray, str]]
+
+
+STEPS = {
+    "step02": BatchStep("step02", cv2.IMREAD_COLOR, _run_grayscale),
+    "step03": BatchStep("step03", cv2.IMREAD_COLOR, _run_resize),
+    "step05": BatchStep("step05", cv2.IMREAD_GRAYSCALE, _run_edges),
+    "step06": BatchStep("step06", cv2.IMREAD_COLOR, _run_circles),
+}
+
+
+@dataclass
+class BatchResult:
+    """單張圖片的處理結果"""
+
+    path: Path
+    elapsed: float
+    message: str
+    ok: bool = True
+
+
+def iter_image_files(roots: list[Path]) -> Iterator[tuple[Path, Path]]:
+    """逐一產生 (資料夾根目錄, 圖片路徑)，邊走訪資料夾邊產生，不會先建立完整清單"""
+    for root in roots:
+        for dir_path, dir_names, file_names in os.walk(root):
+            dir_names.sort()
+            for file_name in sorted(file_names):
+                if Path(file_name).suffix.lower() in IMAGE_SUFFIXES:
+                    yield root, Path(dir_path) / file_name
+
+
+def root_labels(roots: list[Path]) -> dict[Path, str]:
+    """每個來源資料夾在輸出路徑中的名稱
+
+    平常就是資料夾名稱；不同位置的資料夾同名時（例如 a/images 與 b/images），
+    改用「名稱-完整路徑的 SHA-1 前 8 碼」，兩邊的結果才不會寫到同一個檔案。
+    """
+    resolved = {root: root.resolve() for root in roots}
+    counts = Counter(path.name for path in set(resolved.values()))
+    labels = {}
+    for root, path in resolved.items():
+        if counts[path.name] > 1:
+            labels[root] = f"{path.name}-{hashlib.sha1(str(path).encode('utf-8')).hexdigest()[:8]}"
+        else:
+            labels[root] = path.name
+    return labels
+
+
+def _init_worker() -> None:
+    # 每個行程只用一條 OpenCV 執行緒，避免 N 個行程 × N 條執行緒互搶 CPU
+    cv2.setNumThreads(1)
+    # 批次中每張圖只會讀一次，不需要保留記憶體快取（磁碟快取仍然有效）
+    IMAGE_CACHE.max_bytes = 0
+
+
+def process_file(task: tuple[Path, str, Path, Path, tuple[str, ...]]) -> BatchResult:
+    """處理一張圖片並把各步驟的結果寫到 output_dir/<step>/<資料夾名稱>/<檔名>.png"""
+    root, label, image_path, output_dir, step_names = task
+    start = time.perf_counter()
+    relative = image_path.relative_to(root).with_suffix(".png")
+    messages = []
+    try:
+        decoded: dict[int, np.ndarray] = {}
+        for name in step_names:
+            step = STEPS[name]
+            if step.read_flags not in decoded:
+                decoded[step.read_flags] = read_image(image_path, step.read_flags)
+            result, info = step.run(decoded[step.read_flags])
+
+            output_path = output_dir / name / label / relative
+            output_path.parent.mkdir(parents=True, exist_ok=True)
+            if not cv2.imwrite(str(output_path), result):
+                raise RuntimeError(f"無法寫入 {output_path}")
+            if info:
+                messages.append(f"{name}: {info}")
+    except Exception as exc:  # 單張失敗不中斷整批
+        return BatchResult(image_path, time.perf_counter() - start, str(exc), ok=False)
+    return BatchResult(image_path, time.perf_counter() - start, ", ".join(messages))
+
+
+def run_batch(
+    roots: list[Path],
+    output_dir: Path,
+    step_names: tuple[str, ...],
+    workers: int,
+    ordered: bool = False,
+    chunksize: int = 4,
+    quiet: bool = False,
+) -> tuple[int, int, float]:
+    """以行程池串流處理所有圖片，回傳 (成功張數, 失敗張數, 總秒數)"""
+    labels = root_labels(roots)
+    # Pool 的 task-feeder 執行緒會盡快把產生器讀完，所以用號誌限制還沒取回結果的工作數；
+    # 上限至少要有一批（chunksize 張），否則湊不滿一批就送不出去
+    pending = threading.BoundedSemaphore(max(workers, 1) * max(chunksize, 1) * PENDING_CHUNKS_PER_WORKER)
+    stop = threading.Event()
+
+    def iter_tasks():
+        for root, path in iter_image_files(roots):
+            # 定期醒來檢查 stop，中途出錯或 Ctrl+C 時 Pool 才能正常收掉 feeder 執行緒
+            while not pending.acquire(timeout=0.1):
+                if stop.is_set():
+                    return
+            yield root, labels[root], path, output_dir, step_names
+
+    done = failed = 0
+    start = time.perf_counter()
+
+    def consume(results) -> None:
+        nonlocal done, failed
+        for result in results:
+            pending.release()
+            if result.ok:
+                done += 1
+            else:
+                failed += 1
+            if not quiet or not result.ok:
+                status = "OK " if result.ok else "ERR"
+                print(f"[{status}] {result.path.name} ({result.elapsed * 1000:.0f} ms) {result.message}")
+
+    if workers <= 1:
+        _init_worker()
+        consume(map(process_file, iter_tasks()))
+    else:
+        with Pool(processes=workers, initializer=_init_worker) as pool:
+            mapper = pool.imap if ordered else pool.imap_unordered
+            try:
+                consume(mapper(process_file, iter_tasks(), chunksize=chunksize))
+            finally:
+                stop.set()
+    return done, failed, time.perf_counter() - start
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="DAY1 批次處理（多行程）")
+    parser.add_argument("inputs", nargs="*", type=Path,
+                        help="來源資料夾（預設為 DAY1/images 下三個資料夾）")
+    parser.add_argument("-s", "--steps", nargs="+", choices=sorted(STEPS), default=sorted(STEPS),
+                        help="要執行的步驟（預設全部）")
+    parser.add_argument("-o", "--output", type=Path,
+                        default=Path(__file__).resolve().parent / "output" / "batch",
+                        help="輸出資料夾")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count() or 1,
+                        help="行程數（預設為 CPU 核心數，1 = 不開行程池）")
+    parser.add_argument("--ordered", action="store_true",
+                        help="依輸入順序輸出結果（預設誰先做完先輸出）")
+    parser.add_argument("--chunksize", type=int, default=4, help="每次派給行程的圖片數")
+    parser.add_argument("-q", "--quiet", action="store_true", help="只顯示錯誤與總結")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    roots = args.inputs or [root for root in DEFAULT_INPUTS if root.exists()]
+    missing = [root for root in roots if not root.is_dir()]
+    if missing:
+        raise FileNotFoundError(f"找不到資料夾: {', '.join(map(str, missing))}")
+
+    done, failed, elapsed = run_batch(
+        roots,
+        args.output,
+        tuple(args.steps),
+        workers=args.workers,
+        ordered=args.ordered,
+        chunksize=args.chunksize,
+        quiet=args.quiet,
+    )
+    total = done + failed
+    throughput = total / elapsed if elapsed > 0 else 0.0
+    print(f"完成 {done} 張、失敗 {failed} 張，耗時 {elapsed:.2f} 秒")
+    print(f"吞吐量：{throughput:.2f} images/sec（{args.workers} 個行程）")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+"""Day 1 共用影像來源：範例圖片搜尋 + 解碼快取"""
+from __future__ import annotations
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+import hashlib
+import os
+import sys
+import cv2
+import numpy as np
+
+# Author: harry123180
+
+DAY_DIR = Path(__file__).resolve().parent
+IMAGES_DIR = DAY_DIR / "images"
+
+# 設定此環境變數即可啟用磁碟快取（存放解碼後的 .npy），跨程式執行也能重複使用
+DISK_CACHE_ENV = "DAY1_IMAGE_CACHE"
+# 記憶體快取上限 (MB)，預設 512MB
+MEMORY_LIMIT_ENV = "DAY1_IMAGE_CACHE_MB"
+
+
+def get_sample_image() -> Path:
+    """尋找範例照片並回傳路徑（step01 ~ step06 共用）"""
+    # 優先使用正面打光照片（可看到硬幣細節）
+    candidates = sorted((IMAGES_DIR / "frontlit_detail").glob("*.jpg"))
+    if not candidates:
+        # 備用：背光剪影照片
+        candidates = sorted((IMAGES_DIR / "backlit_silhouette").glob("*.jpg"))
+    if not candidates:
+        raise FileNotFoundError("請在 DAY1/images 資料夾放入範例 JPG 圖片")
+    return candidates[0]
+
+
+@dataclass
+class CacheStats:
+    """快取統計：命中 / 未命中次數與省下的解碼量"""
+
+    memory_hits: int = 0
+    disk_hits: int = 0
+    misses: int = 0
+    decoded_bytes: int = 0  # 實際解碼 JPEG 產生的位元組
+    served_bytes: int = 0   # 由快取直接提供、免解碼的位元組
+
+    @property
+    def hits(self) -> int:
+        return self.memory_hits + self.disk_hits
+
+    def summary(self) -> str:
+        total = self.hits + self.misses
+        ratio = self.hits / total if total else 0.0
+        return (
+            f"影像快取：命中 {self.hits} 次（記憶體 {self.memory_hits} / 磁碟 {self.disk_hits}）"
+            f"、未命中 {self.misses} 次、命中率 {ratio:.0%}、"
+            f"解碼 {self.decoded_bytes / 2**20:.1f} MB、省下 {self.served_bytes / 2**20:.1f} MB"
+        )
+
+
+class ImageCache:
+    """以位元組數為上限的 LRU 快取，可選擇搭配磁碟 .npy 快取
+
+    快取鍵由「絕對路徑 + 修改時間 + 檔案大小 + 讀取旗標」組成，
+    原始檔案被覆寫後會自動失效。回傳的陣列為唯讀，需要在上面繪圖時請先 `.copy()`。
+    """
+
+    def __init__(self, max_bytes: int = 512 * 2**20, disk_dir: Path | None = None) -> None:
+        self.max_bytes = max_bytes
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+        self.stats = CacheStats()
+        self._entries: OrderedDict[tuple, np.ndarray] = OrderedDict()
+        self._current_bytes = 0
+
+    @staticmethod
+    def _make_key(path: Path, flags: int) -> tuple:
+        stat = path.stat()
+        return (str(path.resolve()), stat.st_mtime_ns, stat.st_size, flags)
+
+    def _disk_path(self, key: tuple) -> Path:
+        digest = hashlib.sha1("|".join(map(str, key)).encode("utf-8")).hexdigest()
+        return self.disk_dir / f"{digest}.npy"
+
+    def read(self, path: Path, flags: int = cv2.IMREAD_COLOR) -> np.ndarray:
+        """讀取影像，優先使用記憶體快取，其次磁碟快取，最後才解碼"""
+        path = Path(path)
+        key = self._make_key(path, flags)
+
+        image = self._entries.get(key)
+        if image is not None:
+            self._entries.move_to_end(key)
+            self.stats.memory_hits += 1
+            self.stats.served_bytes += image.nbytes
+            return image
+
+        image = self._load_from_disk(key)
+        if image is not None:
+            self.stats.disk_hits += 1
+            self.stats.served_bytes += image.nbytes
+        else:
+            image = decode_image(path, flags)
+            image.setflags(write=False)
+            self.stats.misses += 1
+            self.stats.decoded_bytes += image.nbytes
+            self._save_to_disk(key, image)
+
+        self._remember(key, image)
+        return image
+
+    def clear(self) -> None:
+        """清空記憶體快取（磁碟快取保留）"""
+        self._entries.clear()
+        self._current_bytes = 0
+
+    def _remember(self, key: tuple, image: np.ndarray) -> None:
+        if image.nbytes > self.max_bytes:
+            return
+        self._entries[key] = image
+        self._current_bytes += image.nbytes
+        # 超過上限時移除最久未使用的項目
+        while self._current_bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._current_bytes -= evicted.nbytes
+
+    def _load_from_disk(self, key: tuple) -> np.ndarray | None:
+        if self.disk_dir is None:
+            return None
+        npy_path = self._disk_path(key)
+        if not npy_path.exists():
+            return None
+        try:
+            # mmap_mode="r"：不需要整份讀進記憶體，由作業系統按需載入
+            return np.load(npy_path, mmap_mode="r")
+        except (OSError, ValueError):
+            # 快取檔損毀就當作沒有，稍後會重新寫入
+            return None
+
+    def _save_to_disk(self, key: tuple, image: np.ndarray) -> None:
+        if self.disk_dir is None:
+            return
+        self.disk_dir.mkdir(parents=True, exist_ok=True)
+        npy_path = self._disk_path(key)
+        tmp_path = npy_path.with_name(f"{npy_path.stem}.{os.getpid()}.tmp")
+        with tmp_path.open("wb") as file:
+            np.save(file, image)
+        # 先寫暫存檔再換名，避免多個程式同時寫入時讀到一半的檔案
+        os.replace(tmp_path, npy_path)
+
+
+def decode_image(path: Path, flags: int = cv2.IMREAD_COLOR) -> np.ndarray:
+    """解碼影像檔；使用 imdecode 以支援含中文的路徑"""
+    data = np.fromfile(str(path), dtype=np.uint8)
+    image = cv2.imdecode(data, flags)
+    if image is None:
+        raise RuntimeError(f"OpenCV 無法讀取這張圖片，請確認檔案是否完整: {Path(path).name}")
+    return image
+
+
+def _default_cache() -> ImageCache:
+    disk_dir = os.environ.get(DISK_CACHE_ENV)
+    max_mb = int(os.environ.get(MEMORY_LIMIT_ENV, "512"))
+    return ImageCache(max_bytes=max_mb * 2**20, disk_dir=Path(disk_dir) if disk_dir else None)
+
+
+IMAGE_CACHE = _default_cache()
+
+
+def read_image(path: Path, flags: int = cv2.IMREAD_COLOR) -> np.ndarray:
+    """透過共用快取讀取影像（回傳唯讀陣列）"""
+    return IMAGE_CACHE.read(path, flags)
+
+
+def report_cache_stats() -> None:
+    """啟用磁碟快取時，印出本次執行的快取統計"""
+    if IMAGE_CACHE.disk_dir is not None:
+        print(IMAGE_CACHE.stats.summary())
+
+
+def main() -> None:
+    """預熱快取：python image_source.py [資料夾...]，每張圖讀兩次並顯示統計"""
+    folders = [Path(arg) for arg in sys.argv[1:]] or [IMAGES_DIR / "frontlit_detail"]
+    paths = [p for folder in folders for p in sorted(folder.glob("*.jpg"))]
+    if not paths:
+        raise FileNotFoundError("指定的資料夾中沒有 JPG 圖片")
+
+    for _ in range(2):
+        for path in paths:
+            read_image(path)
+    print(IMAGE_CACHE.stats.summary())
+
+
+if __name__ == "__main__":
+    main()
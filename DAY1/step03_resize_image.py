@@ -1,34 +1,27 @@
 """Day 1 Step 03: 調整影像尺寸"""
 from pathlib import Path
 import cv2
+import numpy as np
 
-# Author: harry123180
-
-
-def get_sample_image() -> Path:
-    day_dir = Path(__file__).resolve().parent
-    images_dir = day_dir / "images"
-
-    candidates = list((images_dir / "frontlit_detail").glob("*.jpg"))
-    if not candidates:
-        candidates = list((images_dir / "backlit_silhouette").glob("*.jpg"))
-    if not candidates:
-        raise FileNotFoundError("找不到範例圖片，請放入一張 JPG")
-    return candidates[0]
+from image_source import get_sample_image, read_image, report_cache_stats
 
+# Author: harry123180
 
-def resize_image(image_path: Path, output_dir: Path, width: int = 640) -> Path:
-    """將影像等比例縮放到指定寬度"""
-    image = cv2.imread(str(image_path))
-    if image is None:
-        raise RuntimeError("讀取圖片失敗")
 
+def resize_to_width(image: np.ndarray, width: int = 640) -> np.ndarray:
+    """將影像陣列等比例縮放到指定寬度"""
     height, original_width = image.shape[:2]
     scale = width / original_width
     target_size = (width, int(height * scale))
 
     # 使用 INTER_AREA 可得到較柔和平滑的縮圖
-    resized = cv2.resize(image, target_size, interpolation=cv2.INTER_AREA)
+    return cv2.resize(image, target_size, interpolation=cv2.INTER_AREA)
+
+
+def resize_image(image_path: Path, output_dir: Path, width: int = 640) -> Path:
+    """將影像等比例縮放到指定寬度"""
+    image = read_image(image_path)
+    resized = resize_to_width(image, width)
 
     output_path = output_dir / "step03_resized.png"
     cv2.imwrite(str(output_path), resized)
@@ -43,6 +36,7 @@ def main() -> None:
     image_path = get_sample_image()
     result_path = resize_image(image_path, output_dir)
     print(f"縮圖已存成 {result_path}")
+    report_cache_stats()
 
 
 if __name__ == "__main__":
@@ -2,19 +2,9 @@
 from pathlib import Path
 import cv2
 
-# Author: harry123180
-
+from image_source import get_sample_image, read_image, report_cache_stats
 
-def get_sample_image() -> Path:
-    day_dir = Path(__file__).resolve().parent
-    images_dir = day_dir / "images"
-
-    candidates = list((images_dir / "frontlit_detail").glob("*.jpg"))
-    if not candidates:
-        candidates = list((images_dir / "backlit_silhouette").glob("*.jpg"))
-    if not candidates:
-        raise FileNotFoundError("找不到範例圖片，請放一張 JPG")
-    return candidates[0]
+# Author: harry123180
 
 
 def main() -> None:
@@ -23,9 +13,8 @@ def main() -> None:
     output_dir.mkdir(exist_ok=True)
 
     image_path = get_sample_image()
-    image = cv2.imread(str(image_path))
-    if image is None:
-        raise RuntimeError("無法讀取圖片")
+    # 快取回傳唯讀陣列，要在上面繪圖需先複製一份
+    image = read_image(image_path).copy()
 
     # 繪製矩形框出主要物件
     height, width = image.shape[:2]
@@ -40,6 +29,7 @@ def main() -> None:
     output_path = output_dir / "step04_drawn.png"
     cv2.imwrite(str(output_path), image)
     print(f"已繪製圖形並輸出到 {output_path}")
+    report_cache_stats()
 
 
 if __name__ == "__main__":
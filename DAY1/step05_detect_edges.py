@@ -1,20 +1,18 @@
 """Day 1 Step 05: 邊緣偵測"""
 from pathlib import Path
 import cv2
+import numpy as np
 
-# Author: harry123180
+from image_source import get_sample_image, read_image, report_cache_stats
 
+# Author: harry123180
 
-def get_sample_image() -> Path:
-    day_dir = Path(__file__).resolve().parent
-    images_dir = day_dir / "images"
 
-    candidates = list((images_dir / "frontlit_detail").glob("*.jpg"))
-    if not candidates:
-        candidates = list((images_dir / "backlit_silhouette").glob("*.jpg"))
-    if not candidates:
-        raise FileNotFoundError("缺少測試圖片")
-    return candidates[0]
+def detect_edges(gray: np.ndarray) -> np.ndarray:
+    """灰階影像 → Canny 邊緣圖"""
+    # 先做輕微模糊降低雜訊
+    blurred = cv2.GaussianBlur(gray, (5, 5), 0)
+    return cv2.Canny(blurred, 80, 160)
 
 
 def main() -> None:
@@ -23,17 +21,13 @@ def main() -> None:
     output_dir.mkdir(exist_ok=True)
 
     image_path = get_sample_image()
-    image = cv2.imread(str(image_path), cv2.IMREAD_GRAYSCALE)
-    if image is None:
-        raise RuntimeError("無法載入圖片")
-
-    # 先做輕微模糊降低雜訊
-    blurred = cv2.GaussianBlur(image, (5, 5), 0)
-    edges = cv2.Canny(blurred, 80, 160)
+    image = read_image(image_path, cv2.IMREAD_GRAYSCALE)
+    edges = detect_edges(image)
 
     output_path = output_dir / "step05_edges.png"
     cv2.imwrite(str(output_path), edges)
     print(f"邊緣檢測結果已存成 {output_path}")
+    report_cache_stats()
 
 
 if __name__ == "__main__":
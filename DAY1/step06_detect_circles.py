@@ -1,63 +1,191 @@
 """Day 1 Step 06: 簡易圓形偵測"""
 from pathlib import Path
+import argparse
+import time
 import cv2
 import numpy as np
 
-# Author: harry123180
+from image_source import IMAGES_DIR, get_sample_image, read_image, report_cache_stats
 
+# Author: harry123180
 
-def get_sample_image() -> Path:
-    day_dir = Path(__file__).resolve().parent
-    images_dir = day_dir / "images"
+# HoughCircles 參數（全解析度）
+MIN_DIST = 40
+CANNY_HIGH = 120
+ACCUMULATOR_THRESHOLD = 35
+MIN_RADIUS = 10
+MAX_RADIUS = 200
 
-    # 優先使用正面打光照片
-    candidates = list((images_dir / "frontlit_detail").glob("*.jpg"))
-    if not candidates:
-        candidates = list((images_dir / "backlit_silhouette").glob("*.jpg"))
-    if not candidates:
-        raise FileNotFoundError("請準備一張含有圓形物件的照片")
-    return candidates[0]
+# 金字塔模式：縮圖上的累加器閾值（圓周像素變少，票數也跟著變少）
+COARSE_ACCUMULATOR_THRESHOLD = 20
 
 
-def main() -> None:
-    day_dir = Path(__file__).resolve().parent
-    output_dir = day_dir / "output"
-    output_dir.mkdir(exist_ok=True)
+def find_circles(blurred: np.ndarray) -> np.ndarray:
+    """全解析度霍夫圓偵測，回傳 N x 3 陣列 (x, y, r)"""
+    circles = cv2.HoughCircles(
+        blurred,
+        cv2.HOUGH_GRADIENT,
+        dp=1.2,
+        minDist=MIN_DIST,
+        param1=CANNY_HIGH,
+        param2=ACCUMULATOR_THRESHOLD,
+        minRadius=MIN_RADIUS,
+        maxRadius=MAX_RADIUS,
+    )
+    if circles is None:
+        return np.empty((0, 3), dtype=np.float32)
+    return circles[0]
 
-    image_path = get_sample_image()
-    image = cv2.imread(str(image_path))
-    if image is None:
-        raise RuntimeError("讀取圖片失敗")
 
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    blurred = cv2.GaussianBlur(gray, (9, 9), 2)
+def find_circles_pyramid(blurred: np.ndarray, scale: float = 0.25) -> np.ndarray:
+    """先在縮圖上粗找圓，再回到原圖的小視窗內精修圓心與半徑
 
-    # 使用 HoughCircles 偵測圓形
-    circles = cv2.HoughCircles(
-        blurred,
+    精修時沿用全解析度的參數，找不到圓的候選會被捨棄，
+    因此縮圖上的誤判也會在這一步被過濾掉。
+    兩個候選可能精修到同一個圓，最後再依縮圖上的票數順序套用一次 MIN_DIST，
+    與全解析度 HoughCircles 的 minDist 規則相同。
+    """
+    small = cv2.resize(blurred, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    coarse = cv2.HoughCircles(
+        small,
         cv2.HOUGH_GRADIENT,
         dp=1.2,
-        minDist=40,
-        param1=120,
-        param2=35,
-        minRadius=10,
-        maxRadius=200,
+        minDist=max(MIN_DIST * scale, 1.0),
+        param1=CANNY_HIGH,
+        param2=COARSE_ACCUMULATOR_THRESHOLD,
+        minRadius=max(int(MIN_RADIUS * scale), 1),
+        maxRadius=int(np.ceil(MAX_RADIUS * scale)),
     )
+    if coarse is None:
+        return np.empty((0, 3), dtype=np.float32)
+
+    # 縮圖上 1 個像素的誤差，放大回原圖約是 1/scale 個像素
+    tolerance = int(np.ceil(2 / scale)) + 2
+    height, width = blurred.shape[:2]
+    refined = []
+    for x, y, r in coarse[0] / scale:
+        min_radius = max(MIN_RADIUS, int(r) - tolerance)
+        max_radius = min(MAX_RADIUS, int(r) + tolerance)
+        half = max_radius + tolerance
+        x0, y0 = max(0, int(x) - half), max(0, int(y) - half)
+        x1, y1 = min(width, int(x) + half + 1), min(height, int(y) + half + 1)
+        window = blurred[y0:y1, x0:x1]
+
+        circles = cv2.HoughCircles(
+            window,
+            cv2.HOUGH_GRADIENT,
+            dp=1.2,
+            minDist=max(window.shape),  # 每個視窗只取一個圓
+            param1=CANNY_HIGH,
+            param2=ACCUMULATOR_THRESHOLD,
+            minRadius=min_radius,
+            maxRadius=max_radius,
+        )
+        if circles is None:
+            continue
+        cx, cy, cr = circles[0][0]
+        cx, cy = cx + x0, cy + y0
+        # HoughCircles 依票數由高到低輸出，先保留的圓優先
+        if any((cx - kx) ** 2 + (cy - ky) ** 2 < MIN_DIST ** 2 for kx, ky, _ in refined):
+            continue
+        refined.append((cx, cy, cr))
+    return np.array(refined, dtype=np.float32).reshape(-1, 3)
+
+
+def _prepare(image: np.ndarray) -> np.ndarray:
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    return cv2.GaussianBlur(gray, (9, 9), 2)
+
+
+def detect_circles(image: np.ndarray, pyramid: bool = False,
+                   scale: float = 0.25) -> tuple[np.ndarray, int]:
+    """偵測圓形並回傳 (標註後影像, 圓形數量)"""
+    blurred = _prepare(image)
+    circles = find_circles_pyramid(blurred, scale) if pyramid else find_circles(blurred)
 
     annotated = image.copy()
     count = 0
-    if circles is not None:
-        for circle in np.round(circles[0]).astype(int):
-            count += 1
-            center = (circle[0], circle[1])
-            radius = circle[2]
-            cv2.circle(annotated, center, radius, (0, 255, 0), 2)
-            cv2.circle(annotated, center, 3, (0, 0, 255), -1)
+    for circle in np.round(circles).astype(int):
+        count += 1
+        center = (circle[0], circle[1])
+        radius = circle[2]
+        cv2.circle(annotated, center, radius, (0, 255, 0), 2)
+        cv2.circle(annotated, center, 3, (0, 0, 255), -1)
+    return annotated, count
+
+
+def _count_matches(reference: np.ndarray, candidates: np.ndarray) -> int:
+    """計算 candidates 中有幾個圓心落在 reference 某個圓的 20% 半徑內"""
+    if len(reference) == 0 or len(candidates) == 0:
+        return 0
+    distance = np.hypot(
+        candidates[:, None, 0] - reference[None, :, 0],
+        candidates[:, None, 1] - reference[None, :, 1],
+    )
+    limit = np.maximum(0.2 * reference[None, :, 2], 5.0)
+    return int(np.any(distance <= limit, axis=1).sum())
+
+
+def compare_modes(scale: float = 0.25) -> None:
+    """在附帶的硬幣照片上比較全解析度與金字塔模式的數量與耗時"""
+    paths = sorted((IMAGES_DIR / "frontlit_detail").glob("*.jpg"))
+    paths += sorted((IMAGES_DIR / "backlit_silhouette").glob("*.jpg"))
+    if not paths:
+        raise FileNotFoundError("請準備含有圓形物件的照片")
+
+    total_full = total_pyramid = 0.0
+    same_count = 0
+    for path in paths:
+        blurred = _prepare(read_image(path))
+
+        start = time.perf_counter()
+        full = find_circles(blurred)
+        full_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        coarse = find_circles_pyramid(blurred, scale)
+        pyramid_time = time.perf_counter() - start
+
+        total_full += full_time
+        total_pyramid += pyramid_time
+        same_count += len(full) == len(coarse)
+        matches = _count_matches(full, coarse)
+        print(f"{path.name}: 全解析 {len(full)} 個 ({full_time * 1000:.0f} ms) / "
+              f"金字塔 {len(coarse)} 個 ({pyramid_time * 1000:.0f} ms)，吻合 {matches} 個")
+
+    print(f"數量一致：{same_count}/{len(paths)} 張")
+    print(f"總耗時：全解析 {total_full:.2f}s / 金字塔 {total_pyramid:.2f}s，"
+          f"加速 {total_full / max(total_pyramid, 1e-9):.1f}x")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Day1 Step06 霍夫圓形偵測")
+    parser.add_argument("--pyramid", action="store_true", help="使用縮圖粗找 + 原圖精修模式")
+    parser.add_argument("--scale", type=float, default=0.25, help="金字塔模式的縮圖比例")
+    parser.add_argument("--compare", action="store_true",
+                        help="在範例硬幣照片上比較全解析度與金字塔模式")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    if args.compare:
+        compare_modes(args.scale)
+        return
+
+    day_dir = Path(__file__).resolve().parent
+    output_dir = day_dir / "output"
+    output_dir.mkdir(exist_ok=True)
+
+    image_path = get_sample_image()
+    image = read_image(image_path)
+    annotated, count = detect_circles(image, pyramid=args.pyramid, scale=args.scale)
     print(f"偵測到 {count} 個圓形")
 
     output_path = output_dir / "step06_circles.png"
     cv2.imwrite(str(output_path), annotated)
     print(f"結果已輸出到 {output_path}")
+    report_cache_stats()
 
 
 if __name__ == "__main__":
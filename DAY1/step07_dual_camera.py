@@ -1,46 +1,296 @@
 """Day 1 Step 07: 雙攝影機 + Mediapipe (FaceMesh & Pose)"""
+from __future__ import annotations
+from dataclasses import dataclass
+from typing import Callable
+import argparse
+import threading
+import time
 import cv2
 import numpy as np
 import mediapipe as mp
 
 # Author: harry123180
 
+# 設定統一的畫面大小
+DISPLAY_WIDTH = 640
+DISPLAY_HEIGHT = 480
 
-def main() -> None:
-    """Camera 0: FaceMesh 臉部網格 / Camera 1: Pose 姿勢骨架"""
+mp_face_mesh = mp.solutions.face_mesh
+mp_pose = mp.solutions.pose
+mp_drawing = mp.solutions.drawing_utils
+mp_drawing_styles = mp.solutions.drawing_styles
+
+
+@dataclass
+class Frame:
+    """一張畫面與它的擷取序號、擷取時間"""
+
+    image: np.ndarray
+    seq: int
+    timestamp: float
+
+
+class LatestFrameSlot:
+    """只保留最新一張畫面的交換區：新畫面直接覆蓋舊畫面（舊的就丟掉）"""
+
+    def __init__(self) -> None:
+        self._condition = threading.Condition()
+        self._frame: Frame | None = None
+        self._last_taken_seq = -1
+        self.dropped = 0  # 還沒被取走就被覆蓋的畫面數
+
+    def put(self, frame: Frame) -> None:
+        with self._condition:
+            if self._frame is not None and self._frame.seq > self._last_taken_seq:
+                self.dropped += 1
+            self._frame = frame
+            self._condition.notify_all()
+
+    def get_newer(self, seq: int, timeout: float = 0.5) -> Frame | None:
+        """等待序號大於 seq 的畫面，逾時回傳 None"""
+        with self._condition:
+            self._condition.wait_for(
+                lambda: self._frame is not None and self._frame.seq > seq, timeout=timeout
+            )
+            if self._frame is None or self._frame.seq <= seq:
+                return None
+            self._last_taken_seq = self._frame.seq
+            return self._frame
+
+    def peek(self) -> Frame | None:
+        """不等待，直接取目前最新的畫面"""
+        with self._condition:
+            return self._frame
+
+
+class FpsMeter:
+    """以指數移動平均計算每秒張數"""
+
+    def __init__(self, smoothing: float = 0.9) -> None:
+        self.smoothing = smoothing
+        self.fps = 0.0
+        self._last: float | None = None
+
+    def tick(self) -> None:
+        now = time.perf_counter()
+        if self._last is not None and now > self._last:
+            current = 1.0 / (now - self._last)
+            self.fps = current if self.fps == 0 else self.fps * self.smoothing + current * (1 - self.smoothing)
+        self._last = now
+
+
+def parse_source(text: str) -> int | str:
+    """數字視為攝影機編號，其餘視為影片路徑"""
+    return int(text) if text.isdigit() else text
+
+
+class CaptureThread(threading.Thread):
+    """持續擷取畫面並放進 LatestFrameSlot；影片檔會依原始 FPS 播放並循環"""
+
+    def __init__(self, source: int | str, slot: LatestFrameSlot, stop_event: threading.Event) -> None:
+        super().__init__(daemon=True)
+        self.source = source
+        self.slot = slot
+        self.stop_event = stop_event
+        self.fps = FpsMeter()
+        self.capture = cv2.VideoCapture(source)
+        self.is_file = isinstance(source, str)
+        file_fps = self.capture.get(cv2.CAP_PROP_FPS) if self.is_file else 0
+        self.frame_interval = 1.0 / file_fps if file_fps > 0 else 0.0
+
+    def is_opened(self) -> bool:
+        return self.capture.isOpened()
+
+    def run(self) -> None:
+        seq = 0
+        frames_since_rewind = 0
+        next_time = time.perf_counter()
+        while not self.stop_event.is_set():
+            ok, image = self.capture.read()
+            if not ok:
+                if self.is_file and frames_since_rewind:
+                    # 影片播完就從頭開始，方便沒有攝影機時測試
+                    self.capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                    frames_since_rewind = 0
+                    continue
+                # 攝影機斷線，或影片從頭開始仍讀不到任何畫面（空檔、損毀、無法倒帶），
+                # 直接結束，不要無限重試把 CPU 吃滿
+                kind = "影片" if self.is_file else "攝影機"
+                print(f"{kind} {self.source} 讀取失敗")
+                self.stop_event.set()
+                break
+            frames_since_rewind += 1
+
+            if self.frame_interval:
+                # 模擬攝影機的固定幀率，避免影片檔被以最快速度讀完
+                next_time += self.frame_interval
+                delay = next_time - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    next_time = time.perf_counter()
+
+            seq += 1
+            self.slot.put(Frame(image, seq, time.perf_counter()))
+            self.fps.tick()
+        self.capture.release()
+
+
+class InferenceWorker(threading.Thread):
+    """從擷取區拿最新畫面做推論與繪製，結果放進自己的輸出區"""
 
-    # 初始化 Mediapipe 模組
-    mp_face_mesh = mp.solutions.face_mesh
-    mp_pose = mp.solutions.pose
-    mp_drawing = mp.solutions.drawing_utils
-    mp_drawing_styles = mp.solutions.drawing_styles
+    def __init__(
+        self,
+        name: str,
+        source_slot: LatestFrameSlot,
+        create_model: Callable[[], object],
+        annotate: Callable[[object, np.ndarray], None],
+        stop_event: threading.Event,
+    ) -> None:
+        super().__init__(daemon=True)
+        self.label = name
+        self.source_slot = source_slot
+        self.output_slot = LatestFrameSlot()
+        self.create_model = create_model
+        self.annotate = annotate
+        self.stop_event = stop_event
+        self.fps = FpsMeter()
 
-    # 建立 FaceMesh 和 Pose 偵測器
-    face_mesh = mp_face_mesh.FaceMesh(
+    def run(self) -> None:
+        # Mediapipe 模型在工作執行緒內建立與使用
+        model = self.create_model()
+        last_seq = 0
+        try:
+            while not self.stop_event.is_set():
+                frame = self.source_slot.get_newer(last_seq)
+                if frame is None:
+                    continue
+                last_seq = frame.seq
+
+                # 統一縮放到相同尺寸（resize 會產生新陣列，不會改到擷取區的畫面）
+                image = cv2.resize(frame.image, (DISPLAY_WIDTH, DISPLAY_HEIGHT))
+                # 轉換 BGR -> RGB (Mediapipe 需要 RGB)
+                rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+                rgb.flags.writeable = False  # 提升效能
+                results = model.process(rgb)
+                self.annotate(results, image)
+
+                self.output_slot.put(Frame(image, frame.seq, frame.timestamp))
+                self.fps.tick()
+        finally:
+            model.close()
+
+
+def create_face_mesh():
+    return mp_face_mesh.FaceMesh(
         max_num_faces=1,
         refine_landmarks=True,  # 包含眼睛和嘴唇細節
         min_detection_confidence=0.5,
         min_tracking_confidence=0.5
     )
 
-    pose = mp_pose.Pose(
+
+def create_pose():
+    return mp_pose.Pose(
         min_detection_confidence=0.5,
         min_tracking_confidence=0.5
     )
 
-    # 開啟兩個攝影機 (0=內建, 1=外接)
-    camera_0 = cv2.VideoCapture(0)
-    camera_1 = cv2.VideoCapture(1)
+
+def draw_face_mesh(face_results, frame: np.ndarray) -> None:
+    """繪製 FaceMesh 網格、輪廓與虹膜"""
+    if not face_results.multi_face_landmarks:
+        return
+    for face_landmarks in face_results.multi_face_landmarks:
+        # 繪製臉部網格
+        mp_drawing.draw_landmarks(
+            image=frame,
+            landmark_list=face_landmarks,
+            connections=mp_face_mesh.FACEMESH_TESSELATION,
+            landmark_drawing_spec=None,
+            connection_drawing_spec=mp_drawing_styles.get_default_face_mesh_tesselation_style()
+        )
+        # 繪製臉部輪廓
+        mp_drawing.draw_landmarks(
+            image=frame,
+            landmark_list=face_landmarks,
+            connections=mp_face_mesh.FACEMESH_CONTOURS,
+            landmark_drawing_spec=None,
+            connection_drawing_spec=mp_drawing_styles.get_default_face_mesh_contours_style()
+        )
+        # 繪製眼睛虹膜
+        mp_drawing.draw_landmarks(
+            image=frame,
+            landmark_list=face_landmarks,
+            connections=mp_face_mesh.FACEMESH_IRISES,
+            landmark_drawing_spec=None,
+            connection_drawing_spec=mp_drawing_styles.get_default_face_mesh_iris_connections_style()
+        )
+
+
+def draw_pose(pose_results, frame: np.ndarray) -> None:
+    """繪製 Pose 骨架"""
+    if pose_results.pose_landmarks:
+        mp_drawing.draw_landmarks(
+            image=frame,
+            landmark_list=pose_results.pose_landmarks,
+            connections=mp_pose.POSE_CONNECTIONS,
+            landmark_drawing_spec=mp_drawing_styles.get_default_pose_landmarks_style()
+        )
+
+
+def _panel(worker: InferenceWorker, capture: CaptureThread, color: tuple[int, int, int]) -> np.ndarray:
+    """取出某一路最新的結果並加上標籤與 FPS"""
+    frame = worker.output_slot.peek()
+    if frame is None:
+        panel = np.zeros((DISPLAY_HEIGHT, DISPLAY_WIDTH, 3), dtype=np.uint8)
+        cv2.putText(panel, f"{worker.label}: waiting...", (10, 30),
+                    cv2.FONT_HERSHEY_SIMPLEX, 1, color, 2)
+        return panel
+
+    panel = frame.image.copy()
+    cv2.putText(panel, worker.label, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, color, 2)
+    stats = (f"cap {capture.fps.fps:4.1f} fps / infer {worker.fps.fps:4.1f} fps / "
+             f"drop {capture.slot.dropped}")
+    cv2.putText(panel, stats, (10, DISPLAY_HEIGHT - 15),
+                cv2.FONT_HERSHEY_SIMPLEX, 0.55, color, 1)
+    return panel
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="雙攝影機 + Mediapipe (FaceMesh & Pose)")
+    parser.add_argument("source0", nargs="?", default="0",
+                        help="FaceMesh 來源：攝影機編號或影片路徑（預設 0）")
+    parser.add_argument("source1", nargs="?", default="1",
+                        help="Pose 來源：攝影機編號或影片路徑（預設 1）")
+    return parser.parse_args()
+
+
+def main() -> None:
+    """Camera 0: FaceMesh 臉部網格 / Camera 1: Pose 姿勢骨架"""
+    args = parse_args()
+    stop_event = threading.Event()
+
+    # 每一路都有自己的擷取執行緒，慢的 FaceMesh 不會拖慢 Pose
+    capture_0 = CaptureThread(parse_source(args.source0), LatestFrameSlot(), stop_event)
+    capture_1 = CaptureThread(parse_source(args.source1), LatestFrameSlot(), stop_event)
 
     # 檢查攝影機是否成功開啟
-    if not camera_0.isOpened():
-        print("錯誤：無法開啟攝影機 0 (內建)")
+    if not capture_0.is_opened():
+        print(f"錯誤：無法開啟來源 0 ({args.source0})")
+        capture_1.capture.release()
         return
-    if not camera_1.isOpened():
-        print("錯誤：無法開啟攝影機 1 (外接)")
-        camera_0.release()
+    if not capture_1.is_opened():
+        print(f"錯誤：無法開啟來源 1 ({args.source1})")
+        capture_0.capture.release()
         return
 
+    worker_0 = InferenceWorker("FaceMesh", capture_0.slot, create_face_mesh, draw_face_mesh, stop_event)
+    worker_1 = InferenceWorker("Pose", capture_1.slot, create_pose, draw_pose, stop_event)
+    threads = [capture_0, capture_1, worker_0, worker_1]
+    for thread in threads:
+        thread.start()
+
     print("=" * 50)
     print("雙攝影機 + Mediapipe 已啟動")
     print("Camera 0: FaceMesh 臉部網格偵測")
@@ -49,83 +299,13 @@ def main() -> None:
     print("按 ESC 關閉程式")
     print("按 'v' 切換垂直/水平排列")
 
-    # 設定統一的畫面大小
-    display_width = 640
-    display_height = 480
-
     # 排列模式：True=水平並排, False=垂直堆疊
     horizontal_mode = True
 
-    while True:
-        # 讀取兩個攝影機的畫面
-        success_0, frame_0 = camera_0.read()
-        success_1, frame_1 = camera_1.read()
-
-        # 如果任一攝影機讀取失敗就跳出
-        if not success_0 or not success_1:
-            print("攝影機讀取失敗")
-            break
-
-        # 統一縮放到相同尺寸
-        frame_0 = cv2.resize(frame_0, (display_width, display_height))
-        frame_1 = cv2.resize(frame_1, (display_width, display_height))
-
-        # ===== Camera 0: FaceMesh 處理 =====
-        # 轉換 BGR -> RGB (Mediapipe 需要 RGB)
-        rgb_0 = cv2.cvtColor(frame_0, cv2.COLOR_BGR2RGB)
-        rgb_0.flags.writeable = False  # 提升效能
-        face_results = face_mesh.process(rgb_0)
-        rgb_0.flags.writeable = True
-
-        # 繪製 FaceMesh 網格
-        if face_results.multi_face_landmarks:
-            for face_landmarks in face_results.multi_face_landmarks:
-                # 繪製臉部網格
-                mp_drawing.draw_landmarks(
-                    image=frame_0,
-                    landmark_list=face_landmarks,
-                    connections=mp_face_mesh.FACEMESH_TESSELATION,
-                    landmark_drawing_spec=None,
-                    connection_drawing_spec=mp_drawing_styles.get_default_face_mesh_tesselation_style()
-                )
-                # 繪製臉部輪廓
-                mp_drawing.draw_landmarks(
-                    image=frame_0,
-                    landmark_list=face_landmarks,
-                    connections=mp_face_mesh.FACEMESH_CONTOURS,
-                    landmark_drawing_spec=None,
-                    connection_drawing_spec=mp_drawing_styles.get_default_face_mesh_contours_style()
-                )
-                # 繪製眼睛虹膜
-                mp_drawing.draw_landmarks(
-                    image=frame_0,
-                    landmark_list=face_landmarks,
-                    connections=mp_face_mesh.FACEMESH_IRISES,
-                    landmark_drawing_spec=None,
-                    connection_drawing_spec=mp_drawing_styles.get_default_face_mesh_iris_connections_style()
-                )
-
-        # ===== Camera 1: Pose 處理 =====
-        # 轉換 BGR -> RGB
-        rgb_1 = cv2.cvtColor(frame_1, cv2.COLOR_BGR2RGB)
-        rgb_1.flags.writeable = False
-        pose_results = pose.process(rgb_1)
-        rgb_1.flags.writeable = True
-
-        # 繪製 Pose 骨架
-        if pose_results.pose_landmarks:
-            mp_drawing.draw_landmarks(
-                image=frame_1,
-                landmark_list=pose_results.pose_landmarks,
-                connections=mp_pose.POSE_CONNECTIONS,
-                landmark_drawing_spec=mp_drawing_styles.get_default_pose_landmarks_style()
-            )
-
-        # 在畫面上加入標籤
-        cv2.putText(frame_0, "FaceMesh", (10, 30),
-                    cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
-        cv2.putText(frame_1, "Pose", (10, 30),
-                    cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 255), 2)
+    # 主執行緒只負責拼接與顯示，永遠拿兩路「目前最新」的結果
+    while not stop_event.is_set():
+        frame_0 = _panel(worker_0, capture_0, (0, 255, 0))
+        frame_1 = _panel(worker_1, capture_1, (0, 255, 255))
 
         # 根據模式拼接畫面
         if horizontal_mode:
@@ -135,11 +315,18 @@ def main() -> None:
             # 垂直堆疊 (上下)
             combined = np.vstack([frame_0, frame_1])
 
+        # 兩路畫面的擷取時間差，數值越大代表兩支攝影機越不同步
+        latest_0, latest_1 = worker_0.output_slot.peek(), worker_1.output_slot.peek()
+        if latest_0 is not None and latest_1 is not None:
+            skew_ms = abs(latest_0.timestamp - latest_1.timestamp) * 1000
+            cv2.putText(combined, f"skew {skew_ms:5.0f} ms", (combined.shape[1] - 200, 30),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
+
         # 顯示整合後的畫面
         cv2.imshow("Dual Camera - FaceMesh & Pose", combined)
 
         # 按鍵處理
-        key = cv2.waitKey(1) & 0xFF
+        key = cv2.waitKey(10) & 0xFF
         if key == 27:  # ESC 離開
             break
         elif key == ord('v'):  # 切換排列模式
@@ -148,10 +335,9 @@ def main() -> None:
             print(f"切換為: {mode_name}")
 
     # 釋放資源
-    face_mesh.close()
-    pose.close()
-    camera_0.release()
-    camera_1.release()
+    stop_event.set()
+    for thread in threads:
+        thread.join(timeout=2)
     cv2.destroyAllWindows()
     print("程式結束")
 
@@ -1,5 +1,8 @@
 ﻿"""Day 2：即時 Pose 偵測 Demo"""
 from __future__ import annotations
+from pathlib import Path
+import argparse
+import sys
 
 # Author: harry123180
 
@@ -9,27 +12,64 @@ try:
 except ImportError as exc:  # pragma: no cover
     raise SystemExit("請先安裝 opencv-python 與 mediapipe 套件") from exc
 
+# 共用 tools/frame_bus.py：可改從共享記憶體匯流排讀取畫面
+sys.path.append(str(Path(__file__).resolve().parent.parent / "tools"))
+from frame_bus import open_source  # noqa: E402
+from pose_roi import RoiPoseTracker  # noqa: E402
+from stage_timer import StageTimer  # noqa: E402
+
+STAGES = ("read", "convert", "pose", "draw", "display")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="即時 Pose 骨架 Demo")
+    parser.add_argument("source", nargs="?", default=None,
+                        help="來源：攝影機編號、影片路徑或 bus:cam0（預設攝影機 0）")
+    parser.add_argument("--roi", action="store_true",
+                        help="依上一格骨架裁切 ROI 再推論，追蹤遺失時改回全畫面")
+    parser.add_argument("--stats", action="store_true",
+                        help="一開始就顯示各階段耗時 p50/p95/p99（執行中按 s 切換）")
+    parser.add_argument("--timing-json", type=Path,
+                        default=Path(__file__).resolve().parent / "pose_live_timing.json",
+                        help="結束時輸出各階段耗時統計的 JSON 路徑")
+    return parser.parse_args()
+
 
 def main() -> None:
     """使用攝影機偵測人體骨架"""
+    args = parse_args()
     # 建立 Mediapipe Pose 模型
     pose = mp.solutions.pose.Pose()
     drawing = mp.solutions.drawing_utils
+    tracker = RoiPoseTracker(pose) if args.roi else None
 
-    cap = cv2.VideoCapture(0)
+    # 參數可指定來源：攝影機編號、影片路徑或 bus:cam0
+    cap = open_source(args.source)
     if not cap.isOpened():
         raise RuntimeError("找不到攝影機，請確認是否已連接")
 
-    print("按下 ESC 結束 Demo")
+    # 分段計時：讀取、色彩轉換、推論、繪圖、顯示（ROI 模式的色彩轉換算在 pose 內）
+    timer = StageTimer(STAGES)
+    show_stats = args.stats
+
+    print("按下 ESC 結束 Demo，按 s 切換耗時統計")
     while True:
+        timer.start_frame()
         ok, frame = cap.read()
+        timer.lap("read")
         if not ok:
             print("讀取畫面失敗，結束程式")
             break
 
-        # Mediapipe 需要 RGB 影像
-        rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        result = pose.process(rgb)
+        if tracker is not None:
+            result = tracker.process(frame)
+        else:
+            # Mediapipe 需要 RGB 影像
+            rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            timer.lap("convert")
+            result = pose.process(rgb)
+        timer.lap("pose")
+        latency_ms = timer.current_ms("convert") + timer.current_ms("pose")
 
         # 將骨架畫在原始畫面上
         if result.pose_landmarks:
@@ -38,14 +78,37 @@ def main() -> None:
                 result.pose_landmarks,
                 mp.solutions.pose.POSE_CONNECTIONS,
             )
+        if tracker is not None:
+            tracker.draw_roi(frame)
+        mode = "ROI" if tracker is not None and tracker.roi is not None else "Full"
+        cv2.putText(frame, f"Pose ({mode}): {latency_ms:5.1f} ms", (20, 30),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 0), 2)
+        if show_stats:
+            timer.draw_overlay(frame)
+        timer.lap("draw")
 
         cv2.imshow("Pose Live", frame)
-        if cv2.waitKey(1) & 0xFF == 27:  # 27 = ESC
+        key = cv2.waitKey(1) & 0xFF
+        timer.lap("display")
+        timer.end_frame()
+        if key == 27:  # 27 = ESC
             break
+        if key == ord("s"):
+            show_stats = not show_stats
 
     cap.release()
     cv2.destroyAllWindows()
 
+    if timer.frames:
+        summary = timer.dump(args.timing_json)
+        print(f"共 {summary['frames']} 格，平均 {summary['fps']} FPS，"
+              f"計時器負擔 {summary['timer_overhead_pct']}%")
+        for name, entry in summary["stages"].items():
+            if "p50_ms" in entry:
+                print(f"  {name:8s} p50 {entry['p50_ms']:6.2f}  p95 {entry['p95_ms']:6.2f}  "
+                      f"p99 {entry['p99_ms']:6.2f} ms")
+        print(f"耗時統計已輸出到 {args.timing_json}")
+
 
 if __name__ == "__main__":
     main()
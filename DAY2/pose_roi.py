@@ -0,0 +1,216 @@
+"""Day 2：依上一格關節點裁切 ROI 再跑 Pose"""
+from __future__ import annotations
+from pathlib import Path
+import argparse
+import time
+
+# Author: harry123180
+
+try:
+    import cv2
+    import mediapipe as mp
+    import numpy as np
+except ImportError as exc:  # pragma: no cover
+    raise SystemExit("請先安裝 opencv-python、mediapipe 與 numpy 套件") from exc
+
+# 關節點外框四周各加上外框長寬的比例，作為裁切範圍
+ROI_MARGIN = 0.35
+# 外框超出 ROI 內縮這個比例的範圍時，重新決定 ROI 大小
+ROI_KEEP_MARGIN = 0.05
+# 外框面積小於 ROI 的這個比例時重新縮小 ROI
+ROI_SHRINK_RATIO = 0.15
+# 可見度高於此值的關節點才用來計算外框
+MIN_VISIBILITY = 0.5
+# ROI 最小邊長（像素），避免人物很小時裁得過小
+MIN_ROI_SIZE = 96
+# benchmark：平均關節點差異超過畫面的這個百分比，視為兩種模式追蹤到不同的人
+SAME_PERSON_ERROR = 10.0
+
+
+class RoiPoseTracker:
+    """包裝 Mediapipe Pose：有追蹤時只對 ROI 推論，追蹤遺失就改跑全畫面
+
+    process() 回傳的 result 與 pose.process() 相同，pose_landmarks 已換算回全畫面座標，
+    因此可直接交給 drawing_utils 繪製或拿來計算角度。
+
+    Pose 內部也會沿用上一格的位置追蹤，座標是以「輸入影像」為準。因此 ROI 大小固定、
+    每格只平移到人物中心，讓人物在裁切畫面中的位置保持穩定，內部追蹤才不會對錯地方；
+    只有第一次建立 ROI 或必須改變大小時才 reset，讓 Pose 在新的裁切上重新偵測。
+    """
+
+    def __init__(self, pose, margin: float = ROI_MARGIN) -> None:
+        self.pose = pose
+        self.margin = margin
+        self.roi: tuple[int, int, int, int] | None = None  # (x0, y0, x1, y1)
+        self.roi_frames = 0
+        self.full_frames = 0
+        self.lost = 0
+        self.recrops = 0
+
+    def process(self, frame: np.ndarray):
+        """對 BGR 畫面推論；有 ROI 時只送裁切後的區域"""
+        if self.roi is not None:
+            x0, y0, x1, y1 = self.roi
+            result = self.pose.process(cv2.cvtColor(frame[y0:y1, x0:x1], cv2.COLOR_BGR2RGB))
+            if result.pose_landmarks:
+                self.roi_frames += 1
+                self._to_frame_coordinates(result.pose_landmarks, frame.shape)
+                self._update_roi(result.pose_landmarks, frame.shape)
+                return result
+            # 追蹤遺失：同一格立刻改用全畫面重新偵測
+            self.lost += 1
+            self._set_roi(None)
+
+        self.full_frames += 1
+        result = self.pose.process(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+        if result.pose_landmarks:
+            self._update_roi(result.pose_landmarks, frame.shape)
+        return result
+
+    def _to_frame_coordinates(self, landmarks, shape: tuple) -> None:
+        """把 ROI 內的歸一化座標換算成全畫面的歸一化座標（直接修改 landmark）"""
+        height, width = shape[:2]
+        x0, y0, x1, y1 = self.roi
+        crop_width, crop_height = x1 - x0, y1 - y0
+        for lm in landmarks.landmark:
+            lm.x = (x0 + lm.x * crop_width) / width
+            lm.y = (y0 + lm.y * crop_height) / height
+            # z 與 x 使用相同尺度（以影像寬度歸一化）
+            lm.z = lm.z * crop_width / width
+
+    def _update_roi(self, landmarks, shape: tuple) -> None:
+        height, width = shape[:2]
+        points = np.array([(lm.x * width, lm.y * height, lm.visibility)
+                           for lm in landmarks.landmark], dtype=np.float32)
+        visible = points[points[:, 2] > MIN_VISIBILITY]
+        if len(visible) < 4:
+            visible = points
+        bx0, by0 = visible[:, :2].min(axis=0)
+        bx1, by1 = visible[:, :2].max(axis=0)
+        box_width, box_height = bx1 - bx0, by1 - by0
+        center_x, center_y = (bx0 + bx1) / 2, (by0 + by1) / 2
+
+        if self.roi is not None:
+            roi_width = self.roi[2] - self.roi[0]
+            roi_height = self.roi[3] - self.roi[1]
+            fits = (box_width <= roi_width * (1 - 2 * ROI_KEEP_MARGIN)
+                    and box_height <= roi_height * (1 - 2 * ROI_KEEP_MARGIN))
+            too_large = box_width * box_height < ROI_SHRINK_RATIO * roi_width * roi_height
+            if fits and not too_large:
+                # 大小不變、只平移：不需要 reset，內部追蹤可以延續
+                self.roi = self._place(center_x, center_y, roi_width, roi_height, width, height)
+                return
+
+        roi_width = int(np.ceil(max(box_width * (1 + 2 * self.margin), MIN_ROI_SIZE)))
+        roi_height = int(np.ceil(max(box_height * (1 + 2 * self.margin), MIN_ROI_SIZE)))
+        # 幾乎等於整張畫面時就不裁切
+        if roi_width * roi_height >= 0.9 * width * height:
+            self._set_roi(None)
+        else:
+            self._set_roi(self._place(center_x, center_y, roi_width, roi_height, width, height))
+
+    @staticmethod
+    def _place(center_x: float, center_y: float, roi_width: int, roi_height: int,
+               width: int, height: int) -> tuple[int, int, int, int]:
+        """以 (center_x, center_y) 為中心放置固定大小的 ROI，碰到畫面邊緣時往內推"""
+        roi_width, roi_height = min(roi_width, width), min(roi_height, height)
+        x0 = int(np.clip(round(center_x - roi_width / 2), 0, width - roi_width))
+        y0 = int(np.clip(round(center_y - roi_height / 2), 0, height - roi_height))
+        return x0, y0, x0 + roi_width, y0 + roi_height
+
+    def _set_roi(self, roi: tuple[int, int, int, int] | None) -> None:
+        """改變 ROI 大小或切換全畫面 / ROI 時呼叫，會 reset Pose 的內部追蹤"""
+        if roi == self.roi:
+            return
+        self.roi = roi
+        self.recrops += 1
+        self.pose.reset()
+
+    def draw_roi(self, frame: np.ndarray) -> None:
+        if self.roi is not None:
+            x0, y0, x1, y1 = self.roi
+            cv2.rectangle(frame, (x0, y0), (x1 - 1, y1 - 1), (255, 200, 0), 1)
+
+
+def _load_frames(video_path: Path, limit: int, upscale: float) -> list[np.ndarray]:
+    cap = cv2.VideoCapture(str(video_path))
+    frames = []
+    while len(frames) < limit:
+        ok, frame = cap.read()
+        if not ok:
+            break
+        if upscale != 1:
+            frame = cv2.resize(frame, None, fx=upscale, fy=upscale, interpolation=cv2.INTER_LINEAR)
+        frames.append(frame)
+    cap.release()
+    if not frames:
+        raise RuntimeError(f"無法讀取影片: {video_path}")
+    return frames
+
+
+def _run(frames: list[np.ndarray], use_roi: bool):
+    """回傳 (每格耗時 ms, 每格 landmarks 或 None, tracker)"""
+    pose = mp.solutions.pose.Pose()
+    tracker = RoiPoseTracker(pose) if use_roi else None
+    latencies, landmarks = [], []
+    for frame in frames:
+        start = time.perf_counter()
+        if tracker is not None:
+            result = tracker.process(frame)
+        else:
+            result = pose.process(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+        latencies.append((time.perf_counter() - start) * 1000)
+        landmarks.append(None if not result.pose_landmarks else np.array(
+            [(lm.x, lm.y) for lm in result.pose_landmarks.landmark], dtype=np.float32))
+    pose.close()
+    return np.array(latencies), landmarks, tracker
+
+
+def benchmark(video_path: Path, limit: int = 300, upscale: float = 1.0) -> None:
+    """同一批畫面分別跑全畫面與 ROI 模式，比較每格延遲與關節點差異"""
+    frames = _load_frames(video_path, limit, upscale)
+    height, width = frames[0].shape[:2]
+    print(f"{video_path.name}：{len(frames)} 格，{width}x{height}")
+
+    full_ms, full_points, _ = _run(frames, use_roi=False)
+    roi_ms, roi_points, tracker = _run(frames, use_roi=True)
+
+    for label, latencies in (("全畫面", full_ms), ("ROI", roi_ms)):
+        print(f"  {label:4s} 平均 {latencies.mean():.2f} ms  p50 {np.percentile(latencies, 50):.2f} ms  "
+              f"p95 {np.percentile(latencies, 95):.2f} ms")
+    saving = full_ms.mean() - roi_ms.mean()
+    print(f"  每格節省 {saving:.2f} ms（{saving / full_ms.mean() * 100:.1f}%）")
+    print(f"  ROI 推論 {tracker.roi_frames} 格、全畫面 {tracker.full_frames} 格、"
+          f"重設 ROI 大小 {tracker.recrops} 次、追蹤遺失 {tracker.lost} 次")
+
+    both = [(a, b) for a, b in zip(full_points, roi_points) if a is not None and b is not None]
+    if both:
+        # x、y 為歸一化座標，乘 100 代表佔畫面寬/高的百分比
+        error = np.stack([np.hypot(*(b - a).T) for a, b in both]) * 100
+        # 畫面中有多人時，兩種模式可能追蹤到不同的人，這些影格不列入誤差
+        same = error.mean(axis=1) < SAME_PERSON_ERROR
+        if same.any():
+            print(f"  與全畫面結果的關節點差異：平均 {error[same].mean():.2f}%  "
+                  f"p95 {np.percentile(error[same], 95):.2f}%（{same.sum()} 格）")
+        if not same.all():
+            print(f"  另有 {(~same).sum()} 格兩種模式追蹤到不同的人")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="比較全畫面與 ROI 裁切模式的 Pose 延遲")
+    parser.add_argument("video", nargs="?", type=Path,
+                        default=Path(__file__).resolve().parent.parent / "video" / "dancer.mp4",
+                        help="測試影片（預設 video/dancer.mp4）")
+    parser.add_argument("--frames", type=int, default=300, help="最多測試幾格")
+    parser.add_argument("--upscale", type=float, default=1.0,
+                        help="先把畫面放大幾倍，例如 3 可模擬 1080x1920 的攝影機畫面")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    benchmark(args.video, args.frames, args.upscale)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,31 @@
 ﻿"""Day 2：深蹲次數統計"""
 from __future__ import annotations
+from pathlib import Path
+import argparse
+import sys
+import time
 
 # Author: harry123180
 
 try:
     import cv2
     import mediapipe as mp
+    import numpy as np
 except ImportError as exc:  # pragma: no cover
-    raise SystemExit("請先安裝 opencv-python 與 mediapipe 套件") from exc
+    raise SystemExit("請先安裝 opencv-python、mediapipe 與 numpy 套件") from exc
+
+# 共用 tools/frame_bus.py：可改從影片檔或共享記憶體匯流排讀取畫面
+sys.path.append(str(Path(__file__).resolve().parent.parent / "tools"))
+from frame_bus import open_source  # noqa: E402
+from pose_roi import RoiPoseTracker  # noqa: E402
+from pose_video_report import landmarks_to_array, load_landmarks  # noqa: E402
+
+# 髖、膝、踝的 landmark 索引
+LEG_JOINTS = {"left": (23, 25, 27), "right": (24, 26, 28)}
+# 膝蓋角度低於 DOWN_ANGLE 視為蹲下，回到 UP_ANGLE 以上才算完成一次；
+# UP_ANGLE 設得比 DOWN_ANGLE 大就形成遲滯區間，可避免在門檻附近抖動時重複計數
+DOWN_ANGLE = 90.0
+UP_ANGLE = 90.0
 
 
 def calculate_angle(a, b, c) -> float:
@@ -28,27 +46,139 @@ def calculate_angle(a, b, c) -> float:
     return math.degrees(math.acos(cos_angle))
 
 
-def main() -> None:
-    """透過膝蓋角度估算深蹲次數"""
+def joint_angles(points: np.ndarray, a: int, b: int, c: int) -> np.ndarray:
+    """一次算出所有影格 a-b-c 三點在 b 的夾角 (度數)，與 calculate_angle 逐格計算相同
+
+    points 為 (N, 33, 2 以上) 的 landmark 陣列，只使用 x、y。
+    """
+    xy = points[:, :, :2].astype(np.float64)
+    ab = xy[:, a] - xy[:, b]
+    cb = xy[:, c] - xy[:, b]
+    dot = np.einsum("ij,ij->i", ab, cb)
+    norm = np.hypot(ab[:, 0], ab[:, 1]) * np.hypot(cb[:, 0], cb[:, 1])
+    # 任一邊長度為 0 時與 calculate_angle 相同，視為 180 度
+    cos_angle = np.divide(dot, norm, out=np.full_like(dot, -1.0), where=norm > 0)
+    return np.degrees(np.arccos(np.clip(cos_angle, -1.0, 1.0)))
+
+
+class SquatCounter:
+    """深蹲遲滯計數器：逐格餵入膝蓋角度"""
+
+    def __init__(self, down_angle: float = DOWN_ANGLE, up_angle: float = UP_ANGLE) -> None:
+        if up_angle < down_angle:
+            raise ValueError("up_angle 不可小於 down_angle")
+        self.down_angle = down_angle
+        self.up_angle = up_angle
+        self.count = 0
+        self.is_down = False
+
+    def update(self, angle: float) -> bool:
+        """更新狀態；完成一次深蹲時回傳 True"""
+        if angle < self.down_angle:
+            self.is_down = True
+        elif angle >= self.up_angle and self.is_down:
+            self.is_down = False
+            self.count += 1
+            return True
+        return False
+
+
+def count_squats(angles: np.ndarray, down_angle: float = DOWN_ANGLE,
+                 up_angle: float = UP_ANGLE) -> np.ndarray:
+    """對整段角度序列執行與 SquatCounter 相同的遲滯計數，回傳每次完成時的索引
+
+    不用逐格迴圈：先標出「蹲下 / 站起」事件，落在遲滯區間內的影格沿用前一個事件的狀態，
+    再找出 蹲下 → 站起 的轉換點。
+    """
+    angles = np.asarray(angles, dtype=np.float64)
+    # 1 = 蹲下、0 = 站起、-1 = 沒有事件；最前面補一個「站起」當初始狀態
+    events = np.where(angles < down_angle, 1, np.where(angles >= up_angle, 0, -1))
+    events = np.concatenate(([0], events))
+    last_event = np.where(events >= 0, np.arange(len(events)), 0)
+    state = events[np.maximum.accumulate(last_event)]
+    return np.flatnonzero((state[:-1] == 1) & (state[1:] == 0))
+
+
+def iter_sessions(paths: list[Path]):
+    """展開資料夾並逐一載入關節點檔 (.npz / .parquet)，yield (路徑, 影格索引, landmarks)"""
+    for path in paths:
+        if path.is_dir():
+            files = sorted(list(path.glob("*.npz")) + list(path.glob("*.parquet")))
+        else:
+            files = [path]
+        for file in files:
+            frames, points = load_landmarks(file)
+            yield file, frames, points
+
+
+def replay(paths: list[Path], side: str = "left", down_angles: list[float] | None = None,
+           up_angles: list[float] | None = None) -> None:
+    """不重跑 Mediapipe，直接在已存的關節點上計數；給多組門檻時輸出每組的次數"""
+    down_angles = down_angles or [DOWN_ANGLE]
+    up_angles = up_angles or [UP_ANGLE]
+    thresholds = [(down, up) for down in down_angles for up in up_angles if up >= down]
+    if not thresholds:
+        raise SystemExit("沒有有效的門檻組合：--up 必須 >= --down")
+
+    start = time.perf_counter()
+    totals = np.zeros(len(thresholds), dtype=int)
+    sessions = total_frames = 0
+    single = len(thresholds) == 1
+    if not single:
+        print("檔案".ljust(22) + "".join(f"{down:g}/{up:g}".rjust(10) for down, up in thresholds))
+    for path, frames, points in iter_sessions(paths):
+        angles = joint_angles(points, *LEG_JOINTS[side])
+        reps = [count_squats(angles, down, up) for down, up in thresholds]
+        totals += [len(rep) for rep in reps]
+        sessions += 1
+        total_frames += len(frames)
+        if single:
+            done_frames = ", ".join(str(frame) for frame in frames[reps[0]])
+            print(f"{path.name}: {len(reps[0])} 次" + (f"（完成於第 {done_frames} 格）" if done_frames else ""))
+        else:
+            print(path.name[:23].ljust(24) + "".join(f"{len(rep):10d}" for rep in reps))
+    elapsed = time.perf_counter() - start
+
+    if not sessions:
+        raise FileNotFoundError("找不到關節點檔，請先用 pose_video_report.py --landmarks npz 產生")
+    if not single:
+        print("合計".ljust(22) + "".join(f"{total:10d}" for total in totals))
+    print(f"{sessions} 個檔案、{total_frames} 格、{len(thresholds)} 組門檻，"
+          f"耗時 {elapsed * 1000:.1f} ms")
+
+
+def run_live(source: str | None, side: str = "left", down_angle: float = DOWN_ANGLE,
+             up_angle: float = UP_ANGLE, record: Path | None = None, roi: bool = False) -> None:
+    """透過膝蓋角度即時估算深蹲次數；record 可把關節點存成 .npz 供之後離線重播"""
     pose = mp.solutions.pose.Pose()
     drawing = mp.solutions.drawing_utils
+    tracker = RoiPoseTracker(pose) if roi else None
+    hip, knee, ankle = LEG_JOINTS[side]
+    counter = SquatCounter(down_angle, up_angle)
+    recorded_frames: list[int] = []
+    recorded_points: list[np.ndarray] = []
 
-    cap = cv2.VideoCapture(0)
+    # 來源可為攝影機編號、影片路徑或 bus:cam0
+    cap = open_source(source)
     if not cap.isOpened():
         raise RuntimeError("找不到攝影機，請確認是否已連接")
 
-    squat_count = 0
-    is_below_threshold = False
-
-    print("當膝蓋角度低於 90 度會記錄一次深蹲，按 ESC 結束")
+    print(f"當膝蓋角度低於 {down_angle:g} 度會記錄一次深蹲，按 ESC 結束")
 
+    frame_index = 0
     while True:
         ok, frame = cap.read()
         if not ok:
             break
+        frame_index += 1
 
-        rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        result = pose.process(rgb)
+        start = time.perf_counter()
+        if tracker is not None:
+            result = tracker.process(frame)
+        else:
+            rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            result = pose.process(rgb)
+        latency_ms = (time.perf_counter() - start) * 1000
 
         if result.pose_landmarks:
             drawing.draw_landmarks(
@@ -58,34 +188,72 @@ def main() -> None:
             )
 
             lmk = result.pose_landmarks.landmark
-            left_hip = (lmk[23].x, lmk[23].y)
-            left_knee = (lmk[25].x, lmk[25].y)
-            left_ankle = (lmk[27].x, lmk[27].y)
+            if record is not None:
+                recorded_frames.append(frame_index)
+                recorded_points.append(landmarks_to_array(lmk))
 
-            angle = calculate_angle(left_hip, left_knee, left_ankle)
+            angle = calculate_angle((lmk[hip].x, lmk[hip].y), (lmk[knee].x, lmk[knee].y),
+                                    (lmk[ankle].x, lmk[ankle].y))
             angle_text = f"Knee: {angle:5.1f}" if angle == angle else "Knee: --"
             cv2.putText(frame, angle_text, (20, 40),
                         cv2.FONT_HERSHEY_SIMPLEX, 0.9, (50, 220, 220), 2)
 
-            # 小於 90 度代表已經蹲下
-            if angle < 90:
-                if not is_below_threshold:
-                    is_below_threshold = True
-            else:
-                if is_below_threshold:
-                    squat_count += 1
-                    is_below_threshold = False
+            counter.update(angle)
 
-            cv2.putText(frame, f"Squat Count: {squat_count}", (20, 80),
+            cv2.putText(frame, f"Squat Count: {counter.count}", (20, 80),
                         cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 255, 0), 2)
 
+        if tracker is not None:
+            tracker.draw_roi(frame)
+        cv2.putText(frame, f"Pose: {latency_ms:5.1f} ms", (20, 115),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 0), 2)
+
         cv2.imshow("Squat Counter", frame)
         if cv2.waitKey(1) & 0xFF == 27:
             break
 
     cap.release()
     cv2.destroyAllWindows()
-    print(f"總共完成 {squat_count} 次深蹲")
+    print(f"總共完成 {counter.count} 次深蹲")
+
+    if record is not None and recorded_frames:
+        # 與 pose_video_report.py --landmarks npz 相同格式，可直接用 --replay 重播
+        np.savez(
+            record,
+            frame=np.array(recorded_frames, dtype=np.int32),
+            landmarks=np.stack(recorded_points),
+            inferred=np.ones(len(recorded_frames), dtype=bool),
+        )
+        print(f"關節點已存到 {record}")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="深蹲計數器（即時或離線重播）")
+    parser.add_argument("source", nargs="?", default=None,
+                        help="即時模式的來源：攝影機編號、影片路徑或 bus:cam0（預設攝影機 0）")
+    parser.add_argument("--replay", type=Path, nargs="+", metavar="PATH",
+                        help="離線重播已存的關節點檔或資料夾 (.npz / .parquet)")
+    parser.add_argument("--side", choices=sorted(LEG_JOINTS), default="left", help="計算哪一隻腳")
+    parser.add_argument("--down", type=float, nargs="+", default=[DOWN_ANGLE],
+                        help="蹲下門檻（度）；重播時可給多個值一次比較")
+    parser.add_argument("--up", type=float, nargs="+", default=[UP_ANGLE],
+                        help="站起門檻（度），需 >= 蹲下門檻；重播時可給多個值一次比較")
+    parser.add_argument("--record", type=Path, default=None,
+                        help="即時模式結束時把關節點存成 .npz")
+    parser.add_argument("--roi", action="store_true",
+                        help="即時模式依上一格骨架裁切 ROI 再推論，追蹤遺失時改回全畫面")
+    args = parser.parse_args()
+    if not args.replay and (len(args.down) > 1 or len(args.up) > 1):
+        parser.error("即時模式只能指定一組 --down / --up")
+    return args
+
+
+def main() -> None:
+    args = parse_args()
+    if args.replay:
+        replay(args.replay, args.side, args.down, args.up)
+    else:
+        run_live(args.source, args.side, args.down[0], args.up[0], args.record, args.roi)
 
 
 if __name__ == "__main__":
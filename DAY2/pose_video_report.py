@@ -1,24 +1,54 @@
 ﻿"""Day 2：影片批次姿勢摘要"""
 from __future__ import annotations
+from dataclasses import dataclass
+from functools import partial
+from multiprocessing import get_context
 from pathlib import Path
+import argparse
 import csv
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+import zipfile
 
 # Author: harry123180
 
 try:
     import cv2
     import mediapipe as mp
+    import numpy as np
 except ImportError as exc:  # pragma: no cover
-    raise SystemExit("請先安裝 opencv-python 與 mediapipe 套件") from exc
+    raise SystemExit("請先安裝 opencv-python、mediapipe 與 numpy 套件") from exc
 
+NUM_LANDMARKS = 33
+LANDMARK_FIELDS = ("x", "y", "z", "visibility")
+# 每累積多少筆偵測結果就交給輸出端寫一次
+CHUNK_FRAMES = 256
+# 自適應取樣時，用來比較畫面差異的縮圖寬度
+MOTION_WIDTH = 64
+# 結果快取的格式版本；分片格式或計算方式改變時要加 1，舊快取就會自動失效
+CACHE_VERSION = 1
+DEFAULT_CACHE_DIR = Path(__file__).resolve().parent / ".cache" / "pose_report"
 
-def iter_video_frames(video_path: Path):
-    """逐格讀取影片，yield (索引, frame)"""
+# 每個 worker 行程各自持有一個 Pose 模型（由 _init_worker 建立）
+_worker_pose = None
+
+
+def iter_video_frames(video_path: Path, start: int = 0, stop: int | None = None):
+    """逐格讀取影片，yield (索引, frame)
+
+    索引從 1 開始；start / stop 以 0 起算，可只讀取 [start, stop) 範圍內的影格。
+    """
     cap = cv2.VideoCapture(str(video_path))
     if not cap.isOpened():
         raise RuntimeError(f"無法開啟影片: {video_path}")
-    index = 0
-    while True:
+    if start:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+    index = start
+    while stop is None or index < stop:
         ok, frame = cap.read()
         if not ok:
             break
@@ -27,40 +57,627 @@ def iter_video_frames(video_path: Path):
     cap.release()
 
 
+def landmarks_to_array(landmarks) -> np.ndarray:
+    """把 33 個 landmark 轉成 33 x 4 的 float32 陣列 (x, y, z, visibility)"""
+    return np.array([(lm.x, lm.y, lm.z, lm.visibility) for lm in landmarks], dtype=np.float32)
+
+
+def torso_angles(points: np.ndarray) -> np.ndarray:
+    """一次計算 N 個影格的軀幹傾斜角度：肩膀中心 → 髖部中心連線 (度數)"""
+    xy = points[:, :, :2].astype(np.float64)
+    shoulder_center = (xy[:, 11] + xy[:, 12]) / 2
+    hip_center = (xy[:, 23] + xy[:, 24]) / 2
+    delta = (hip_center - shoulder_center).astype(np.float32)
+    # cv2.phase 與 fastAtan2 使用同一套快速近似，結果與逐格計算一致
+    return cv2.phase(delta[:, 0], delta[:, 1], angleInDegrees=True).ravel()
+
+
+@dataclass(frozen=True)
+class Sampling:
+    """取樣設定
+
+    stride：最多隔幾格跑一次 Pose（1 代表每格都跑）。
+    motion_threshold：不為 None 時改用自適應取樣，縮圖灰階差異超過門檻就提早推論，
+    stride 則成為最長間隔。
+    """
+    stride: int = 1
+    motion_threshold: float | None = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.stride > 1
+
+
+FULL_SAMPLING = Sampling()
+
+
+@dataclass
+class PoseChunk:
+    """一段連續結果：影格索引 (N,)、landmark 陣列 (N, 33, 4)、是否為實際推論 (N,)"""
+    video: str
+    frames: np.ndarray
+    points: np.ndarray
+    inferred: np.ndarray
+    # 影片的完整路徑（resolve 後）；不同資料夾的同名影片靠它區分
+    source: str = ""
+
+    def csv_rows(self, with_source: bool = False) -> list[list]:
+        angles = torso_angles(self.points)
+        rows = [[self.video, int(index), round(float(angle), 2)]
+                for index, angle in zip(self.frames, angles)]
+        if with_source:
+            for row, inferred in zip(rows, self.inferred):
+                row.append("inferred" if inferred else "interpolated")
+        return rows
+
+
+def _make_chunk(video_path: Path, frames: list[int], points: list[np.ndarray],
+                inferred: list[bool]) -> PoseChunk:
+    return PoseChunk(
+        video_path.name,
+        np.array(frames, dtype=np.int32),
+        np.stack(points) if points else np.empty((0, NUM_LANDMARKS, 4), dtype=np.float32),
+        np.array(inferred, dtype=bool),
+        str(video_path.resolve()),
+    )
+
+
+def _infer(pose, frame: np.ndarray) -> np.ndarray | None:
+    result = pose.process(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+    if not result.pose_landmarks:
+        return None
+    return landmarks_to_array(result.pose_landmarks.landmark)
+
+
+def _motion_thumbnail(frame: np.ndarray) -> np.ndarray:
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    height, width = gray.shape
+    size = (MOTION_WIDTH, max(1, round(height * MOTION_WIDTH / width)))
+    return cv2.resize(gray, size, interpolation=cv2.INTER_AREA)
+
+
+def _interpolate(previous: tuple, current: tuple, indices: list[int]):
+    """在兩個推論影格之間線性內插；任一端沒偵測到人時，中間影格一律視為沒偵測到"""
+    (index0, points0), (index1, points1) = previous, current
+    if points0 is None or points1 is None:
+        for index in indices:
+            yield index, None, False
+        return
+    weights = (np.array(indices, dtype=np.float32) - index0) / (index1 - index0)
+    filled = points0 + weights[:, None, None] * (points1 - points0)
+    for index, points in zip(indices, filled):
+        yield index, points, False
+
+
+def iter_poses(pose, video_path: Path, start: int = 0, stop: int | None = None,
+               sampling: Sampling = FULL_SAMPLING):
+    """依取樣設定逐格產出 (索引, landmarks 或 None, 是否為實際推論)"""
+    if not sampling.enabled:
+        for index, frame in iter_video_frames(video_path, start, stop):
+            yield index, _infer(pose, frame), True
+        return
+
+    adaptive = sampling.motion_threshold is not None
+    keyframe = None  # 上一個推論影格 (索引, landmarks)
+    key_thumbnail = None
+    skipped: list[int] = []
+    last_frame = None
+    for index, frame in iter_video_frames(video_path, start, stop):
+        due = keyframe is None or index - keyframe[0] >= sampling.stride
+        thumbnail = _motion_thumbnail(frame) if adaptive else None
+        if not due and adaptive:
+            # 與上一個推論影格比較，累積的動作量超過門檻就提早推論
+            motion = float(cv2.absdiff(thumbnail, key_thumbnail).mean())
+            due = motion > sampling.motion_threshold
+        if not due:
+            skipped.append(index)
+            last_frame = frame
+            continue
+        current = (index, _infer(pose, frame))
+        if keyframe is not None:
+            yield from _interpolate(keyframe, current, skipped)
+        yield index, current[1], True
+        keyframe, key_thumbnail, skipped = current, thumbnail, []
+
+    if skipped:
+        # 範圍最後一格沒被推論到：補跑一次，尾端才有兩個端點可以內插
+        current = (skipped.pop(), _infer(pose, last_frame))
+        yield from _interpolate(keyframe, current, skipped)
+        yield current[0], current[1], True
+
+
+def analyze_frames(pose, video_path: Path, start: int = 0, stop: int | None = None,
+                   skip_until: int = 0, chunk_frames: int = CHUNK_FRAMES,
+                   sampling: Sampling = FULL_SAMPLING):
+    """對指定影格範圍跑 Pose，每累積 chunk_frames 筆結果就 yield 一個 PoseChunk
+
+    索引 <= skip_until 的影格只用來暖機、不輸出；沒偵測到人的影格會略過。
+    """
+    frames: list[int] = []
+    points: list[np.ndarray] = []
+    inferred: list[bool] = []
+    for index, landmarks, is_inferred in iter_poses(pose, video_path, start, stop, sampling):
+        if index <= skip_until or landmarks is None:
+            continue
+        frames.append(index)
+        points.append(landmarks)
+        inferred.append(is_inferred)
+        if len(frames) >= chunk_frames:
+            yield _make_chunk(video_path, frames, points, inferred)
+            frames, points, inferred = [], [], []
+    if frames:
+        yield _make_chunk(video_path, frames, points, inferred)
+
+
+def count_frames(video_path: Path) -> int:
+    cap = cv2.VideoCapture(str(video_path))
+    total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+    return total
+
+
+def split_segments(videos: list[Path], segment_frames: int, warmup: int,
+                   resume: dict[Path, int] | None = None) -> list[tuple]:
+    """把每支影片切成 (影片, 起點, 終點, 暖機起點) 的片段清單，順序即輸出順序
+
+    resume 指定某支影片已完成到第幾格：之前的片段整段略過，
+    跨過該格的片段則從下一格開始輸出，切段位置與從頭跑時相同。
+    """
+    segments = []
+    for video_path in videos:
+        done = resume.get(video_path, 0) if resume else 0
+        total = count_frames(video_path)
+        starts = list(range(0, max(total, 1), segment_frames))
+        for i, start in enumerate(starts):
+            # 最後一段不設終點，避免 FRAME_COUNT 不準時漏掉尾端影格
+            stop = starts[i + 1] if i + 1 < len(starts) else None
+            if stop is not None and stop <= done:
+                continue
+            start = max(start, done)
+            segments.append((video_path, start, stop, max(0, start - warmup)))
+    return segments
+
+
+def _init_worker() -> None:
+    global _worker_pose
+    # 多行程時每個行程只用一條 OpenCV 執行緒，避免互搶 CPU
+    cv2.setNumThreads(1)
+    _worker_pose = mp.solutions.pose.Pose()
+
+
+def _process_segment(segment: tuple, sampling: Sampling = FULL_SAMPLING) -> list[PoseChunk]:
+    """worker：先跑暖機影格讓追蹤穩定，再輸出片段本身的結果"""
+    video_path, start, stop, warmup_start = segment
+    # 清掉上一個片段留下的追蹤狀態，結果才不會受片段分配到哪個行程影響
+    _worker_pose.reset()
+    return list(analyze_frames(_worker_pose, video_path, warmup_start, stop,
+                               skip_until=start, sampling=sampling))
+
+
+def iter_pose_chunks(videos: list[Path], workers: int = 1, segment_frames: int = 300,
+                     warmup: int = 60, sampling: Sampling = FULL_SAMPLING,
+                     resume: dict[Path, int] | None = None):
+    """分析所有影片，依 (影片, 影格) 順序 yield PoseChunk
+
+    resume 為 {影片: 已完成的最後一格}，這些影片只輸出該格之後的結果。
+    """
+    if workers <= 1:
+        # 單行程：與原本相同，一個 Pose 依序處理所有影格
+        pose = mp.solutions.pose.Pose()
+        try:
+            for video_path in videos:
+                # 每支影片從乾淨的追蹤狀態開始，結果才能逐支快取、互不影響
+                pose.reset()
+                done = resume.get(video_path, 0) if resume else 0
+                # 接續處理時先往回多跑 warmup 格，讓追蹤穩定後再輸出
+                start = max(0, done - warmup) if done else 0
+                yield from analyze_frames(pose, video_path, start, skip_until=done,
+                                          sampling=sampling)
+        finally:
+            pose.close()
+        return
+
+    segments = split_segments(videos, max(segment_frames, 1), warmup, resume)
+    # 使用 spawn：Mediapipe 不保證 fork 後還能安全使用
+    with get_context("spawn").Pool(processes=workers, initializer=_init_worker) as pool:
+        # imap 依片段順序回傳，合併後自然就是正確的影格順序
+        for segment_chunks in pool.imap(partial(_process_segment, sampling=sampling), segments):
+            yield from segment_chunks
+
+
+def analyze_videos(videos: list[Path], workers: int = 1, segment_frames: int = 300,
+                   warmup: int = 60, sampling: Sampling = FULL_SAMPLING) -> list[list]:
+    """分析所有影片並回傳依 (影片, 影格) 排序的 CSV 列"""
+    rows = []
+    for chunk in iter_pose_chunks(videos, workers, segment_frames, warmup, sampling):
+        rows.extend(chunk.csv_rows(with_source=sampling.enabled))
+    return rows
+
+
+def path_key(video_path: Path) -> str:
+    """影片完整路徑（resolve 後）的短雜湊；不同資料夾的同名影片靠它區分快取與輸出檔"""
+    return hashlib.sha1(str(Path(video_path).resolve()).encode("utf-8")).hexdigest()[:8]
+
+
+def landmark_filename(chunk: PoseChunk, suffix: str) -> str:
+    """--landmarks 的輸出檔名：<影片名>-<路徑雜湊><副檔名>"""
+    return f"{Path(chunk.video).stem}-{path_key(Path(chunk.source))}{suffix}"
+
+
+class NpzLandmarkWriter:
+    """每支影片輸出一個 .npz：frame (N,) int32、landmarks (N, 33, 4) float32、inferred (N,) bool
+
+    每個 chunk 一到就附加到暫存檔，影片結束時再把暫存檔串流複製成 .npz，
+    記憶體用量只和單一 chunk 大小有關，與影片長度無關。
+    """
+
+    suffix = ".npz"
+    # 欄位名稱與 dtype；暫存檔存的就是這些陣列的原始位元組
+    arrays = (("frame", np.int32), ("landmarks", np.float32), ("inferred", np.bool_))
+
+    def __init__(self, output_dir: Path) -> None:
+        self.output_dir = output_dir
+        self.paths: list[Path] = []
+        self._path: Path | None = None
+        self._source: str | None = None
+        self._parts: dict = {}
+        self._rows = 0
+
+    def write(self, chunk: PoseChunk) -> None:
+        if chunk.source != self._source:
+            self.close()
+            self._source = chunk.source
+            self._path = self.output_dir / landmark_filename(chunk, self.suffix)
+            self._parts = {name: tempfile.TemporaryFile(dir=self.output_dir) for name, _ in self.arrays}
+            self._rows = 0
+        values = {"frame": chunk.frames, "landmarks": chunk.points, "inferred": chunk.inferred}
+        for name, dtype in self.arrays:
+            self._parts[name].write(np.ascontiguousarray(values[name], dtype=dtype).tobytes())
+        self._rows += len(chunk.frames)
+
+    def close(self) -> None:
+        if not self._parts:
+            return
+        shapes = {"frame": (self._rows,), "landmarks": (self._rows, NUM_LANDMARKS, len(LANDMARK_FIELDS)),
+                  "inferred": (self._rows,)}
+        tmp_path = self._path.with_name(f"{self._path.name}.{os.getpid()}.tmp")
+        # 與 np.savez 相同的格式：不壓縮的 zip，每個陣列一個 .npy；讀取時直接整塊載入
+        with zipfile.ZipFile(tmp_path, "w", zipfile.ZIP_STORED, allowZip64=True) as archive:
+            for name, dtype in self.arrays:
+                part = self._parts.pop(name)
+                with part, archive.open(f"{name}.npy", "w", force_zip64=True) as member:
+                    np.lib.format.write_array_header_1_0(member, {
+                        "descr": np.lib.format.dtype_to_descr(np.dtype(dtype)),
+                        "fortran_order": False,
+                        "shape": shapes[name],
+                    })
+                    part.seek(0)
+                    shutil.copyfileobj(part, member)
+            with archive.open("fields.npy", "w") as member:
+                np.lib.format.write_array(member, np.array(LANDMARK_FIELDS))
+        os.replace(tmp_path, self._path)
+        self.paths.append(self._path)
+        self._source = None
+
+
+def _landmark_columns() -> list[str]:
+    return [f"lm{i}_{field}" for i in range(NUM_LANDMARKS) for field in LANDMARK_FIELDS]
+
+
+class ParquetLandmarkWriter:
+    """每支影片輸出一個 .parquet，每個 chunk 寫成一個 row group
+
+    欄位為 frame、lm{i}_{x,y,z,visibility} 共 132 個 float32 欄位，以及 inferred。
+    """
+
+    suffix = ".parquet"
+
+    def __init__(self, output_dir: Path) -> None:
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as exc:
+            raise SystemExit("輸出 Parquet 需要 pyarrow 套件：pip install pyarrow") from exc
+        self._pa = pa
+        self._pq = pq
+        self.output_dir = output_dir
+        self.paths: list[Path] = []
+        self._source: str | None = None
+        self._writer = None
+        self._columns = ["frame"] + _landmark_columns() + ["inferred"]
+
+    def write(self, chunk: PoseChunk) -> None:
+        if chunk.source != self._source:
+            self.close()
+            self._source = chunk.source
+        flat = chunk.points.reshape(len(chunk.frames), -1)
+        arrays = ([self._pa.array(chunk.frames)]
+                  + [self._pa.array(column) for column in flat.T]
+                  + [self._pa.array(chunk.inferred)])
+        table = self._pa.Table.from_arrays(arrays, names=self._columns)
+        if self._writer is None:
+            path = self.output_dir / landmark_filename(chunk, self.suffix)
+            self._writer = self._pq.ParquetWriter(path, table.schema)
+            self.paths.append(path)
+        self._writer.write_table(table)
+
+    def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+LANDMARK_WRITERS = {"npz": NpzLandmarkWriter, "parquet": ParquetLandmarkWriter}
+
+
+def load_landmarks(path: Path) -> tuple[np.ndarray, np.ndarray]:
+    """讀回 --landmarks 輸出的檔案，回傳 (frame (N,), landmarks (N, 33, 4))"""
+    path = Path(path)
+    if path.suffix == ".npz":
+        with np.load(path) as data:
+            return data["frame"], data["landmarks"]
+    import pyarrow.parquet as pq
+
+    table = pq.read_table(path)
+    frames = table.column("frame").to_numpy()
+    points = np.column_stack([table.column(name).to_numpy() for name in _landmark_columns()])
+    return frames, points.reshape(len(frames), NUM_LANDMARKS, len(LANDMARK_FIELDS))
+
+
+def video_digest(video_path: Path) -> str:
+    """影片內容的 SHA-1（只有修改時間改變、內容相同時仍能命中快取）"""
+    digest = hashlib.sha1()
+    with video_path.open("rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def processing_params(workers: int, segment_frames: int, warmup: int,
+                      sampling: Sampling) -> dict:
+    """會影響輸出結果的參數；任何一項改變都視為不同的快取"""
+    params = {
+        "version": CACHE_VERSION,
+        "mediapipe": mp.__version__,
+        "stride": sampling.stride,
+        "motion_threshold": sampling.motion_threshold,
+    }
+    if workers > 1:
+        # 切段平行處理時，切段位置與暖機長度都會影響結果
+        params.update(segment_frames=segment_frames, warmup=warmup)
+    return params
+
+
+class VideoShards:
+    """單支影片的快取分片：<快取資料夾>/<影片名>-<路徑雜湊>-<參數雜湊>-<內容雜湊>/part-00000.npz ...
+
+    路徑雜湊讓不同資料夾中的同名影片各自擁有快取，清理舊快取時也不會刪到別支影片的。
+
+    每收到一個 PoseChunk 就寫成一個分片，整支影片處理完才寫 done.json，
+    所以程式中斷後可以從最後一個分片的影格接續。
+    """
+
+    def __init__(self, cache_dir: Path, video_path: Path, params: dict) -> None:
+        self.video_path = video_path.resolve()
+        params_key = hashlib.sha1(json.dumps(params, sort_keys=True).encode("utf-8")).hexdigest()
+        self.prefix = f"{video_path.stem}-{path_key(self.video_path)}-{params_key[:8]}"
+        self.directory = cache_dir / f"{self.prefix}-{video_digest(video_path)[:16]}"
+        self._parts = sorted(self.directory.glob("part-*.npz"))
+
+    @property
+    def complete(self) -> bool:
+        return (self.directory / "done.json").exists()
+
+    def resume_frame(self) -> int:
+        """已寫入分片的最後一格索引；0 代表從頭開始"""
+        if not self._parts:
+            return 0
+        with np.load(self._parts[-1]) as data:
+            return int(data["frame"][-1])
+
+    def append(self, chunk: PoseChunk) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.directory / f"part-{len(self._parts):05d}.npz"
+        tmp_path = path.with_name(f"{path.stem}.{os.getpid()}.tmp")
+        with tmp_path.open("wb") as file:
+            np.savez(file, frame=chunk.frames, landmarks=chunk.points, inferred=chunk.inferred)
+        # 先寫暫存檔再換名，中斷時不會留下寫到一半的分片
+        os.replace(tmp_path, path)
+        self._parts.append(path)
+
+    def finish(self) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        (self.directory / "done.json").write_text(
+            json.dumps({"video": self.video_path.name, "parts": len(self._parts)}),
+            encoding="utf-8",
+        )
+        # 同一路徑、同參數，但影片內容已改變的舊快取用不到了，順手清掉
+        for stale in self.directory.parent.glob(f"{self.prefix}-*"):
+            if stale != self.directory and stale.is_dir():
+                shutil.rmtree(stale, ignore_errors=True)
+
+    def iter_chunks(self):
+        for path in self._parts:
+            with np.load(path) as data:
+                yield PoseChunk(self.video_path.name, data["frame"], data["landmarks"],
+                                data["inferred"], str(self.video_path))
+
+
+def iter_cached_chunks(videos: list[Path], cache_dir: Path, workers: int = 1,
+                       segment_frames: int = 300, warmup: int = 60,
+                       sampling: Sampling = FULL_SAMPLING):
+    """只處理沒有快取或沒處理完的影片，最後從各影片的分片依序組出完整結果"""
+    params = processing_params(workers, segment_frames, warmup, sampling)
+    # 一律以 resolve 後的完整路徑為 key，不同資料夾的同名影片才不會混在一起
+    videos = [video_path.resolve() for video_path in videos]
+    shards = {video_path: VideoShards(cache_dir, video_path, params) for video_path in videos}
+
+    pending = {}
+    for video_path, shard in shards.items():
+        if shard.complete:
+            print(f"{video_path.name}：使用快取")
+            continue
+        pending[video_path] = shard.resume_frame()
+        if pending[video_path]:
+            print(f"{video_path.name}：從第 {pending[video_path] + 1} 格接續處理")
+        else:
+            print(f"{video_path.name}：開始處理")
+
+    if pending:
+        by_source = {str(video_path): shards[video_path] for video_path in pending}
+        current = None
+        for chunk in iter_pose_chunks(list(pending), workers, segment_frames, warmup,
+                                      sampling, resume=pending):
+            shard = by_source[chunk.source]
+            if current is not None and shard is not current:
+                # 結果依影片順序產出，換到下一支影片代表上一支已處理完
+                current.finish()
+            current = shard
+            shard.append(chunk)
+        for video_path in pending:
+            if not shards[video_path].complete:
+                shards[video_path].finish()
+
+    for video_path in videos:
+        yield from shards[video_path].iter_chunks()
+
+
+def benchmark(videos: list[Path], worker_counts: list[int], segment_frames: int, warmup: int) -> None:
+    """比較不同 worker 數量的處理速度 (frames/sec)"""
+    total_frames = sum(count_frames(video_path) for video_path in videos)
+    for workers in worker_counts:
+        start = time.perf_counter()
+        rows = analyze_videos(videos, workers, segment_frames, warmup)
+        elapsed = time.perf_counter() - start
+        print(f"{workers} 個 worker：{total_frames} 影格、{len(rows)} 筆結果，"
+              f"耗時 {elapsed:.1f} 秒，{total_frames / elapsed:.1f} frames/sec")
+
+
+def _collect(videos: list[Path], workers: int, segment_frames: int, warmup: int,
+             sampling: Sampling) -> tuple[dict, float]:
+    """跑一次分析並回傳 ({(影片, 影格): (landmarks, 是否推論)}, 耗時秒數)"""
+    results = {}
+    start = time.perf_counter()
+    for chunk in iter_pose_chunks(videos, workers, segment_frames, warmup, sampling):
+        for index, points, inferred in zip(chunk.frames, chunk.points, chunk.inferred):
+            results[(chunk.video, int(index))] = (points, bool(inferred))
+    return results, time.perf_counter() - start
+
+
+def evaluate_sampling(videos: list[Path], sampling: Sampling, workers: int = 1,
+                      segment_frames: int = 300, warmup: int = 60) -> None:
+    """與每格都推論的結果比較：速度、推論比例，以及內插造成的誤差"""
+    total_frames = sum(count_frames(video_path) for video_path in videos)
+    full, full_time = _collect(videos, workers, segment_frames, warmup, FULL_SAMPLING)
+    sampled, sampled_time = _collect(videos, workers, segment_frames, warmup, sampling)
+
+    common = sorted(full.keys() & sampled.keys())
+    if not common:
+        print("兩次分析沒有共同的偵測影格，無法比較")
+        return
+    reference = np.stack([full[key][0] for key in common])
+    estimate = np.stack([sampled[key][0] for key in common])
+    inferred = np.array([sampled[key][1] for key in common])
+
+    # 角度在 0°/360° 附近會繞回，先換算成 -180°~180° 的差值
+    angle_error = np.abs((torso_angles(estimate) - torso_angles(reference) + 180) % 360 - 180)
+    # 關節點位移：x、y 為 0~1 的歸一化座標，乘 100 代表佔畫面寬/高的百分比
+    point_error = np.hypot(*(estimate[:, :, :2] - reference[:, :, :2]).transpose(2, 0, 1)) * 100
+
+    inference_count = sum(inferred for _, inferred in sampled.values())
+    print(f"每格推論：{total_frames / full_time:.1f} frames/sec（{full_time:.1f} 秒）")
+    print(f"取樣模式：{total_frames / sampled_time:.1f} frames/sec（{sampled_time:.1f} 秒），"
+          f"加速 {full_time / sampled_time:.2f}x，實際推論 {inference_count}/{len(sampled)} 格")
+    print(f"比較影格：{len(common)}（僅每格推論有 {len(full.keys() - sampled.keys())} 格、"
+          f"僅取樣模式有 {len(sampled.keys() - full.keys())} 格）")
+    for label, mask in (("全部", np.ones_like(inferred)), ("內插", ~inferred), ("推論", inferred)):
+        if not mask.any():
+            continue
+        angles = angle_error[mask]
+        points = point_error[mask]
+        print(f"  {label} {mask.sum():4d} 格｜軀幹角度誤差 平均 {angles.mean():.2f}° "
+              f"p95 {np.percentile(angles, 95):.2f}° 最大 {angles.max():.2f}°｜"
+              f"關節點位移 平均 {points.mean():.2f}% p95 {np.percentile(points, 95):.2f}%")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="影片批次姿勢摘要")
+    parser.add_argument("videos", nargs="*", type=Path,
+                        help="要分析的影片（預設為 video 資料夾內所有 mp4）")
+    parser.add_argument("-w", "--workers", type=int, default=1,
+                        help="行程數；大於 1 時會把影片切段平行處理")
+    parser.add_argument("--segment-frames", type=int, default=300, help="每段影格數")
+    parser.add_argument("--warmup", type=int, default=60,
+                        help="每段開頭額外處理、但不輸出的暖機影格數（讓追蹤先穩定）")
+    parser.add_argument("--benchmark", type=int, nargs="+", metavar="WORKERS",
+                        help="比較多種 worker 數量的 frames/sec，例如 --benchmark 1 2 4")
+    parser.add_argument("--landmarks", choices=sorted(LANDMARK_WRITERS),
+                        help="另外輸出每格 33 個關節點的完整座標 (npz 或 parquet)")
+    parser.add_argument("--landmarks-dir", type=Path, default=None,
+                        help="關節點檔案輸出資料夾（預設 DAY2/pose_landmarks）")
+    parser.add_argument("--stride", type=int, default=1,
+                        help="每隔幾格跑一次 Pose，中間影格以線性內插補齊（預設 1 = 每格都跑）")
+    parser.add_argument("--motion-threshold", type=float, default=None,
+                        help="自適應取樣：64 px 縮圖的平均灰階差超過此值就提早推論，"
+                             "此時 --stride 為最長間隔")
+    parser.add_argument("--evaluate", action="store_true",
+                        help="與每格推論的結果比較速度與誤差")
+    parser.add_argument("--cache-dir", type=Path, default=DEFAULT_CACHE_DIR,
+                        help="每支影片結果分片的快取資料夾（預設 DAY2/.cache/pose_report）")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="不讀寫快取，所有影片重新處理")
+    args = parser.parse_args()
+    if args.stride < 1:
+        parser.error("--stride 必須 >= 1")
+    if args.motion_threshold is not None and args.stride == 1:
+        parser.error("--motion-threshold 需要搭配 --stride N (N > 1) 作為最長間隔")
+    if args.evaluate and args.stride == 1:
+        parser.error("--evaluate 需要搭配 --stride 才有東西可以比較")
+    return args
+
+
 def main() -> None:
     """建立影片的簡易姿勢角度紀錄"""
+    args = parse_args()
     video_dir = Path(__file__).resolve().parent.parent / "video"
-    videos = sorted(video_dir.glob("*.mp4"))
+    videos = args.videos or sorted(video_dir.glob("*.mp4"))
     if not videos:
         raise FileNotFoundError("請在 video 資料夾準備 mp4 示範影片")
+    sampling = Sampling(args.stride, args.motion_threshold)
+
+    if args.benchmark:
+        benchmark(videos, args.benchmark, args.segment_frames, args.warmup)
+        return
+    if args.evaluate:
+        evaluate_sampling(videos, sampling, args.workers, args.segment_frames, args.warmup)
+        return
+
+    writer = None
+    if args.landmarks:
+        landmarks_dir = args.landmarks_dir or Path(__file__).resolve().parent / "pose_landmarks"
+        landmarks_dir.mkdir(parents=True, exist_ok=True)
+        writer = LANDMARK_WRITERS[args.landmarks](landmarks_dir)
 
-    pose = mp.solutions.pose.Pose()
     csv_path = Path(__file__).resolve().parent / "pose_report.csv"
     with csv_path.open("w", newline="", encoding="utf-8") as csv_file:
-        writer = csv.writer(csv_file)
-        writer.writerow(["video", "frame", "torso_angle_degree"])
-
-        for video_path in videos:
-            for index, frame in iter_video_frames(video_path):
-                rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                result = pose.process(rgb)
-                if not result.pose_landmarks:
-                    continue
-
-                landmarks = result.pose_landmarks.landmark
-                shoulder_center = (
-                    (landmarks[11].x + landmarks[12].x) / 2,
-                    (landmarks[11].y + landmarks[12].y) / 2,
-                )
-                hip_center = (
-                    (landmarks[23].x + landmarks[24].x) / 2,
-                    (landmarks[23].y + landmarks[24].y) / 2,
-                )
-                dx = hip_center[0] - shoulder_center[0]
-                dy = hip_center[1] - shoulder_center[1]
-                # 使用 fastAtan2 快速求出軀幹傾斜角度 (度數)
-                angle = cv2.fastAtan2(dy, dx)
-                writer.writerow([video_path.name, index, round(angle, 2)])
+        csv_writer = csv.writer(csv_file)
+        header = ["video", "frame", "torso_angle_degree"]
+        # 取樣模式多一欄 source，標示該列是實際推論 (inferred) 還是內插 (interpolated)
+        csv_writer.writerow(header + ["source"] if sampling.enabled else header)
+        if args.no_cache:
+            chunks = iter_pose_chunks(videos, args.workers, args.segment_frames, args.warmup,
+                                      sampling)
+        else:
+            chunks = iter_cached_chunks(videos, args.cache_dir, args.workers,
+                                        args.segment_frames, args.warmup, sampling)
+        for chunk in chunks:
+            csv_writer.writerows(chunk.csv_rows(with_source=sampling.enabled))
+            if writer is not None:
+                writer.write(chunk)
+    if writer is not None:
+        writer.close()
+        for path in writer.paths:
+            print(f"關節點資料已輸出到 {path}")
 
     print(f"統計表已輸出到 {csv_path.name}")
 
@@ -0,0 +1,124 @@
+"""Day 2：即時迴圈的分段計時器"""
+from __future__ import annotations
+from pathlib import Path
+import json
+import time
+
+# Author: harry123180
+
+try:
+    import cv2
+    import numpy as np
+except ImportError as exc:  # pragma: no cover
+    raise SystemExit("請先安裝 opencv-python 與 numpy 套件") from exc
+
+# 環形緩衝區保留最近幾格的耗時，約為 30 FPS 下 20 秒
+DEFAULT_CAPACITY = 600
+# 疊圖上的百分位數每隔幾格才重新計算一次
+OVERLAY_REFRESH = 15
+PERCENTILES = (50, 95, 99)
+
+
+class StageTimer:
+    """記錄每一格各階段耗時的輕量計時器
+
+    用法：每格開頭呼叫 start_frame()，每個階段結束時呼叫 lap("階段名稱")，
+    最後呼叫 end_frame()。耗時寫入固定大小的環形緩衝區，不會隨執行時間增加記憶體。
+    """
+
+    def __init__(self, stages: tuple[str, ...], capacity: int = DEFAULT_CAPACITY) -> None:
+        self.stages = stages
+        self._index = {name: i for i, name in enumerate(stages)}
+        # 最後一欄為整格總耗時 (ns)
+        self._buffer = np.zeros((capacity, len(stages) + 1), dtype=np.int64)
+        self._row = np.zeros(len(stages) + 1, dtype=np.int64)
+        self._totals = np.zeros(len(stages) + 1, dtype=np.int64)
+        self._position = 0
+        self.frames = 0
+        self._frame_start = self._last = 0
+        self._overlay_lines: list[str] = []
+        self.lap_cost_ns = self._measure_lap_cost()
+
+    def start_frame(self) -> None:
+        self._row[:] = 0
+        self._frame_start = self._last = time.perf_counter_ns()
+
+    def lap(self, stage: str) -> None:
+        """把上一次 lap（或 start_frame）到現在的時間記到 stage；同一格可重複累加"""
+        now = time.perf_counter_ns()
+        self._row[self._index[stage]] += now - self._last
+        self._last = now
+
+    def current_ms(self, stage: str) -> float:
+        """目前這一格某階段已累計的耗時 (毫秒)"""
+        return self._row[self._index[stage]] / 1e6
+
+    def end_frame(self) -> None:
+        self._row[-1] = time.perf_counter_ns() - self._frame_start
+        self._buffer[self._position] = self._row
+        self._totals += self._row
+        self._position = (self._position + 1) % len(self._buffer)
+        self.frames += 1
+
+    def _window(self) -> np.ndarray:
+        """環形緩衝區內的有效資料 (毫秒)"""
+        return self._buffer[:min(self.frames, len(self._buffer))] / 1e6
+
+    def summary(self) -> dict:
+        """各階段在最近視窗內的百分位數，以及整段執行期間的平均"""
+        window = self._window()
+        names = list(self.stages) + ["total"]
+        stats = {}
+        for i, name in enumerate(names):
+            values = window[:, i]
+            entry = {"mean_ms_all": round(self._totals[i] / max(self.frames, 1) / 1e6, 3)}
+            if len(values):
+                entry["mean_ms"] = round(float(values.mean()), 3)
+                for q, value in zip(PERCENTILES, np.percentile(values, PERCENTILES)):
+                    entry[f"p{q}_ms"] = round(float(value), 3)
+                entry["max_ms"] = round(float(values.max()), 3)
+            stats[name] = entry
+
+        mean_total = self._totals[-1] / max(self.frames, 1)
+        laps_per_frame = len(self.stages) + 2  # start_frame / end_frame 也各讀一次時鐘
+        return {
+            "frames": self.frames,
+            "window_frames": len(window),
+            "fps": round(1e9 / mean_total, 2) if mean_total else 0.0,
+            "timer_overhead_pct": round(100 * self.lap_cost_ns * laps_per_frame / mean_total, 4)
+            if mean_total else 0.0,
+            "stages": stats,
+        }
+
+    def draw_overlay(self, frame: np.ndarray, origin: tuple[int, int] = (20, 60)) -> None:
+        """在畫面上顯示各階段 p50 / p95 / p99（毫秒）"""
+        if self.frames and (not self._overlay_lines or self.frames % OVERLAY_REFRESH == 0):
+            stats = self.summary()["stages"]
+            self._overlay_lines = [
+                f"{name:8s} {entry['p50_ms']:6.1f} {entry['p95_ms']:6.1f} {entry['p99_ms']:6.1f}"
+                for name, entry in stats.items() if "p50_ms" in entry
+            ]
+        x, y = origin
+        lines = ["stage     p50    p95    p99 (ms)"] + self._overlay_lines
+        # 深色底框讓文字在亮背景上也看得清楚
+        cv2.rectangle(frame, (x - 5, y - 16), (x + 290, y + 20 * len(lines) - 12), (0, 0, 0), -1)
+        for i, line in enumerate(lines):
+            cv2.putText(frame, line, (x, y + i * 20), cv2.FONT_HERSHEY_PLAIN, 1.1,
+                        (255, 255, 255), 1, cv2.LINE_AA)
+
+    def dump(self, path: Path) -> dict:
+        summary = self.summary()
+        Path(path).write_text(json.dumps(summary, ensure_ascii=False, indent=2), encoding="utf-8")
+        return summary
+
+    @staticmethod
+    def _measure_lap_cost(samples: int = 2000) -> float:
+        """估計一次讀取時鐘加記錄的成本 (ns)，用來回報計時器本身的額外負擔"""
+        row = np.zeros(1, dtype=np.int64)
+        last = time.perf_counter_ns()
+        start = last
+        for _ in range(samples):
+            now = time.perf_counter_ns()
+            row[0] += now - last
+            last = now
+        return (time.perf_counter_ns() - start) / samples
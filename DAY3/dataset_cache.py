@@ -0,0 +1,181 @@
+﻿"""Day 3：把資料集預先 letterbox 成 memory-mapped 陣列，訓練時不必每個 epoch 重新解碼 JPEG"""
+from __future__ import annotations
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import argparse
+import hashlib
+import json
+import time
+
+# Author: harry123180
+
+try:
+    import cv2
+    import numpy as np
+except ImportError as exc:  # pragma: no cover
+    raise SystemExit("請先安裝 opencv-python 與 numpy 套件") from exc
+
+from detectors import letterbox
+from infer_image import DATASET_DIR, iter_split_images
+
+# 放在 .cache/ 底下，已被 .gitignore 排除
+DEFAULT_CACHE_ROOT = DATASET_DIR.parent / ".cache"
+SPLITS = ("train", "valid", "test")
+CACHE_VERSION = 1
+
+
+def cache_dir_for(imgsz: int, root: Path = DEFAULT_CACHE_ROOT) -> Path:
+    return root / f"memmap-{imgsz}"
+
+
+def split_fingerprint(paths: list[Path]) -> str:
+    """以檔名、大小、修改時間與標註檔內容計算指紋，資料集有變動時快取就會重建"""
+    digest = hashlib.sha256(f"v{CACHE_VERSION}".encode())
+    for path in paths:
+        stat = path.stat()
+        digest.update(f"{path.name}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+        label_path = path.parent.parent / "labels" / f"{path.stem}.txt"
+        if label_path.exists():
+            digest.update(label_path.read_bytes())
+    return digest.hexdigest()[:16]
+
+
+def _read_labels(image_path: Path) -> np.ndarray:
+    """YOLO 標註 (類別 cx cy w h)，歸一化到原圖大小"""
+    label_path = image_path.parent.parent / "labels" / f"{image_path.stem}.txt"
+    if not label_path.exists() or not label_path.stat().st_size:
+        return np.zeros((0, 5), dtype=np.float32)
+    return np.loadtxt(label_path, dtype=np.float32, ndmin=2)[:, :5]
+
+
+def _letterbox_file(path: Path, imgsz: int) -> tuple[np.ndarray, tuple[int, int], float, tuple[int, int]]:
+    image = cv2.imread(str(path))
+    if image is None:
+        raise FileNotFoundError(f"無法讀取圖片 {path}")
+    boxed, ratio, pad = letterbox(image, imgsz)
+    return boxed, image.shape[:2], ratio, pad
+
+
+def build_split(split: str, imgsz: int, cache_dir: Path, workers: int = 4) -> dict:
+    """解碼並 letterbox 一個資料夾的所有圖片，寫成 <split>_images.npy 與 <split>_labels.npz
+
+    影像存成 (N, imgsz, imgsz, 3) 的 uint8 BGR 陣列；標註換算到 letterbox 後的座標，
+    仍是歸一化的 (cx, cy, w, h)，以 offsets 索引每張圖的框。
+    """
+    paths = [path for _, path in iter_split_images([split])]
+    images_path = cache_dir / f"{split}_images.npy"
+    tmp_path = images_path.with_suffix(".tmp.npy")
+    images = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.uint8,
+                                       shape=(len(paths), imgsz, imgsz, 3))
+    orig_shapes = np.zeros((len(paths), 2), dtype=np.int32)
+    offsets = np.zeros(len(paths) + 1, dtype=np.int64)
+    cls_ids, boxes = [], []
+    # cv2.imread / resize 會釋放 GIL，用執行緒就能平行解碼
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = pool.map(lambda path: _letterbox_file(path, imgsz), paths)
+        for i, (path, (boxed, shape, ratio, (left, top))) in enumerate(zip(paths, results)):
+            images[i] = boxed
+            orig_shapes[i] = shape
+            labels = _read_labels(path)
+            height, width = shape
+            # 原圖歸一化座標 → 像素 → 加上補邊 → 以 imgsz 重新歸一化
+            xywh = labels[:, 1:5] * [width, height, width, height] * ratio
+            xywh[:, 0] += left
+            xywh[:, 1] += top
+            cls_ids.append(labels[:, 0])
+            boxes.append(xywh / imgsz)
+            offsets[i + 1] = offsets[i] + len(labels)
+    images.flush()
+    del images
+    tmp_path.replace(images_path)
+    np.savez(cache_dir / f"{split}_labels.npz",
+             files=np.array([str(path) for path in paths]),
+             orig_shapes=orig_shapes,
+             offsets=offsets,
+             cls=np.concatenate(cls_ids) if cls_ids else np.zeros(0, dtype=np.float32),
+             boxes=np.concatenate(boxes) if boxes else np.zeros((0, 4), dtype=np.float32))
+    return {"images": len(paths), "labels": int(offsets[-1]), "fingerprint": split_fingerprint(paths)}
+
+
+def build_cache(imgsz: int = 640, cache_dir: Path | None = None, splits: tuple[str, ...] = SPLITS,
+                force: bool = False, workers: int = 4) -> Path:
+    """建立（或沿用）memmap 快取；資料集指紋沒變就直接略過"""
+    cache_dir = cache_dir or cache_dir_for(imgsz)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    meta_path = cache_dir / "meta.json"
+    meta = json.loads(meta_path.read_text(encoding="utf-8")) if meta_path.exists() else {}
+    if meta.get("imgsz") != imgsz or meta.get("version") != CACHE_VERSION:
+        meta = {"version": CACHE_VERSION, "imgsz": imgsz, "splits": {}}
+
+    for split in splits:
+        paths = [path for _, path in iter_split_images([split])]
+        cached = meta["splits"].get(split)
+        if (not force and cached and cached["fingerprint"] == split_fingerprint(paths)
+                and (cache_dir / f"{split}_images.npy").exists()):
+            print(f"{split}：快取為最新（{cached['images']} 張），略過")
+            continue
+        start = time.perf_counter()
+        meta["splits"][split] = build_split(split, imgsz, cache_dir, workers)
+        # 每完成一個 split 就更新 meta，中途中斷也不會留下對不上的紀錄
+        meta_path.write_text(json.dumps(meta, ensure_ascii=False, indent=2), encoding="utf-8")
+        info = meta["splits"][split]
+        print(f"{split}：{info['images']} 張、{info['labels']} 個框，"
+              f"耗時 {time.perf_counter() - start:.2f} 秒")
+    return cache_dir
+
+
+class MemmapSplit:
+    """讀取 build_split 的輸出；影像陣列以唯讀 memmap 開啟，只有實際讀到的部分才會載入記憶體"""
+
+    def __init__(self, cache_dir: Path, split: str) -> None:
+        self.images_path = cache_dir / f"{split}_images.npy"
+        labels_path = cache_dir / f"{split}_labels.npz"
+        if not self.images_path.exists() or not labels_path.exists():
+            raise FileNotFoundError(f"找不到 {split} 的快取，請先執行 python dataset_cache.py")
+        with np.load(labels_path) as index:
+            self.files = [str(name) for name in index["files"]]
+            self.orig_shapes = index["orig_shapes"]
+            self.offsets = index["offsets"]
+            self.cls = index["cls"]
+            self.boxes = index["boxes"]
+        self._images = None
+
+    @property
+    def images(self) -> np.ndarray:
+        # DataLoader 的 worker 會複製這個物件，延後到第一次讀取時才開啟 memmap
+        if self._images is None:
+            self._images = np.load(self.images_path, mmap_mode="r")
+        return self._images
+
+    def __getstate__(self) -> dict:
+        # Windows 的 worker 以 pickle 傳遞 dataset，不要把整個陣列一起序列化
+        return {**self.__dict__, "_images": None}
+
+    def __len__(self) -> int:
+        return len(self.files)
+
+    def labels(self, i: int) -> tuple[np.ndarray, np.ndarray]:
+        """第 i 張圖的 (類別, 歸一化 xywh)"""
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return self.cls[start:end], self.boxes[start:end]
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="建立 letterbox 後的 memmap 資料集快取")
+    parser.add_argument("--imgsz", type=int, default=640, help="letterbox 的邊長，需與訓練的 imgsz 相同")
+    parser.add_argument("--cache-dir", type=Path, default=None,
+                        help="快取位置（預設 dataset/.cache/memmap-<imgsz>）")
+    parser.add_argument("--splits", nargs="+", default=list(SPLITS), help="要建立快取的資料夾")
+    parser.add_argument("--force", action="store_true", help="忽略既有快取，全部重建")
+    parser.add_argument("--workers", type=int, default=4, help="解碼圖片的執行緒數")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    cache_dir = build_cache(args.imgsz, args.cache_dir, tuple(args.splits), args.force, args.workers)
+    print(f"快取位於 {cache_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+﻿"""Day 3：YOLO 推論後端（Ultralytics PyTorch / ONNX Runtime）"""
+from __future__ import annotations
+from pathlib import Path
+import ast
+
+# Author: harry123180
+
+try:
+    import cv2
+    import numpy as np
+except ImportError as exc:  # pragma: no cover
+    raise SystemExit("請先安裝 opencv-python 與 numpy 套件") from exc
+
+# 與 Ultralytics predict 的預設值一致
+DEFAULT_IMGSZ = 640
+DEFAULT_CONF = 0.25
+DEFAULT_IOU = 0.7
+MAX_DET = 300
+# 補邊顏色 (114, 114, 114) 與 Ultralytics 的 LetterBox 相同
+PAD_VALUE = 114
+# 類別感知 NMS：每個類別的框平移這個距離，讓不同類別的框互不重疊
+CLASS_OFFSET = 7680
+
+
+def letterbox(image: np.ndarray, size: int = DEFAULT_IMGSZ) -> tuple[np.ndarray, float, tuple[int, int]]:
+    """等比例縮放後置中補邊成 size x size，回傳 (影像, 縮放比例, (左, 上) 補邊)
+
+    縮放與補邊的捨入方式、補邊顏色都和 Ultralytics 的 LetterBox 相同。
+    注意 .pt 後端 predict 時用的是對齊 stride 的矩形補邊，非正方形影像的輸入尺寸會和這裡不同。
+    """
+    height, width = image.shape[:2]
+    ratio = min(size / height, size / width)
+    new_width, new_height = round(width * ratio), round(height * ratio)
+    dw, dh = (size - new_width) / 2, (size - new_height) / 2
+    top, bottom = round(dh - 0.1), round(dh + 0.1)
+    left, right = round(dw - 0.1), round(dw + 0.1)
+    if (new_width, new_height) != (width, height):
+        image = cv2.resize(image, (new_width, new_height), interpolation=cv2.INTER_LINEAR)
+    image = cv2.copyMakeBorder(image, top, bottom, left, right, cv2.BORDER_CONSTANT,
+                               value=(PAD_VALUE, PAD_VALUE, PAD_VALUE))
+    return image, ratio, (left, top)
+
+
+def box_iou(box: np.ndarray, boxes: np.ndarray) -> np.ndarray:
+    """一個 xyxy 框對多個 xyxy 框的 IoU"""
+    x1 = np.maximum(box[0], boxes[:, 0])
+    y1 = np.maximum(box[1], boxes[:, 1])
+    x2 = np.minimum(box[2], boxes[:, 2])
+    y2 = np.minimum(box[3], boxes[:, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area = (box[2] - box[0]) * (box[3] - box[1])
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    return inter / np.maximum(area + areas - inter, 1e-9)
+
+
+def nms(boxes: np.ndarray, scores: np.ndarray, iou: float = DEFAULT_IOU) -> np.ndarray:
+    """貪婪 NMS，回傳保留下來的索引（依分數由高到低）"""
+    order = np.argsort(-scores, kind="stable")
+    keep = []
+    while order.size:
+        best = order[0]
+        keep.append(best)
+        if order.size == 1:
+            break
+        rest = order[1:]
+        order = rest[box_iou(boxes[best], boxes[rest]) <= iou]
+    return np.array(keep, dtype=np.int64)
+
+
+def batched_nms(boxes: np.ndarray, scores: np.ndarray, classes: np.ndarray,
+                iou: float = DEFAULT_IOU) -> np.ndarray:
+    """類別感知 NMS：依類別平移座標後只跑一次 NMS，不同類別的框不會互相抑制"""
+    if not len(boxes):
+        return np.zeros(0, dtype=np.int64)
+    offset = classes[:, None].astype(boxes.dtype) * CLASS_OFFSET
+    return nms(boxes + offset, scores, iou)
+
+
+def filter_detections(detections: np.ndarray, conf: float = DEFAULT_CONF,
+                      iou: float = DEFAULT_IOU) -> np.ndarray:
+    """對以寬鬆門檻取得的 N x 6 偵測結果，重新套用信心度門檻與類別感知 NMS（不必重跑模型）"""
+    detections = detections[detections[:, 4] > conf]
+    keep = batched_nms(detections[:, :4], detections[:, 4], detections[:, 5], iou)
+    return detections[keep]
+
+
+def draw_detections(image: np.ndarray, detections: np.ndarray, names: dict[int, str]) -> np.ndarray:
+    """在影像副本上畫出偵測框與「類別 信心度」"""
+    annotated = image.copy()
+    for x1, y1, x2, y2, confidence, cls_id in detections:
+        label = names.get(int(cls_id), str(int(cls_id)))
+        cv2.rectangle(annotated, (int(x1), int(y1)), (int(x2), int(y2)), (0, 255, 0), 2)
+        cv2.putText(annotated, f"{label} {confidence:.2f}", (int(x1), int(y1) - 8),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
+    return annotated
+
+
+class UltralyticsDetector:
+    """用 ultralytics.YOLO 載入 .pt 權重（PyTorch 後端）"""
+
+    backend = "torch"
+
+    def __init__(self, weights: Path, imgsz: int = DEFAULT_IMGSZ, device: str = "cpu") -> None:
+        try:
+            from ultralytics import YOLO
+        except ImportError as exc:
+            raise ImportError("請先安裝 ultralytics 套件：pip install ultralytics") from exc
+        self.weights = Path(weights)
+        self.imgsz = imgsz
+        self.device = device
+        self.model = YOLO(str(weights))
+        self.names: dict[int, str] = dict(self.model.names)
+
+    def detect(self, images: list[np.ndarray], conf: float = DEFAULT_CONF,
+               iou: float = DEFAULT_IOU) -> list[np.ndarray]:
+        """對一批 BGR 影像推論，每張圖回傳 N x 6 陣列 (x1, y1, x2, y2, conf, cls)"""
+        if not images:
+            return []  # Ultralytics 收到空的 source 會丟出 FileNotFoundError
+        # 傳入影像 list 時，Ultralytics 會把整批一起送進模型
+        results = self.model.predict(source=images, conf=conf, iou=iou, imgsz=self.imgsz,
+                                     device=self.device, verbose=False)
+        return [result.boxes.data.cpu().numpy().astype(np.float32) for result in results]
+
+
+class OnnxDetector:
+    """用 ONNX Runtime 執行 export_onnx.py 匯出的模型，前後處理全部以 NumPy 完成
+
+    不需要 import torch / ultralytics，啟動快也比較省記憶體。模型輸出為
+    (batch, 4 + 類別數, 候選框數)，前 4 個通道是 letterbox 座標下的 (cx, cy, w, h)。
+    """
+
+    backend = "onnx"
+
+    def __init__(self, weights: Path, imgsz: int = DEFAULT_IMGSZ, threads: int = 0) -> None:
+        try:
+            import onnxruntime as ort
+        except ImportError as exc:
+            raise ImportError("請先安裝 onnxruntime 套件：pip install onnxruntime") from exc
+        self.weights = Path(weights)
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = threads  # 0 代表由 ONNX Runtime 自行決定
+        self.session = ort.InferenceSession(str(weights), options, providers=["CPUExecutionProvider"])
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        batch, _, height, _ = model_input.shape
+        # 匯出時沒有開 dynamic 的模型，輸入大小與 batch 都是固定的
+        self.imgsz = height if isinstance(height, int) else imgsz
+        self.fixed_batch = batch if isinstance(batch, int) else None
+        metadata = self.session.get_modelmeta().custom_metadata_map
+        self.names: dict[int, str] = ast.literal_eval(metadata["names"]) if "names" in metadata else {}
+
+    def preprocess(self, images: list[np.ndarray]) -> tuple[np.ndarray, list[tuple[float, tuple[int, int]]]]:
+        """letterbox → BGR 轉 RGB → HWC 轉 NCHW → 0~1 的 float32"""
+        padded, transforms = [], []
+        for image in images:
+            boxed, ratio, pad = letterbox(image, self.imgsz)
+            padded.append(boxed)
+            transforms.append((ratio, pad))
+        blob = np.stack(padded)[..., ::-1].transpose(0, 3, 1, 2)
+        return np.ascontiguousarray(blob, dtype=np.float32) / 255.0, transforms
+
+    def postprocess(self, prediction: np.ndarray, ratio: float, pad: tuple[int, int],
+                    shape: tuple[int, ...], conf: float, iou: float) -> np.ndarray:
+        """單張圖的輸出 (4 + nc, N) → 信心度過濾 → NMS → 換算回原圖座標"""
+        prediction = prediction.T
+        scores_all = prediction[:, 4:]
+        cls_ids = scores_all.argmax(axis=1)
+        scores = scores_all[np.arange(len(cls_ids)), cls_ids]
+        mask = scores > conf
+        xywh, scores, cls_ids = prediction[mask, :4], scores[mask], cls_ids[mask]
+        boxes = np.empty_like(xywh)
+        boxes[:, :2] = xywh[:, :2] - xywh[:, 2:] / 2
+        boxes[:, 2:] = xywh[:, :2] + xywh[:, 2:] / 2
+        keep = batched_nms(boxes, scores, cls_ids, iou)[:MAX_DET]
+        boxes, scores, cls_ids = boxes[keep], scores[keep], cls_ids[keep]
+
+        boxes[:, [0, 2]] -= pad[0]
+        boxes[:, [1, 3]] -= pad[1]
+        boxes /= ratio
+        height, width = shape[:2]
+        boxes[:, [0, 2]] = boxes[:, [0, 2]].clip(0, width)
+        boxes[:, [1, 3]] = boxes[:, [1, 3]].clip(0, height)
+        return np.column_stack([boxes, scores, cls_ids]).astype(np.float32)
+
+    def detect(self, images: list[np.ndarray], conf: float = DEFAULT_CONF,
+               iou: float = DEFAULT_IOU) -> list[np.ndarray]:
+        """對一批 BGR 影像推論，每張圖回傳 N x 6 陣列 (x1, y1, x2, y2, conf, cls)"""
+        if not images:
+            return []
+        # 固定 batch 的模型每次都要送滿 fixed_batch 張
+        step = self.fixed_batch or len(images)
+        detections = []
+        for start in range(0, len(images), step):
+            chunk = images[start:start + step]
+            blob, transforms = self.preprocess(chunk)
+            if self.fixed_batch and len(chunk) < self.fixed_batch:
+                # 固定 batch 的模型：最後不滿一批時補上全 0 的影像，補上的輸出直接丟掉
+                filler = np.zeros((self.fixed_batch - len(chunk), *blob.shape[1:]), dtype=blob.dtype)
+                blob = np.concatenate([blob, filler])
+            outputs = self.session.run(None, {self.input_name: blob})[0][:len(chunk)]
+            for prediction, (ratio, pad), image in zip(outputs, transforms, chunk):
+                detections.append(self.postprocess(prediction, ratio, pad, image.shape, conf, iou))
+        return detections
+
+
+def load_detector(weights: Path, imgsz: int = DEFAULT_IMGSZ, device: str = "cpu"):
+    """依副檔名選擇後端：.onnx 用 ONNX Runtime，其餘（.pt）用 Ultralytics"""
+    weights = Path(weights)
+    if not weights.exists():
+        hint = "請先執行 python export_onnx.py 匯出模型" if weights.suffix == ".onnx" else "請先完成訓練或下載權重"
+        raise FileNotFoundError(f"找不到權重 {weights}，{hint}")
+    if weights.suffix.lower() == ".onnx":
+        return OnnxDetector(weights, imgsz)
+    return UltralyticsDetector(weights, imgsz, device)
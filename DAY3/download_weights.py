@@ -1,35 +1,70 @@
-﻿"""Day 3：下載 YOLO 權重"""
+﻿"""Day 3：下載 YOLO 權重並登錄到 models/registry.json"""
 from __future__ import annotations
 from pathlib import Path
+import argparse
 
 # Author: harry123180
 
-try:
-    from ultralytics import YOLO
-except ImportError as exc:  # pragma: no cover
-    raise SystemExit("請先安裝 ultralytics 套件：pip install ultralytics") from exc
+from model_registry import ModelRegistry
 
+WEIGHT_NAME = "yolo11n.pt"
 
-def main() -> None:
-    """下載 yolo11n 預訓練權重供課堂使用"""
-    target = Path(__file__).resolve().parent / "models"
-    target.mkdir(exist_ok=True)
 
-    weight_path = target / "yolo11n.pt"
-    if weight_path.exists():
-        print("預訓練權重已存在，略過下載")
-        return
+def download(registry: ModelRegistry) -> Path:
+    """透過 Ultralytics 下載權重，再安裝到 models/（hardlink 或串流複製，不整檔讀進記憶體）"""
+    try:
+        from ultralytics import YOLO
+        from ultralytics.utils import WEIGHTS_DIR
+    except ImportError as exc:  # pragma: no cover
+        raise SystemExit("請先安裝 ultralytics 套件：pip install ultralytics") from exc
 
     # 透過 YOLO 類別讀取模型時會自動下載缺少的權重
-    print("正在下載 yolo11n.pt，首次執行需稍候片刻...")
-    YOLO("yolo11n.pt")
-    cache_dir = Path.home() / ".ultralytics" / "models"
-    candidates = list(cache_dir.glob("yolo11n.pt"))
-    if not candidates:
+    print(f"正在下載 {WEIGHT_NAME}，首次執行需稍候片刻...")
+    try:
+        model = YOLO(WEIGHT_NAME)
+    except OSError as exc:
+        raise SystemExit("下載失敗，離線環境請改用 python download_weights.py --from-dir <權重資料夾>") from exc
+    # 不同版本的 Ultralytics 會把權重放在目前目錄或設定中的 weights 資料夾
+    candidates = [Path(model.ckpt_path or ""), Path.cwd() / WEIGHT_NAME, WEIGHTS_DIR / WEIGHT_NAME,
+                  Path.home() / ".ultralytics" / "models" / WEIGHT_NAME]
+    source = next((path for path in candidates if path.is_file()), None)
+    if source is None:
         raise RuntimeError("找不到下載後的模型，請確認 ultralytics 是否完成下載")
+    return registry.install(source, WEIGHT_NAME, origin="ultralytics")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="下載並登錄 YOLO 權重")
+    parser.add_argument("--from-dir", type=Path, default=None,
+                        help="離線安裝：從本機資料夾（例如隨身碟）安裝所有 .pt / .onnx，不連網")
+    parser.add_argument("--verify", action="store_true", help="重新計算所有已登錄模型的 sha256")
+    parser.add_argument("--list", action="store_true", help="列出登錄表內容")
+    return parser.parse_args()
+
+
+def main() -> None:
+    """下載 yolo11n 預訓練權重供課堂使用"""
+    args = parse_args()
+    registry = ModelRegistry()
+
+    if args.from_dir is not None:
+        for path in registry.install_from_dir(args.from_dir):
+            entry = registry.models[path.name]
+            print(f"已安裝 {path.name}（{entry['install']}，sha256 {entry['sha256'][:12]}…）")
+    elif args.verify or args.list:
+        pass  # 只檢查或列出，不下載
+    elif registry.resolve(WEIGHT_NAME) is not None:
+        print("預訓練權重已存在，略過下載")
+    else:
+        path = download(registry)
+        print(f"權重已安裝到 {path}（{registry.models[WEIGHT_NAME]['install']}）")
 
-    weight_path.write_bytes(candidates[0].read_bytes())
-    print(f"權重已複製到 {weight_path}")
+    if args.verify:
+        for name in list(registry.models):
+            print(f"{name}：{'OK' if registry.verify(name, force=True) else '檔案遺失或 sha256 不符'}")
+    if args.list:
+        for name, entry in registry.models.items():
+            print(f"{name:20s} {entry['size'] / 1e6:7.1f} MB  {entry['sha256'][:12]}  {entry['source']}")
 
 
 if __name__ == "__main__":
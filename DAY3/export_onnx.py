@@ -0,0 +1,122 @@
+﻿"""Day 3：把訓練好的權重匯出成 ONNX，並比較 PyTorch 與 ONNX Runtime"""
+from __future__ import annotations
+from pathlib import Path
+import argparse
+import time
+
+# Author: harry123180
+
+try:
+    import cv2
+    import numpy as np
+except ImportError as exc:  # pragma: no cover
+    raise SystemExit("請先安裝 opencv-python 與 numpy 套件") from exc
+
+from detectors import DEFAULT_CONF, OnnxDetector, UltralyticsDetector, box_iou
+from infer_image import WEIGHTS_DIR, find_weights, iter_split_images
+
+# 兩個後端的框 IoU 超過此值且類別相同，視為同一個偵測結果
+MATCH_IOU = 0.9
+
+
+def export(weights: Path, imgsz: int = 640, dynamic: bool = False) -> Path:
+    """用 Ultralytics 匯出 ONNX，檔案放在權重旁邊（best.pt → best.onnx）"""
+    try:
+        from ultralytics import YOLO
+    except ImportError as exc:  # pragma: no cover
+        raise SystemExit("請先安裝 ultralytics 套件：pip install ultralytics") from exc
+    # dynamic=False 時輸入固定為 1x3ximgszximgsz，ONNX Runtime 在 CPU 上最快
+    path = YOLO(str(weights)).export(format="onnx", imgsz=imgsz, dynamic=dynamic, simplify=True)
+    return Path(path)
+
+
+def match_detections(reference: np.ndarray, candidate: np.ndarray) -> list[tuple[float, float]]:
+    """以 reference 為準，找出 candidate 中同類別且 IoU 最高的框，回傳 [(IoU, 信心度差)]"""
+    matches = []
+    used = np.zeros(len(candidate), dtype=bool)
+    for box in reference:
+        same_class = (candidate[:, 5] == box[5]) & ~used
+        if not same_class.any():
+            continue
+        ious = np.where(same_class, box_iou(box[:4], candidate[:, :4]), 0.0)
+        best = int(ious.argmax())
+        if ious[best] >= MATCH_IOU:
+            used[best] = True
+            matches.append((float(ious[best]), abs(float(box[4] - candidate[best, 4]))))
+    return matches
+
+
+def _timed_detect(detector, image: np.ndarray, conf: float) -> tuple[np.ndarray, float]:
+    start = time.perf_counter()
+    detections = detector.detect([image], conf=conf)[0]
+    return detections, (time.perf_counter() - start) * 1000
+
+
+def compare(pt_path: Path, onnx_path: Path, splits: list[str], conf: float = DEFAULT_CONF) -> None:
+    """同一批圖片各跑一次兩個後端，比較單張延遲與偵測結果是否一致"""
+    images = [cv2.imread(str(path)) for _, path in iter_split_images(splits)]
+    if not images:
+        raise FileNotFoundError("資料集沒有圖片，請確認資料集完整")
+
+    start = time.perf_counter()
+    onnx_detector = OnnxDetector(onnx_path)
+    onnx_load = time.perf_counter() - start
+    start = time.perf_counter()
+    torch_detector = UltralyticsDetector(pt_path, imgsz=onnx_detector.imgsz)
+    torch_load = time.perf_counter() - start
+
+    # 暖機：第一次推論包含記憶體配置與圖最佳化，不列入統計
+    for detector in (torch_detector, onnx_detector):
+        detector.detect(images[:1], conf=conf)
+
+    torch_ms, onnx_ms = [], []
+    torch_count = onnx_count = 0
+    matches = []
+    for image in images:
+        torch_dets, elapsed = _timed_detect(torch_detector, image, conf)
+        torch_ms.append(elapsed)
+        onnx_dets, elapsed = _timed_detect(onnx_detector, image, conf)
+        onnx_ms.append(elapsed)
+        torch_count += len(torch_dets)
+        onnx_count += len(onnx_dets)
+        matches.extend(match_detections(torch_dets, onnx_dets))
+
+    print(f"{len(images)} 張圖（{', '.join(splits)}），輸入 {onnx_detector.imgsz}x{onnx_detector.imgsz}，conf={conf}")
+    print(f"  載入時間：PyTorch {torch_load:.2f} 秒、ONNX Runtime {onnx_load:.2f} 秒")
+    for label, latencies in (("PyTorch", np.array(torch_ms)), ("ONNX Runtime", np.array(onnx_ms))):
+        print(f"  {label:12s} 平均 {latencies.mean():6.1f} ms  p50 {np.percentile(latencies, 50):6.1f} ms  "
+              f"p95 {np.percentile(latencies, 95):6.1f} ms")
+    print(f"  ONNX Runtime 加速 {np.mean(torch_ms) / np.mean(onnx_ms):.2f} 倍")
+    print(f"  偵測框數：PyTorch {torch_count}、ONNX Runtime {onnx_count}，"
+          f"同類別且 IoU ≥ {MATCH_IOU} 的有 {len(matches)} 個")
+    if matches:
+        ious, conf_diffs = np.array(matches).T
+        print(f"  配對框平均 IoU {ious.mean():.4f}，信心度差異平均 {conf_diffs.mean():.4f} / 最大 {conf_diffs.max():.4f}")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="匯出 ONNX 並比較 PyTorch / ONNX Runtime")
+    parser.add_argument("--weights", type=Path, default=None,
+                        help="要匯出的 .pt 權重（預設 runs/demo_yolo11/weights/best.pt）")
+    parser.add_argument("--imgsz", type=int, default=640, help="匯出的輸入大小")
+    parser.add_argument("--dynamic", action="store_true", help="匯出可變 batch / 輸入大小的模型")
+    parser.add_argument("--compare", action="store_true", help="匯出後比較兩個後端的延遲與偵測結果")
+    parser.add_argument("--splits", nargs="+", default=["valid", "test"], help="比較時使用的資料夾")
+    parser.add_argument("--conf", type=float, default=DEFAULT_CONF, help="比較時的信心度門檻")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    weights = args.weights
+    if weights is None:
+        # 匯出驗證集表現最好的 best.pt；還沒有 best.pt 時才退回 last.pt
+        weights = WEIGHTS_DIR / "best.pt" if (WEIGHTS_DIR / "best.pt").exists() else find_weights()
+    onnx_path = export(weights, args.imgsz, args.dynamic)
+    print(f"已匯出 {onnx_path}")
+    if args.compare:
+        compare(weights, onnx_path, args.splits, args.conf)
+
+
+if __name__ == "__main__":
+    main()
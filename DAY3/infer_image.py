@@ -1,35 +1,229 @@
 ﻿"""Day 3：使用訓練後模型進行推論"""
 from __future__ import annotations
 from pathlib import Path
+import argparse
+import csv
+import json
+import time
 
 # Author: harry123180
 
 try:
-    from ultralytics import YOLO
+    import cv2
+    import numpy as np
 except ImportError as exc:  # pragma: no cover
-    raise SystemExit("請先安裝 ultralytics 套件：pip install ultralytics") from exc
+    raise SystemExit("請先安裝 opencv-python 與 numpy 套件") from exc
 
+from detectors import draw_detections, load_detector
 
-def main() -> None:
-    """對驗證集圖片進行推論並輸出帶標註的結果"""
-    day_dir = Path(__file__).resolve().parent
-    runs_dir = day_dir / "runs" / "demo_yolo11" / "weights"
-    weight_files = list(runs_dir.glob("last.pt")) or list(runs_dir.glob("best.pt"))
+DAY_DIR = Path(__file__).resolve().parent
+WEIGHTS_DIR = DAY_DIR / "runs" / "demo_yolo11" / "weights"
+DATASET_DIR = DAY_DIR / "dataset" / "extracted"
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png", ".bmp"}
+CSV_FIELDS = ["split", "image", "width", "height", "class_id", "class_name",
+              "confidence", "x1", "y1", "x2", "y2"]
+
+
+def find_weights() -> Path:
+    """找出訓練好的權重：runs/demo_yolo11/weights/ 內的 last.pt 或 best.pt"""
+    weight_files = list(WEIGHTS_DIR.glob("last.pt")) or list(WEIGHTS_DIR.glob("best.pt"))
     if not weight_files:
         raise FileNotFoundError("請先完成訓練，在 runs/demo_yolo11/weights/ 找不到模型")
+    return weight_files[0]
+
+
+def iter_split_images(splits: list[str]):
+    """依序 yield (split, 圖片路徑)，不會一次列出全部檔案"""
+    for split in splits:
+        image_dir = DATASET_DIR / split / "images"
+        if not image_dir.is_dir():
+            raise FileNotFoundError(f"找不到 {image_dir}，請確認資料集完整")
+        for path in sorted(image_dir.iterdir()):
+            if path.suffix.lower() in IMAGE_SUFFIXES:
+                yield split, path
+
+
+def iter_batches(items, batch_size: int):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def default_weights(backend: str) -> Path:
+    """torch 用訓練輸出的 .pt；onnx 用 export_onnx.py 匯出的 best.onnx"""
+    if backend == "onnx":
+        return WEIGHTS_DIR / "best.onnx"
+    return find_weights()
+
+
+def result_to_record(split: str, path: Path, shape: tuple[int, ...], detections: np.ndarray,
+                     names: dict[int, str]) -> dict:
+    """把單張圖的偵測結果 (N x 6 陣列) 整理成可寫入 JSONL 的 dict"""
+    height, width = shape[:2]
+    detections = [
+        {
+            "class_id": int(cls_id),
+            "class_name": names.get(int(cls_id), str(int(cls_id))),
+            "confidence": round(float(conf), 4),
+            "x1": round(float(x1), 1), "y1": round(float(y1), 1),
+            "x2": round(float(x2), 1), "y2": round(float(y2), 1),
+        }
+        for x1, y1, x2, y2, conf, cls_id in detections.tolist()
+    ]
+    return {"split": split, "image": path.name, "width": width, "height": height,
+            "detections": detections}
+
+
+class DetectionWriter:
+    """依副檔名寫成 JSONL（每張圖一行）或 CSV（每個框一列）"""
+
+    def __init__(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.is_csv = path.suffix.lower() == ".csv"
+        self._file = path.open("w", newline="", encoding="utf-8")
+        if self.is_csv:
+            self._csv = csv.DictWriter(self._file, fieldnames=CSV_FIELDS)
+            self._csv.writeheader()
+
+    def write(self, record: dict) -> None:
+        if not self.is_csv:
+            self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            return
+        image_fields = {key: record[key] for key in ("split", "image", "width", "height")}
+        for detection in record["detections"]:
+            self._csv.writerow({**image_fields, **detection})
+
+    def close(self) -> None:
+        self._file.close()
 
-    model = YOLO(str(weight_files[0]))
 
-    valid_images = sorted((day_dir / "dataset/extracted" / "valid" / "images").glob("*.*"))
+def predict_batches(detector, splits: list[str], batch_size: int, output: Path,
+                    save_dir: Path | None = None, conf: float = 0.25) -> None:
+    """把各 split 的圖片分批送進 detector.detect，結果寫到單一 JSONL / CSV 檔
+
+    讀不到的圖片（損毀或格式不支援）會印出警告並略過，不會中斷整批推論。
+    """
+    skipped = 0
+
+    def readable_items():
+        nonlocal skipped
+        for split, path in iter_split_images(splits):
+            image = cv2.imread(str(path))
+            if image is None:
+                skipped += 1
+                print(f"無法讀取 {path}，略過")
+                continue
+            yield split, path, image
+
+    items = readable_items()
+    first = next(items, None)
+    if first is None:
+        raise FileNotFoundError("資料集沒有可讀取的圖片，請確認資料集完整")
+    # 先用第一張圖暖機，避免模型初始化時間算進第一批的延遲
+    detector.detect([first[2]], conf=conf)
+
+    def all_items():
+        yield first
+        yield from items
+
+    if save_dir is not None:
+        save_dir.mkdir(parents=True, exist_ok=True)
+    writer = DetectionWriter(output)
+    batch_latencies = []
+    image_count = detection_count = 0
+    start = time.perf_counter()
+    try:
+        for batch in iter_batches(all_items(), batch_size):
+            images = [image for _, _, image in batch]
+            batch_start = time.perf_counter()
+            results = detector.detect(images, conf=conf)
+            batch_latencies.append(time.perf_counter() - batch_start)
+
+            for (split, path, image), detections in zip(batch, results):
+                record = result_to_record(split, path, image.shape, detections, detector.names)
+                writer.write(record)
+                detection_count += len(record["detections"])
+                if save_dir is not None:
+                    cv2.imwrite(str(save_dir / f"{split}_{path.stem}.jpg"),
+                                draw_detections(image, detections, detector.names))
+            image_count += len(batch)
+    finally:
+        writer.close()
+    elapsed = time.perf_counter() - start
+
+    latencies_ms = np.array(batch_latencies) * 1000
+    print(f"共 {image_count} 張圖、{detection_count} 個框，結果已寫入 {output}")
+    if skipped:
+        print(f"略過 {skipped} 張無法讀取的圖片")
+    print(f"{detector.backend} 後端 batch={batch_size}：{len(batch_latencies)} 批，每批延遲 "
+          f"平均 {latencies_ms.mean():.1f} ms / p50 {np.percentile(latencies_ms, 50):.1f} ms / "
+          f"p95 {np.percentile(latencies_ms, 95):.1f} ms")
+    print(f"整體吞吐量 {image_count / elapsed:.2f} images/sec（含讀圖與寫檔，耗時 {elapsed:.2f} 秒）")
+    if save_dir is not None:
+        print(f"標註圖已輸出到 {save_dir}")
+
+
+def predict_single(detector) -> None:
+    """對驗證集第一張圖片進行推論並輸出帶標註的結果"""
+    valid_images = sorted((DATASET_DIR / "valid" / "images").glob("*.*"))
     if not valid_images:
         raise FileNotFoundError("驗證集沒有圖片，請確認資料集完整")
 
     image_path = valid_images[0]
     print(f"對 {image_path.name} 進行推論")
 
-    # save=True 會自動輸出結果在 runs/predict 目錄
-    model.predict(source=str(image_path), save=True, name="demo_predict")
-    print("完成推論，請到 runs/demo_predict/ 查看結果圖檔")
+    image = cv2.imread(str(image_path))
+    detections = detector.detect([image])[0]
+    save_dir = DAY_DIR / "runs" / "demo_predict"
+    save_dir.mkdir(parents=True, exist_ok=True)
+    cv2.imwrite(str(save_dir / image_path.name), draw_detections(image, detections, detector.names))
+    print(f"完成推論（{detector.backend} 後端，{len(detections)} 個框），請到 runs/demo_predict/ 查看結果圖檔")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Day3 YOLO 推論")
+    parser.add_argument("--weights", type=Path, default=None,
+                        help="權重檔（預設 torch 用 runs/demo_yolo11/weights/ 內的 last.pt 或 best.pt，"
+                             "onnx 用同資料夾的 best.onnx）")
+    parser.add_argument("--backend", choices=["torch", "onnx"], default="torch",
+                        help="推論後端：torch 使用 Ultralytics，onnx 使用 ONNX Runtime（需先執行 export_onnx.py）")
+    parser.add_argument("--batch", action="store_true",
+                        help="批次模式：把 valid / test 全部圖片分批推論")
+    parser.add_argument("--splits", nargs="+", default=["valid", "test"],
+                        help="批次模式要處理的資料夾")
+    parser.add_argument("--batch-size", type=int, default=8, help="每批幾張圖")
+    parser.add_argument("--output", type=Path, default=DAY_DIR / "runs" / "batch_predict" / "detections.jsonl",
+                        help="偵測結果檔，副檔名 .jsonl 或 .csv")
+    parser.add_argument("--save-images", action="store_true", help="另外輸出帶框的標註圖")
+    parser.add_argument("--conf", type=float, default=0.25, help="信心度門檻")
+    parser.add_argument("--imgsz", type=int, default=640,
+                        help="推論時的輸入大小（onnx 後端以匯出時的大小為準）")
+    parser.add_argument("--device", default="cpu", help="torch 後端的推論裝置，例如 cpu 或 0（第一張 GPU）")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    weights = args.weights or default_weights(args.backend)
+    if args.backend == "onnx" and weights.suffix != ".onnx":
+        weights = weights.with_suffix(".onnx")
+    try:
+        detector = load_detector(weights, args.imgsz, args.device)
+    except ImportError as exc:
+        raise SystemExit(str(exc)) from exc
+
+    if not args.batch:
+        predict_single(detector)
+        return
+
+    save_dir = args.output.parent / "images" if args.save_images else None
+    predict_batches(detector, args.splits, max(args.batch_size, 1), args.output, save_dir, args.conf)
 
 
 if __name__ == "__main__":
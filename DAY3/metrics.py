@@ -0,0 +1,145 @@
+﻿"""Day 3：以 NumPy 計算偵測模型在資料集上的 mAP"""
+from __future__ import annotations
+from pathlib import Path
+
+# Author: harry123180
+
+try:
+    import cv2
+    import numpy as np
+except ImportError as exc:  # pragma: no cover
+    raise SystemExit("請先安裝 opencv-python 與 numpy 套件") from exc
+
+from infer_image import DATASET_DIR, iter_split_images
+
+# mAP50-95 使用的 10 個 IoU 門檻，與 COCO / Ultralytics 相同
+IOU_THRESHOLDS = np.linspace(0.5, 0.95, 10)
+# 評估時用很低的信心度門檻，才能畫出完整的 precision-recall 曲線
+EVAL_CONF = 0.001
+
+
+def load_labels(image_path: Path, width: int, height: int) -> np.ndarray:
+    """讀取 YOLO 標註（類別 cx cy w h，歸一化），回傳 M x 5 的 (cls, x1, y1, x2, y2) 像素座標"""
+    label_path = image_path.parent.parent / "labels" / f"{image_path.stem}.txt"
+    if not label_path.exists():
+        return np.zeros((0, 5), dtype=np.float32)
+    rows = np.loadtxt(label_path, dtype=np.float32, ndmin=2)
+    if not rows.size:
+        return np.zeros((0, 5), dtype=np.float32)
+    cls_ids, cx, cy, w, h = rows[:, :5].T
+    return np.column_stack([cls_ids, (cx - w / 2) * width, (cy - h / 2) * height,
+                            (cx + w / 2) * width, (cy + h / 2) * height])
+
+
+def box_iou_matrix(boxes1: np.ndarray, boxes2: np.ndarray) -> np.ndarray:
+    """兩組 xyxy 框兩兩之間的 IoU，形狀為 len(boxes1) x len(boxes2)"""
+    top_left = np.maximum(boxes1[:, None, :2], boxes2[None, :, :2])
+    bottom_right = np.minimum(boxes1[:, None, 2:], boxes2[None, :, 2:])
+    inter = np.clip(bottom_right - top_left, 0, None).prod(axis=2)
+    area1 = (boxes1[:, 2:] - boxes1[:, :2]).prod(axis=1)
+    area2 = (boxes2[:, 2:] - boxes2[:, :2]).prod(axis=1)
+    return inter / np.maximum(area1[:, None] + area2[None, :] - inter, 1e-9)
+
+
+def match_predictions(detections: np.ndarray, labels: np.ndarray) -> np.ndarray:
+    """判斷每個偵測框在各 IoU 門檻下是否為 TP，回傳 N x 10 的布林陣列
+
+    同類別的框才配對；每個標註與每個偵測框各自只能配對一次，IoU 高的優先。
+    """
+    correct = np.zeros((len(detections), len(IOU_THRESHOLDS)), dtype=bool)
+    if not len(detections) or not len(labels):
+        return correct
+    iou = box_iou_matrix(labels[:, 1:], detections[:, :4])
+    iou = iou * (labels[:, :1] == detections[None, :, 5])
+    for i, threshold in enumerate(IOU_THRESHOLDS):
+        label_idx, det_idx = np.nonzero(iou >= threshold)
+        if not len(label_idx):
+            continue
+        order = np.argsort(-iou[label_idx, det_idx], kind="stable")
+        label_idx, det_idx = label_idx[order], det_idx[order]
+        _, first = np.unique(det_idx, return_index=True)
+        label_idx, det_idx = label_idx[first], det_idx[first]
+        order = np.argsort(-iou[label_idx, det_idx], kind="stable")
+        _, first = np.unique(label_idx[order], return_index=True)
+        correct[det_idx[order][first], i] = True
+    return correct
+
+
+def match_labels(detections: np.ndarray, labels: np.ndarray, threshold: float = 0.5) -> np.ndarray:
+    """與 match_predictions 相同的一對一配對，改為回傳每個標註是否被找到（計算 recall 用）"""
+    matched = np.zeros(len(labels), dtype=bool)
+    if not len(detections) or not len(labels):
+        return matched
+    iou = box_iou_matrix(labels[:, 1:], detections[:, :4])
+    iou = iou * (labels[:, :1] == detections[None, :, 5])
+    label_idx, det_idx = np.nonzero(iou >= threshold)
+    order = np.argsort(-iou[label_idx, det_idx], kind="stable")
+    label_idx, det_idx = label_idx[order], det_idx[order]
+    _, first = np.unique(det_idx, return_index=True)
+    label_idx, det_idx = label_idx[first], det_idx[first]
+    matched[label_idx] = True
+    return matched
+
+
+def average_precision(recall: np.ndarray, precision: np.ndarray) -> float:
+    """以 101 點內插計算 PR 曲線下的面積（COCO 作法）"""
+    recall = np.concatenate([[0.0], recall, [1.0]])
+    precision = np.concatenate([[1.0], precision, [0.0]])
+    # precision 取右側最大值，讓曲線單調遞減
+    precision = np.flip(np.maximum.accumulate(np.flip(precision)))
+    points = np.linspace(0, 1, 101)
+    values = np.interp(points, recall, precision)
+    return float(((values[1:] + values[:-1]) / 2 * np.diff(points)).sum())
+
+
+def compute_map(correct: np.ndarray, scores: np.ndarray, pred_cls: np.ndarray,
+                target_cls: np.ndarray) -> np.ndarray:
+    """依類別計算各 IoU 門檻的 AP，回傳 類別數 x 10 的陣列（只含有標註的類別）"""
+    order = np.argsort(-scores, kind="stable")
+    correct, pred_cls = correct[order], pred_cls[order]
+    classes = np.unique(target_cls)
+    ap = np.zeros((len(classes), len(IOU_THRESHOLDS)))
+    for ci, cls_id in enumerate(classes):
+        mask = pred_cls == cls_id
+        num_labels = int((target_cls == cls_id).sum())
+        if not mask.any():
+            continue
+        tp = np.cumsum(correct[mask], axis=0)
+        fp = np.cumsum(~correct[mask], axis=0)
+        recall = tp / num_labels
+        precision = tp / (tp + fp)
+        for i in range(len(IOU_THRESHOLDS)):
+            ap[ci, i] = average_precision(recall[:, i], precision[:, i])
+    return ap
+
+
+def evaluate_map(detector, splits: list[str], conf: float = EVAL_CONF) -> dict:
+    """在指定資料夾上跑 detector，回傳 mAP50、mAP50-95 與各類別 AP50
+
+    每個框只保留分數最高的類別（與實際推論相同），因此數值會略低於 `yolo val`
+    （驗證時每個框可同時對應多個類別）。
+    """
+    correct, scores, pred_cls, target_cls = [], [], [], []
+    for _, path in iter_split_images(splits):
+        image = cv2.imread(str(path))
+        detections = detector.detect([image], conf=conf)[0]
+        labels = load_labels(path, image.shape[1], image.shape[0])
+        correct.append(match_predictions(detections, labels))
+        scores.append(detections[:, 4])
+        pred_cls.append(detections[:, 5])
+        target_cls.append(labels[:, 0])
+
+    target_cls = np.concatenate(target_cls)
+    if not len(target_cls):
+        raise FileNotFoundError(f"{DATASET_DIR} 的 {splits} 沒有任何標註")
+    ap = compute_map(np.concatenate(correct), np.concatenate(scores),
+                     np.concatenate(pred_cls), target_cls)
+    classes = np.unique(target_cls).astype(int)
+    return {
+        "images": len(correct),
+        "labels": len(target_cls),
+        "map50": round(float(ap[:, 0].mean()), 4),
+        "map50_95": round(float(ap.mean()), 4),
+        "ap50_per_class": {detector.names.get(int(c), str(c)): round(float(v), 4)
+                           for c, v in zip(classes, ap[:, 0])},
+    }
@@ -0,0 +1,178 @@
+﻿"""Day 3：本機模型登錄表（名稱、路徑、sha256、大小、來源）"""
+from __future__ import annotations
+from datetime import datetime
+from pathlib import Path
+import hashlib
+import json
+import os
+import shutil
+
+# Author: harry123180
+
+DAY_DIR = Path(__file__).resolve().parent
+MODELS_DIR = DAY_DIR / "models"
+MANIFEST_NAME = "registry.json"
+MANIFEST_VERSION = 1
+# 自己訓練的權重會隨每次訓練改變，不登錄、直接依路徑尋找
+TRAINED_WEIGHTS_DIR = DAY_DIR / "runs" / "demo_yolo11" / "weights"
+# 依序尋找：自己訓練的 best → 登錄表中的預訓練權重
+DEFAULT_LOOKUP = ("best", "yolo11n")
+CHUNK_SIZE = 1 << 20  # 串流複製與計算雜湊時每次讀 1 MB
+
+
+def sha256_of(path: Path) -> str:
+    """分段讀取計算 sha256，不會把整個模型讀進記憶體"""
+    digest = hashlib.sha256()
+    with path.open("rb") as file:
+        for chunk in iter(lambda: file.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _stat_key(path: Path) -> dict:
+    stat = path.stat()
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+class ModelRegistry:
+    """models/registry.json 的讀寫與安裝
+
+    每個模型以檔名（例如 yolo11n.pt、yolo11n.onnx）為名稱登錄。驗證是延遲進行的：
+    檔案的大小與修改時間和上次驗證時相同，就沿用上次的結果，不必重新計算 sha256。
+    """
+
+    def __init__(self, models_dir: Path = MODELS_DIR) -> None:
+        self.models_dir = Path(models_dir)
+        self.manifest_path = self.models_dir / MANIFEST_NAME
+        self._manifest: dict | None = None
+
+    @property
+    def manifest(self) -> dict:
+        if self._manifest is None:
+            if self.manifest_path.exists():
+                self._manifest = json.loads(self.manifest_path.read_text(encoding="utf-8"))
+            else:
+                self._manifest = {"version": MANIFEST_VERSION, "models": {}}
+        return self._manifest
+
+    @property
+    def models(self) -> dict[str, dict]:
+        return self.manifest["models"]
+
+    def _save(self) -> None:
+        # 先寫暫存檔再取代，寫到一半中斷也不會留下損壞的登錄表
+        self.models_dir.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.manifest_path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(self.manifest, ensure_ascii=False, indent=2), encoding="utf-8")
+        os.replace(tmp_path, self.manifest_path)
+
+    def path_of(self, name: str) -> Path:
+        return self.models_dir / self.models[name]["path"]
+
+    def install(self, source: Path, name: str | None = None, origin: str = "local",
+                expected_sha256: str | None = None) -> Path:
+        """把 source 安裝到 models/<name> 並登錄
+
+        同一個檔案系統時用 hardlink（不複製任何資料）；跨磁碟或不支援時改為 1 MB 分段串流複製，
+        複製途中同時計算 sha256。
+        """
+        source = Path(source)
+        if not source.is_file():
+            raise FileNotFoundError(f"找不到模型檔 {source}")
+        name = name or source.name
+        target = self.models_dir / name
+        self.models_dir.mkdir(parents=True, exist_ok=True)
+
+        if target.exists() and os.path.samefile(source, target):
+            digest, method = sha256_of(target), "existing"
+        else:
+            tmp_path = target.with_name(f".{name}.tmp")
+            tmp_path.unlink(missing_ok=True)
+            try:
+                os.link(source, tmp_path)
+                digest, method = sha256_of(tmp_path), "hardlink"
+            except OSError:
+                digest, method = self._stream_copy(source, tmp_path), "copy"
+            if expected_sha256 and digest != expected_sha256:
+                tmp_path.unlink(missing_ok=True)
+                raise RuntimeError(f"{source} 的 sha256 與預期不符，可能下載不完整")
+            os.replace(tmp_path, target)
+
+        self.models[name] = {
+            "path": name,
+            "sha256": digest,
+            "size": target.stat().st_size,
+            "source": f"{origin}:{source}",
+            "install": method,
+            "installed_at": datetime.now().isoformat(timespec="seconds"),
+            "verified": _stat_key(target),
+        }
+        self._save()
+        return target
+
+    @staticmethod
+    def _stream_copy(source: Path, target: Path) -> str:
+        digest = hashlib.sha256()
+        with source.open("rb") as src, target.open("wb") as dst:
+            for chunk in iter(lambda: src.read(CHUNK_SIZE), b""):
+                digest.update(chunk)
+                dst.write(chunk)
+        shutil.copystat(source, target)
+        return digest.hexdigest()
+
+    def install_from_dir(self, directory: Path, suffixes: tuple[str, ...] = (".pt", ".onnx")) -> list[Path]:
+        """離線安裝：把資料夾內所有模型檔安裝到 models/"""
+        directory = Path(directory)
+        if not directory.is_dir():
+            raise FileNotFoundError(f"找不到資料夾 {directory}")
+        return [self.install(path, origin="dir") for path in sorted(directory.iterdir())
+                if path.suffix.lower() in suffixes]
+
+    def verify(self, name: str, force: bool = False) -> bool:
+        """檢查登錄的檔案是否存在且 sha256 相符；大小與修改時間沒變時直接沿用上次結果"""
+        entry = self.models.get(name)
+        if entry is None:
+            return False
+        path = self.path_of(name)
+        if not path.exists():
+            return False
+        stat_key = _stat_key(path)
+        if not force and entry.get("verified") == stat_key:
+            return True
+        if stat_key["size"] != entry["size"] or sha256_of(path) != entry["sha256"]:
+            entry.pop("verified", None)
+            self._save()
+            return False
+        entry["verified"] = stat_key
+        self._save()
+        return True
+
+    def resolve(self, name: str, verify: bool = True) -> Path | None:
+        """回傳已登錄且檢查通過的模型路徑，找不到或檔案損壞時回傳 None"""
+        if name not in self.models:
+            # 手動放進 models/ 的檔案：第一次查詢時補登錄
+            if not (self.models_dir / name).is_file():
+                return None
+            return self.install(self.models_dir / name, origin="found")
+        if verify and not self.verify(name):
+            return None
+        return self.path_of(name)
+
+
+def find_model(suffix: str = ".pt", names: tuple[str, ...] = DEFAULT_LOOKUP,
+               registry: ModelRegistry | None = None) -> Path | None:
+    """DAY3 / DAY6 共用的權重查詢：依 names 順序回傳第一個可用的 <name><suffix>
+
+    "best" 代表自己訓練的 runs/demo_yolo11/weights/best*；其他名稱查詢 models/ 的登錄表。
+    """
+    registry = registry or ModelRegistry()
+    for name in names:
+        if name == "best":
+            trained = TRAINED_WEIGHTS_DIR / f"best{suffix}"
+            if trained.exists():
+                return trained
+            continue
+        path = registry.resolve(f"{name}{suffix}")
+        if path is not None:
+            return path
+    return None
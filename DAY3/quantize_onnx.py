@@ -0,0 +1,181 @@
+"""Day 3：ONNX 模型 INT8 靜態量化，並比較 FP32 / INT8 的 mAP 與延遲"""
+from __future__ import annotations
+from pathlib import Path
+import argparse
+import json
+import re
+import time
+
+# Author: harry123180
+
+try:
+    import cv2
+    import numpy as np
+    import onnx
+    from onnxruntime.quantization import (CalibrationDataReader, CalibrationMethod, QuantFormat,
+                                          QuantType, quantize_static)
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+except ImportError as exc:  # pragma: no cover
+    raise SystemExit("請先安裝 onnx 與 onnxruntime 套件：pip install onnx onnxruntime") from exc
+
+from detectors import OnnxDetector
+from infer_image import DAY_DIR, WEIGHTS_DIR, iter_split_images
+from metrics import evaluate_map
+
+# 校正用的訓練集圖片張數上限；幾十張就足以估計各層的數值範圍
+CALIBRATION_IMAGES = 64
+
+
+class TrainImageReader(CalibrationDataReader):
+    """把訓練集圖片依推論時相同的 letterbox 前處理，逐張餵給量化校正"""
+
+    def __init__(self, detector: OnnxDetector, splits: list[str], limit: int) -> None:
+        self.detector = detector
+        self._paths = [path for _, path in iter_split_images(splits)][:limit]
+        self._iter = iter(self._paths)
+
+    def __len__(self) -> int:
+        return len(self._paths)
+
+    def get_next(self) -> dict | None:
+        path = next(self._iter, None)
+        if path is None:
+            return None
+        blob, _ = self.detector.preprocess([cv2.imread(str(path))])
+        return {self.detector.input_name: blob}
+
+    def rewind(self) -> None:
+        self._iter = iter(self._paths)
+
+
+def head_postprocess_nodes(model_path: Path) -> list[str]:
+    """找出偵測頭最後解碼框座標的節點（DFL、座標換算、Concat 等），這些節點保留 FP32
+
+    解碼後的座標是 0~640 的像素值，和類別分數 (0~1) 接在同一個輸出裡，
+    若一起量化成同一組 scale，分數會被壓到只剩幾個刻度。
+    """
+    names = [node.name for node in onnx.load(str(model_path)).graph.node]
+    indices = [int(match.group(1)) for name in names if (match := re.match(r"/model\.(\d+)/", name))]
+    if not indices:
+        return []
+    head = f"/model.{max(indices)}/"
+    # cv2.* / cv3.* 為框與類別分支的卷積，量化收益最大，仍然量化
+    return [name for name in names
+            if name.startswith(head) and not re.match(rf"{re.escape(head)}cv[23]\.", name)]
+
+
+def quantize(fp32_path: Path, int8_path: Path, splits: list[str], limit: int = CALIBRATION_IMAGES,
+             method: str = "minmax") -> Path:
+    """以訓練集做 post-training static quantization（QDQ 格式、權重逐通道 INT8）"""
+    detector = OnnxDetector(fp32_path)
+    reader = TrainImageReader(detector, splits, limit)
+    if not len(reader):
+        raise FileNotFoundError("找不到校正用的訓練集圖片，請確認資料集完整")
+
+    # 先做形狀推論與圖最佳化，量化工具才能正確判斷每個張量
+    prepared = int8_path.with_name(f"{fp32_path.stem}-prep.onnx")
+    quant_pre_process(str(fp32_path), str(prepared))
+    excluded = head_postprocess_nodes(prepared)
+    print(f"以 {len(reader)} 張 {', '.join(splits)} 圖片校正（{method}），偵測頭解碼的 {len(excluded)} 個節點保留 FP32")
+    start = time.perf_counter()
+    try:
+        quantize_static(
+            str(prepared), str(int8_path), reader,
+            quant_format=QuantFormat.QDQ,
+            per_channel=True,
+            activation_type=QuantType.QUInt8,
+            weight_type=QuantType.QInt8,
+            calibrate_method=CalibrationMethod.Percentile if method == "percentile" else CalibrationMethod.MinMax,
+            nodes_to_exclude=excluded,
+        )
+    finally:
+        prepared.unlink(missing_ok=True)
+    # ONNX 模型的類別名稱等 metadata 不會自動帶到量化後的模型
+    quantized = onnx.load(str(int8_path))
+    source = onnx.load(str(fp32_path))
+    onnx.helper.set_model_props(quantized, {prop.key: prop.value for prop in source.metadata_props})
+    onnx.save(quantized, str(int8_path))
+    print(f"量化完成（{time.perf_counter() - start:.1f} 秒），已輸出 {int8_path}")
+    return int8_path
+
+
+def measure_latency(detector: OnnxDetector, splits: list[str], repeats: int = 1) -> np.ndarray:
+    """每張圖的端到端延遲 (ms)，包含前處理、推論與 NMS"""
+    images = [cv2.imread(str(path)) for _, path in iter_split_images(splits)]
+    detector.detect(images[:1])  # 暖機
+    latencies = []
+    for _ in range(repeats):
+        for image in images:
+            start = time.perf_counter()
+            detector.detect([image])
+            latencies.append((time.perf_counter() - start) * 1000)
+    return np.array(latencies)
+
+
+def build_report(fp32_path: Path, int8_path: Path, splits: list[str], repeats: int) -> dict:
+    report = {"splits": splits, "models": {}}
+    for label, path in (("fp32", fp32_path), ("int8", int8_path)):
+        detector = OnnxDetector(path)
+        latencies = measure_latency(detector, splits, repeats)
+        report["models"][label] = {
+            "path": str(path),
+            "size_mb": round(path.stat().st_size / 1e6, 2),
+            **evaluate_map(detector, splits),
+            "latency_ms": {
+                "mean": round(float(latencies.mean()), 2),
+                "p50": round(float(np.percentile(latencies, 50)), 2),
+                "p95": round(float(np.percentile(latencies, 95)), 2),
+            },
+        }
+    fp32, int8 = report["models"]["fp32"], report["models"]["int8"]
+    report["speedup"] = round(fp32["latency_ms"]["mean"] / int8["latency_ms"]["mean"], 2)
+    report["map50_drop"] = round(fp32["map50"] - int8["map50"], 4)
+    report["map50_95_drop"] = round(fp32["map50_95"] - int8["map50_95"], 4)
+    return report
+
+
+def print_report(report: dict) -> None:
+    print(f"評估資料：{', '.join(report['splits'])}")
+    print(f"{'模型':6s} {'大小 MB':>8s} {'mAP50':>7s} {'mAP50-95':>9s} {'平均 ms':>8s} {'p50 ms':>7s} {'p95 ms':>7s}")
+    for label, entry in report["models"].items():
+        latency = entry["latency_ms"]
+        print(f"{label:6s} {entry['size_mb']:8.2f} {entry['map50']:7.4f} {entry['map50_95']:9.4f} "
+              f"{latency['mean']:8.1f} {latency['p50']:7.1f} {latency['p95']:7.1f}")
+    print(f"INT8 加速 {report['speedup']:.2f} 倍，mAP50 下降 {report['map50_drop'] * 100:.2f} 點、"
+          f"mAP50-95 下降 {report['map50_95_drop'] * 100:.2f} 點")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="ONNX INT8 靜態量化與 FP32 / INT8 比較報告")
+    parser.add_argument("--model", type=Path, default=WEIGHTS_DIR / "best.onnx",
+                        help="FP32 ONNX 模型（預設 export_onnx.py 輸出的 best.onnx）")
+    parser.add_argument("--output", type=Path, default=None, help="INT8 模型路徑（預設 <模型名稱>-int8.onnx）")
+    parser.add_argument("--calib-splits", nargs="+", default=["train"], help="校正用的資料夾")
+    parser.add_argument("--calib-images", type=int, default=CALIBRATION_IMAGES, help="校正圖片張數上限")
+    parser.add_argument("--calib-method", choices=["minmax", "percentile"], default="minmax",
+                        help="估計數值範圍的方法")
+    parser.add_argument("--eval-splits", nargs="+", default=["valid"], help="比較 mAP 與延遲的資料夾")
+    parser.add_argument("--repeats", type=int, default=3, help="延遲量測時每張圖重複幾次")
+    parser.add_argument("--report", type=Path, default=DAY_DIR / "runs" / "quantize" / "report.json",
+                        help="比較報告輸出位置 (JSON)")
+    parser.add_argument("--skip-quantize", action="store_true", help="沿用已存在的 INT8 模型，只產生報告")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    if not args.model.exists():
+        raise SystemExit(f"找不到 {args.model}，請先執行 python export_onnx.py")
+    int8_path = args.output or args.model.with_name(f"{args.model.stem}-int8.onnx")
+    if not args.skip_quantize:
+        quantize(args.model, int8_path, args.calib_splits, args.calib_images, args.calib_method)
+
+    report = build_report(args.model, int8_path, args.eval_splits, max(args.repeats, 1))
+    print_report(report)
+    args.report.parent.mkdir(parents=True, exist_ok=True)
+    args.report.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"報告已寫入 {args.report}")
+
+
+if __name__ == "__main__":
+    main()
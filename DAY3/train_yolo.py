@@ -1,38 +1,227 @@
 ﻿"""Day 3：訓練 YOLO11 模型"""
 from __future__ import annotations
+from functools import partial
 from pathlib import Path
+import argparse
+import json
+import math
+import time
 
 # Author: harry123180
 
 try:
     from ultralytics import YOLO
+    from ultralytics.data.dataset import YOLODataset
+    from ultralytics.models.yolo.detect import DetectionTrainer
+    from ultralytics.utils.torch_utils import unwrap_model
 except ImportError as exc:  # pragma: no cover
     raise SystemExit("請先安裝 ultralytics 套件：pip install ultralytics") from exc
 
+import cv2
+import numpy as np
+
+from dataset_cache import MemmapSplit, build_cache
+from model_registry import find_model
+
+DAY_DIR = Path(__file__).resolve().parent
+
+
+class MemmapYOLODataset(YOLODataset):
+    """從 dataset_cache.py 的 memmap 快取讀圖，取代每次解碼 JPEG
+
+    快取內的影像已 letterbox 成正方形，標註也已換算到同一座標系。
+    原圖是正方形時，快取影像與 JPEG 模式縮放後的影像相同，後續的 Mosaic 等增強也就不變；
+    非正方形的原圖會多出灰色補邊，因此 main() 會拒絕這種資料集（見 non_square_sources）。
+    """
+
+    def __init__(self, *args, memmap: MemmapSplit, **kwargs) -> None:
+        # 父類別的 __init__ 會呼叫 get_img_files / get_labels，要先準備好快取
+        self.memmap = memmap
+        super().__init__(*args, **kwargs)
+
+    def get_img_files(self, img_path) -> list[str]:
+        return list(self.memmap.files)
+
+    def get_labels(self) -> list[dict]:
+        size = self.memmap.images.shape[1:3]
+        labels = []
+        for i, im_file in enumerate(self.memmap.files):
+            cls_ids, boxes = self.memmap.labels(i)
+            labels.append({
+                "im_file": im_file,
+                "shape": size,
+                "cls": cls_ids.reshape(-1, 1).astype(np.float32),
+                "bboxes": boxes.astype(np.float32),
+                "segments": [],
+                "keypoints": None,
+                "normalized": True,
+                "bbox_format": "xywh",
+            })
+        return labels
+
+    def load_image(self, i: int, rect_mode: bool = True, resize_short: bool = False):
+        """與 BaseDataset.load_image 相同的縮放規則與回傳格式，只是影像改從 memmap 複製"""
+        if self.ims[i] is not None:
+            return self.ims[i], self.im_hw0[i], self.im_hw[i]
+        im = np.array(self.memmap.images[i])  # 複製一份，增強時可以安心修改
+        h0, w0 = im.shape[:2]
+        # 快取大小與訓練 imgsz 不同時（例如 --imgsz 改過但沒重建快取）仍可運作
+        if rect_mode:
+            if resize_short:
+                r = self.imgsz / min(h0, w0)
+                if r != 1:
+                    w, h = (math.ceil(w0 * r), self.imgsz) if h0 < w0 else (self.imgsz, math.ceil(h0 * r))
+                    im = cv2.resize(im, (w, h), interpolation=cv2.INTER_LINEAR)
+            else:
+                r = self.imgsz / max(h0, w0)
+                if r != 1:
+                    w, h = min(math.ceil(w0 * r), self.imgsz), min(math.ceil(h0 * r), self.imgsz)
+                    im = cv2.resize(im, (w, h), interpolation=cv2.INTER_LINEAR)
+        elif not (h0 == w0 == self.imgsz):
+            im = cv2.resize(im, (self.imgsz, self.imgsz), interpolation=cv2.INTER_LINEAR)
+        if self.augment and self.cache != "ram":
+            # Mosaic 會從 buffer 隨機挑其他圖片，維持與父類別相同的 buffer 行為
+            self.ims[i], self.im_hw0[i], self.im_hw[i] = im, (h0, w0), im.shape[:2]
+            self.buffer.append(i)
+            if 1 < len(self.buffer) >= self.max_buffer_length:
+                j = self.buffer.pop(0)
+                if self.cache != "ram":
+                    self.ims[j], self.im_hw0[j], self.im_hw[j] = None, None, None
+        return im, (h0, w0), im.shape[:2]
+
+
+def non_square_sources(cache_dir: Path, splits: tuple[str, ...]) -> list[str]:
+    """列出快取中原圖不是正方形的檔案；這些圖在 memmap 模式下的增強結果會與 JPEG 模式不同"""
+    files = []
+    for split in splits:
+        memmap = MemmapSplit(cache_dir, split)
+        files += [name for name, (height, width) in zip(memmap.files, memmap.orig_shapes) if height != width]
+    return files
+
+
+class MemmapDetectionTrainer(DetectionTrainer):
+    """訓練與驗證的 dataloader 都改用 MemmapYOLODataset"""
+
+    def __init__(self, *args, cache_dir: Path, **kwargs) -> None:
+        self.cache_dir = cache_dir
+        super().__init__(*args, **kwargs)
+
+    def build_dataset(self, img_path: str, mode: str = "train", batch: int | None = None):
+        # data.yaml 中的路徑形如 .../train/images，上一層資料夾名稱就是 split
+        split = Path(img_path).parent.name
+        stride = max(int(unwrap_model(self.model).stride.max()), 32)
+        return MemmapYOLODataset(
+            img_path=img_path,
+            imgsz=self.args.imgsz,
+            batch_size=batch,
+            augment=mode == "train",
+            hyp=self.args,
+            rect=self.args.rect or mode == "val",
+            cache=None,
+            single_cls=self.args.single_cls or False,
+            stride=stride,
+            pad=0.0 if mode == "train" else 0.5,
+            prefix=f"{mode} (memmap): ",
+            task=self.args.task,
+            classes=self.args.classes,
+            data=self.data,
+            fraction=self.args.fraction if mode == "train" else 1.0,
+            memmap=MemmapSplit(self.cache_dir, split),
+        )
+
+
+class EpochTimer:
+    """以 callback 記錄每個 epoch 的訓練時間（不含驗證）與含驗證的總時間"""
+
+    def __init__(self) -> None:
+        self.train_seconds: list[float] = []
+        self.total_seconds: list[float] = []
+        self._start = 0.0
+
+    def attach(self, model: YOLO) -> None:
+        model.add_callback("on_train_epoch_start", self._on_start)
+        model.add_callback("on_train_epoch_end", self._on_train_end)
+        model.add_callback("on_fit_epoch_end", self._on_fit_end)
+
+    def _on_start(self, trainer) -> None:
+        self._start = time.perf_counter()
+
+    def _on_train_end(self, trainer) -> None:
+        self.train_seconds.append(time.perf_counter() - self._start)
+
+    def _on_fit_end(self, trainer) -> None:
+        # 訓練結束後的最終驗證也會觸發這個 callback，只記錄有對應訓練的 epoch
+        if len(self.total_seconds) < len(self.train_seconds):
+            self.total_seconds.append(time.perf_counter() - self._start)
+
+    def summary(self, profile: str) -> dict:
+        # 第一個 epoch 包含 dataloader worker 啟動等一次性成本，平均時排除
+        steady = self.train_seconds[1:] or self.train_seconds
+        return {
+            "profile": profile,
+            "epochs": len(self.train_seconds),
+            "train_seconds": [round(value, 2) for value in self.train_seconds],
+            "total_seconds": [round(value, 2) for value in self.total_seconds],
+            "mean_train_seconds": round(float(np.mean(steady)), 2) if steady else None,
+        }
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Day3 YOLO11 訓練")
+    parser.add_argument("--profile", choices=["jpeg", "memmap"], default="jpeg",
+                        help="jpeg：每個 epoch 從 JPEG 解碼（原本的作法）；memmap：讀取預先 letterbox 的快取")
+    parser.add_argument("--weights", type=Path, default=None,
+                        help="起始權重（預設為登錄表中的 models/yolo11n.pt）；也可給 yolo11n.yaml 從頭訓練")
+    parser.add_argument("--epochs", type=int, default=20, help="訓練 epochs")
+    parser.add_argument("--imgsz", type=int, default=640, help="訓練輸入大小")
+    parser.add_argument("--device", default=None, help="訓練裝置，例如 cpu 或 0（預設自動選擇）")
+    parser.add_argument("--workers", type=int, default=8, help="dataloader worker 數")
+    parser.add_argument("--name", default="demo_yolo11", help="輸出到 runs/<name>")
+    return parser.parse_args()
+
 
 def main() -> None:
     """以 Roboflow 匯出的資料集進行快速微調"""
-    day_dir = Path(__file__).resolve().parent
-    data_yaml = day_dir / "dataset/extracted" / "data.yaml"
+    args = parse_args()
+    data_yaml = DAY_DIR / "dataset/extracted" / "data.yaml"
     if not data_yaml.exists():
         raise FileNotFoundError("找不到 data.yaml，請先解壓縮資料集")
 
-    weights = day_dir / "models" / "yolo11n.pt"
-    if not weights.exists():
-        raise FileNotFoundError("缺少預訓練權重，請先執行 download_weights.py")
+    weights = args.weights or find_model(".pt", names=("yolo11n",))
+    if weights is None or (weights.suffix == ".pt" and not weights.exists()):
+        raise FileNotFoundError("缺少預訓練權重（或檢查碼不符），請先執行 download_weights.py")
 
     model = YOLO(str(weights))
+    timer = EpochTimer()
+    timer.attach(model)
+
+    trainer = None
+    if args.profile == "memmap":
+        # 快取已是最新時只會檢查指紋，不會重新解碼
+        splits = ("train", "valid")
+        cache_dir = build_cache(args.imgsz, splits=splits)
+        if bad := non_square_sources(cache_dir, splits):
+            raise SystemExit(f"memmap 模式只支援正方形原圖，有 {len(bad)} 張不是（例如 {Path(bad[0]).name}），"
+                             "請改用 --profile jpeg")
+        trainer = partial(MemmapDetectionTrainer, cache_dir=cache_dir)
 
     # 以較少 epochs 做示範，避免課堂耗時過久
     model.train(
         data=str(data_yaml),
-        epochs=20,
-        imgsz=640,
-        project=str(day_dir / "runs"),
-        name="demo_yolo11",
+        epochs=args.epochs,
+        imgsz=args.imgsz,
+        device=args.device,
+        workers=args.workers,
+        project=str(DAY_DIR / "runs"),
+        name=args.name,
+        trainer=trainer,
     )
 
-    print("訓練完成，可在 runs/demo_yolo11/ 中找到成果")
+    summary = timer.summary(args.profile)
+    save_dir = Path(model.trainer.save_dir)
+    (save_dir / "epoch_times.json").write_text(json.dumps(summary, indent=2), encoding="utf-8")
+    print(f"[{args.profile}] 每個 epoch 平均訓練時間 {summary['mean_train_seconds']} 秒（不含第一個 epoch 與驗證）")
+    print(f"訓練完成，可在 {save_dir} 中找到成果")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,350 @@
+﻿"""Day 4：棋盤格相機校正，並預先計算去畸變映射表"""
+from __future__ import annotations
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+import argparse
+import json
+import os
+import time
+import cv2
+import numpy as np
+
+# Author: harry123180
+
+DAY_DIR = Path(__file__).resolve().parent
+CALIBRATION_IMAGES_DIR = DAY_DIR.parent / "calibration_chessboard"
+DEFAULT_OUTPUT = DAY_DIR / "output" / "camera_calibration.json"
+IMAGE_SUFFIXES = {".bmp", ".png", ".jpg", ".jpeg"}
+
+# 棋盤格「內角點」數量（每列, 每行）與每格邊長，請依實際使用的棋盤格修改
+PATTERN_SIZE = (9, 6)
+SQUARE_MM = 10.0
+# 粗偵測時把長邊縮到這個大小以下；在數百萬像素的原圖上 findChessboardCorners 很慢，
+# 找不到棋盤格（角度太斜、反光）時更可能耗上數十秒
+COARSE_MAX_SIDE = 1000
+CHESSBOARD_FLAGS = cv2.CALIB_CB_ADAPTIVE_THRESH | cv2.CALIB_CB_NORMALIZE_IMAGE
+SUBPIX_CRITERIA = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 30, 0.01)
+# 角點與鄰居中點的最大偏差（相對格距），超過就視為精修失敗
+GRID_TOLERANCE = 0.25
+# 少於這個張數時內參誤差很大，直接視為失敗
+MIN_VIEWS = 5
+
+
+@dataclass
+class CornerResult:
+    path: Path
+    image_size: tuple[int, int]  # (寬, 高)
+    corners: np.ndarray | None  # N x 1 x 2，找不到棋盤格時為 None
+    coarse_ms: float
+    refine_ms: float
+    factor: int = 1  # 實際找到角點時的縮小倍數
+    fallback: bool = False  # 預設縮圖上找不到，改用較高解析度才找到（或仍找不到）
+
+
+def read_gray(path: Path, bayer: bool = True) -> np.ndarray:
+    """讀取校正圖並轉灰階；單通道 BMP 視為 Bayer 原始資料（與 circle_marker_detector 相同）"""
+    image = cv2.imread(str(path), cv2.IMREAD_UNCHANGED)
+    if image is None:
+        raise RuntimeError(f"OpenCV 無法讀取 {path.name}")
+    if image.ndim == 2:
+        return cv2.cvtColor(image, cv2.COLOR_BayerGR2GRAY) if bayer else image
+    if image.shape[2] == 4:
+        return cv2.cvtColor(image, cv2.COLOR_BGRA2GRAY)
+    return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+
+def read_color(path: Path, bayer: bool = True) -> np.ndarray:
+    """讀取要去畸變的影像；Bayer 原始資料要先解成彩色，不能直接對馬賽克內插"""
+    image = cv2.imread(str(path), cv2.IMREAD_UNCHANGED)
+    if image is None:
+        raise RuntimeError(f"OpenCV 無法讀取 {path.name}")
+    if image.ndim == 2 and bayer:
+        return cv2.cvtColor(image, cv2.COLOR_BayerGR2BGR)
+    return image
+
+
+def _subpix_window(corners: np.ndarray, pattern: tuple[int, int], scale: float) -> int:
+    """cornerSubPix 的搜尋半徑：要涵蓋粗偵測的誤差（約縮圖的 1 像素），但不能超過半格"""
+    grid = corners.reshape(pattern[1], pattern[0], 2)
+    spacing = np.linalg.norm(np.diff(grid, axis=1), axis=2).min()
+    window = int(np.ceil(2 / scale)) + 2
+    return int(max(min(window, spacing / 2 - 1), 2))
+
+
+def grid_is_regular(corners: np.ndarray, pattern: tuple[int, int]) -> bool:
+    """每個內部角點應在左右（上下）兩個鄰居的中點附近；鏡頭畸變與透視只造成緩慢變化
+
+    縮圖上的粗略角點偏差太大時，cornerSubPix 可能收斂到錯的位置，這種角點會明顯偏離中點。
+    """
+    grid = corners.reshape(pattern[1], pattern[0], 2)
+    spacing = np.median(np.linalg.norm(np.diff(grid, axis=1), axis=2))
+    bend = np.concatenate([
+        np.linalg.norm(grid[:, 2:] - 2 * grid[:, 1:-1] + grid[:, :-2], axis=2).ravel(),
+        np.linalg.norm(grid[2:] - 2 * grid[1:-1] + grid[:-2], axis=2).ravel(),
+    ])
+    return bool(bend.max(initial=0.0) <= GRID_TOLERANCE * spacing)
+
+
+def _coarse_corners(gray: np.ndarray, pattern: tuple[int, int], factor: int,
+                    fallback: bool) -> np.ndarray | None:
+    """在縮小 factor 倍的影像上找角點，回傳原圖座標"""
+    if factor > 1:
+        small = cv2.resize(gray, None, fx=1 / factor, fy=1 / factor, interpolation=cv2.INTER_AREA)
+        found, corners = cv2.findChessboardCorners(small, pattern, flags=CHESSBOARD_FLAGS)
+    elif fallback:
+        # 原圖上的 findChessboardCorners 找不到時可能耗上數十秒（加 FAST_CHECK 又會漏掉格子小的棋盤）；
+        # SB 版本在原圖上找得到小格子，找不到時也只需約 1 秒
+        found, corners = cv2.findChessboardCornersSB(gray, pattern, flags=cv2.CALIB_CB_NORMALIZE_IMAGE)
+    else:
+        found, corners = cv2.findChessboardCorners(gray, pattern, flags=CHESSBOARD_FLAGS)
+    if not found:
+        return None
+    # 縮圖座標換回原圖（以像素中心對齊）
+    return ((corners + 0.5) * factor - 0.5).astype(np.float32)
+
+
+def find_corners(path: Path, pattern: tuple[int, int] = PATTERN_SIZE,
+                 max_side: int = COARSE_MAX_SIDE, bayer: bool = True) -> CornerResult:
+    """在縮小的影像上粗略找角點，再回到全解析度以 cornerSubPix 精修
+
+    棋盤格太小時縮圖上會找不到（或精修後格點不規則）：縮小倍數減半重試，最後回到原圖改用
+    findChessboardCornersSB。fallback=True 表示預設縮圖沒能用上。
+    """
+    gray = read_gray(path, bayer)
+    height, width = gray.shape
+    # 取整數倍縮小：INTER_AREA 在整數倍時直接做區塊平均，比任意比例快好幾倍
+    initial = max(int(np.ceil(max(height, width) / max_side)), 1) if max_side else 1
+
+    coarse_ms = refine_ms = 0.0
+    factor = initial
+    while True:
+        start = time.perf_counter()
+        corners = _coarse_corners(gray, pattern, factor, fallback=factor != initial)
+        coarse_ms += (time.perf_counter() - start) * 1000
+        if corners is not None:
+            start = time.perf_counter()
+            window = _subpix_window(corners, pattern, 1.0 / factor)
+            corners = cv2.cornerSubPix(gray, corners, (window, window), (-1, -1), SUBPIX_CRITERIA)
+            refine_ms += (time.perf_counter() - start) * 1000
+            if grid_is_regular(corners, pattern):
+                return CornerResult(path, (width, height), corners, coarse_ms, refine_ms,
+                                    factor, factor != initial)
+        if factor == 1:
+            return CornerResult(path, (width, height), None, coarse_ms, refine_ms, factor, initial != 1)
+        factor //= 2
+
+
+def detect_all(paths: list[Path], pattern: tuple[int, int] = PATTERN_SIZE,
+               max_side: int = COARSE_MAX_SIDE, workers: int | None = None,
+               bayer: bool = True) -> list[CornerResult]:
+    """以執行緒池平行偵測所有圖片（OpenCV 運算時會釋放 GIL）"""
+    workers = workers or os.cpu_count() or 1
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(lambda path: find_corners(path, pattern, max_side, bayer), paths))
+
+
+def board_points(pattern: tuple[int, int], square_mm: float) -> np.ndarray:
+    """棋盤格角點在世界座標的位置（z = 0 平面，單位 mm）"""
+    points = np.zeros((pattern[0] * pattern[1], 3), dtype=np.float32)
+    points[:, :2] = np.mgrid[0:pattern[0], 0:pattern[1]].T.reshape(-1, 2) * square_mm
+    return points
+
+
+def calibrate(results: list[CornerResult], pattern: tuple[int, int] = PATTERN_SIZE,
+              square_mm: float = SQUARE_MM) -> dict:
+    """以成功找到角點的圖片執行 calibrateCamera，回傳可直接存成 JSON 的校正結果"""
+    views = [result for result in results if result.corners is not None]
+    if len(views) < MIN_VIEWS:
+        raise RuntimeError(f"只有 {len(views)} 張圖片找到棋盤格，至少需要 {MIN_VIEWS} 張；"
+                           f"請確認 --pattern 是否為內角點數量")
+    sizes = {view.image_size for view in views}
+    if len(sizes) > 1:
+        raise ValueError(f"校正圖片的解析度不一致：{sorted(sizes)}")
+    image_size = sizes.pop()
+
+    objp = board_points(pattern, square_mm)
+    object_points = [objp] * len(views)
+    image_points = [view.corners for view in views]
+    rms, camera_matrix, dist_coeffs, rvecs, tvecs = cv2.calibrateCamera(
+        object_points, image_points, image_size, None, None)
+
+    view_errors = []
+    for view, rvec, tvec in zip(views, rvecs, tvecs):
+        projected, _ = cv2.projectPoints(objp, rvec, tvec, camera_matrix, dist_coeffs)
+        error = np.sqrt(np.mean(np.sum((projected - view.corners) ** 2, axis=2)))
+        view_errors.append({"image": view.path.name, "rms_px": round(float(error), 4),
+                            "factor": view.factor})
+
+    return {
+        "version": 1,
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "image_size": list(image_size),
+        "pattern": list(pattern),
+        "square_mm": square_mm,
+        "rms_px": round(float(rms), 4),
+        "camera_matrix": camera_matrix.tolist(),
+        "dist_coeffs": dist_coeffs.ravel().tolist(),
+        "views": view_errors,
+        "skipped": [result.path.name for result in results if result.corners is None],
+    }
+
+
+def load_calibration(path: Path = DEFAULT_OUTPUT) -> dict:
+    if not path.exists():
+        raise FileNotFoundError(f"找不到 {path}，請先執行 python camera_calibration.py")
+    return json.loads(path.read_text(encoding="utf-8"))
+
+
+class Undistorter:
+    """建立時以 initUndistortRectifyMap 算好映射表，之後每張影像只需一次 remap
+
+    cv2.undistort 每次呼叫都會重新計算整張映射表；同一台相機連續處理多張影像時，
+    映射表只和內參與解析度有關，算一次就夠了。
+    """
+
+    def __init__(self, calibration: dict, alpha: float = 0.0) -> None:
+        camera_matrix = np.array(calibration["camera_matrix"], dtype=np.float64)
+        dist_coeffs = np.array(calibration["dist_coeffs"], dtype=np.float64)
+        self.image_size = tuple(calibration["image_size"])
+        # alpha=0 裁掉去畸變後的黑邊；alpha=1 保留所有原始像素
+        self.camera_matrix, self.roi = cv2.getOptimalNewCameraMatrix(
+            camera_matrix, dist_coeffs, self.image_size, alpha, self.image_size)
+        # CV_16SC2 定點格式的映射表比兩張 float32 表省一半記憶體，remap 也較快
+        self.map1, self.map2 = cv2.initUndistortRectifyMap(
+            camera_matrix, dist_coeffs, None, self.camera_matrix, self.image_size, cv2.CV_16SC2)
+
+    @classmethod
+    def from_file(cls, path: Path = DEFAULT_OUTPUT, alpha: float = 0.0) -> "Undistorter":
+        return cls(load_calibration(path), alpha)
+
+    def undistort(self, image: np.ndarray, interpolation: int = cv2.INTER_LINEAR) -> np.ndarray:
+        height, width = image.shape[:2]
+        if (width, height) != self.image_size:
+            raise ValueError(f"影像大小 {width}x{height} 與校正時的 "
+                             f"{self.image_size[0]}x{self.image_size[1]} 不同，需重新校正")
+        return cv2.remap(image, self.map1, self.map2, interpolation)
+
+
+def benchmark_undistort(calibration: dict, image: np.ndarray, repeats: int = 20) -> dict:
+    """比較每張影像呼叫 cv2.undistort 與預先計算映射表後只做 remap 的耗時"""
+    camera_matrix = np.array(calibration["camera_matrix"])
+    dist_coeffs = np.array(calibration["dist_coeffs"])
+
+    start = time.perf_counter()
+    undistorter = Undistorter(calibration)
+    build_ms = (time.perf_counter() - start) * 1000
+
+    def per_frame(func) -> float:
+        func()  # 暖機
+        start = time.perf_counter()
+        for _ in range(repeats):
+            func()
+        return (time.perf_counter() - start) * 1000 / repeats
+
+    return {
+        "build_maps_ms": round(build_ms, 2),
+        "remap_ms": round(per_frame(lambda: undistorter.undistort(image)), 2),
+        "cv2_undistort_ms": round(per_frame(
+            lambda: cv2.undistort(image, camera_matrix, dist_coeffs, None, undistorter.camera_matrix)), 2),
+    }
+
+
+def list_images(directory: Path) -> list[Path]:
+    if not directory.is_dir():
+        raise FileNotFoundError(f"找不到資料夾 {directory}")
+    paths = sorted(path for path in directory.iterdir() if path.suffix.lower() in IMAGE_SUFFIXES)
+    if not paths:
+        raise FileNotFoundError(f"{directory} 內沒有校正圖片（.bmp / .png / .jpg）")
+    return paths
+
+
+def run_calibration(args: argparse.Namespace) -> dict:
+    try:
+        columns, rows = (int(value) for value in args.pattern.lower().split("x"))
+    except ValueError as exc:
+        raise SystemExit("--pattern 格式應為「每列內角點數x每行內角點數」，例如 9x6") from exc
+    pattern = (columns, rows)
+    paths = list_images(args.images)
+
+    start = time.perf_counter()
+    results = detect_all(paths, pattern, args.max_side, args.workers, not args.no_bayer)
+    detect_s = time.perf_counter() - start
+    found = [result for result in results if result.corners is not None]
+    print(f"角點偵測：{len(found)} / {len(results)} 張成功，共 {detect_s:.2f} 秒")
+    if found:
+        print(f"  每張平均：粗偵測 {np.mean([r.coarse_ms for r in results]):.1f} ms、"
+              f"cornerSubPix {np.mean([r.refine_ms for r in found]):.1f} ms")
+
+    rescued = [result.path.name for result in found if result.fallback]
+    if rescued:
+        print(f"  警告：{len(rescued)} 張在縮圖上找不到棋盤格，改用較高解析度才找到"
+              f"（格子太小，可加大 --max-side 或設為 0）：{', '.join(rescued)}")
+    missing = [result.path.name for result in results if result.corners is None]
+    if missing:
+        print(f"  未找到棋盤格（原圖解析度也找不到，請確認 --pattern 與圖片品質）：{', '.join(missing)}")
+
+    start = time.perf_counter()
+    calibration = calibrate(results, pattern, args.square_mm)
+    calibrate_s = time.perf_counter() - start
+    print(f"calibrateCamera：{calibrate_s:.2f} 秒，重投影誤差 RMS {calibration['rms_px']:.3f} px")
+
+    calibration["timings"] = {
+        "workers": args.workers or os.cpu_count(),
+        "max_side": args.max_side,
+        "detect_s": round(detect_s, 3),
+        "coarse_ms_mean": round(float(np.mean([r.coarse_ms for r in results])), 2),
+        "refine_ms_mean": round(float(np.mean([r.refine_ms for r in found])), 2),
+        "calibrate_s": round(calibrate_s, 3),
+    }
+    return calibration
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Day4 棋盤格相機校正與去畸變")
+    parser.add_argument("--images", type=Path, default=CALIBRATION_IMAGES_DIR, help="校正圖片資料夾")
+    parser.add_argument("--pattern", default=f"{PATTERN_SIZE[0]}x{PATTERN_SIZE[1]}",
+                        help="棋盤格內角點數量，例如 9x6（不是格子數）")
+    parser.add_argument("--square-mm", type=float, default=SQUARE_MM, help="每格邊長 (mm)")
+    parser.add_argument("--max-side", type=int, default=COARSE_MAX_SIDE,
+                        help="粗偵測時縮圖的長邊；0 代表直接在原圖上偵測")
+    parser.add_argument("--workers", type=int, default=None, help="平行偵測的執行緒數（預設為 CPU 核心數）")
+    parser.add_argument("--no-bayer", action="store_true", help="單通道圖片為一般灰階，不做 Bayer 解碼")
+    parser.add_argument("--output", type=Path, default=DEFAULT_OUTPUT, help="校正結果 (JSON)")
+    parser.add_argument("--undistort", type=Path, default=None,
+                        help="沿用既有校正結果，把這張圖去畸變後輸出到 output/")
+    parser.add_argument("--repeats", type=int, default=20, help="量測每張去畸變耗時的重複次數")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    if args.undistort is not None:
+        calibration = load_calibration(args.output)
+        sample_path = args.undistort
+    else:
+        calibration = run_calibration(args)
+        sample_path = list_images(args.images)[0]
+
+    sample = read_color(sample_path, not args.no_bayer)
+    timings = benchmark_undistort(calibration, sample, max(args.repeats, 1))
+    print(f"去畸變：建立映射表 {timings['build_maps_ms']:.1f} ms（只需一次），"
+          f"之後每張 remap {timings['remap_ms']:.1f} ms；"
+          f"每張都呼叫 cv2.undistort 需 {timings['cv2_undistort_ms']:.1f} ms")
+
+    if args.undistort is not None:
+        output_path = DAY_DIR / "output" / f"{sample_path.stem}_undistorted.png"
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        cv2.imwrite(str(output_path), Undistorter(calibration).undistort(sample))
+        print(f"去畸變結果已輸出到 {output_path.name}")
+        return
+
+    calibration["timings"].update(timings)
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    args.output.write_text(json.dumps(calibration, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"校正結果已輸出到 {args.output}")
+
+
+if __name__ == "__main__":
+    main()
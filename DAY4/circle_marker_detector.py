@@ -1,14 +1,36 @@
 ﻿"""Day 4：圓點標記偵測示範"""
 from __future__ import annotations
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+import argparse
+import os
+import time
+import tracemalloc
 import cv2
 import numpy as np
 
 # Author: harry123180
 
+# HoughCircles 參數
+BLUR_KSIZE = 11
+MIN_DIST = 40
+CANNY_HIGH = 120
+ACCUMULATOR_THRESHOLD = 40
+MIN_RADIUS = 10
+MAX_RADIUS = 80
 
-def load_raw_image() -> np.ndarray:
-    """載入 BMP 原始圖，若為 BGR 會轉為 RGB"""
+# 次像素精修：每個圓沿幾條放射線取樣、取樣帶寬（相對半徑）與每條線的取樣點數
+REFINE_RAYS = 64
+REFINE_BAND = 0.35
+REFINE_SAMPLES = 24
+
+# 分塊模式：重疊區至少要能完整容納一個最大的圓（含模糊核的邊界效應）
+TILE_SIZE = 2048
+TILE_OVERLAP = 2 * (MAX_RADIUS + BLUR_KSIZE) + 16
+
+
+def _read_sample() -> np.ndarray:
+    """讀取示範 BMP（保留原始通道數）"""
     day_dir = Path(__file__).resolve().parent
     image_path = day_dir / "images" / "high_res_sample.bmp"
     if not image_path.exists():
@@ -17,6 +39,12 @@ def load_raw_image() -> np.ndarray:
     image = cv2.imread(str(image_path), cv2.IMREAD_UNCHANGED)
     if image is None:
         raise RuntimeError("OpenCV 無法讀取示範圖片")
+    return image
+
+
+def load_raw_image() -> np.ndarray:
+    """載入 BMP 原始圖，若為 BGR 會轉為 RGB"""
+    image = _read_sample()
 
     if image.ndim == 2:
         # 有些相機輸出 Bayer 單色，轉為可視的灰階
@@ -25,42 +53,403 @@ def load_raw_image() -> np.ndarray:
     return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
 
 
-def detect_circles(image: np.ndarray) -> tuple[np.ndarray, int]:
-    """使用霍夫變換偵測圓點，並回傳標示後的影像與數量"""
-    gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
-    blurred = cv2.GaussianBlur(gray, (11, 11), 0)
+def load_gray_image(binning: bool = False) -> tuple[np.ndarray, float]:
+    """直接載入灰階圖，回傳 (灰階影像, 相對原圖的縮放比例)
+
+    Bayer 單通道資料直接去馬賽克成灰階，不產生任何彩色緩衝區；
+    binning=True 時把每個 2x2 Bayer 格（R、G、G、B）平均成一個像素，
+    得到半解析度的亮度圖，記憶體與運算量都只剩 1/4。
+    """
+    image = _read_sample()
+    if image.ndim == 2:
+        if binning:
+            return cv2.resize(image, None, fx=0.5, fy=0.5, interpolation=cv2.INTER_AREA), 0.5
+        return cv2.cvtColor(image, cv2.COLOR_BayerGR2GRAY), 1.0
+
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    del image  # 盡早釋放彩色原圖
+    if binning:
+        return cv2.resize(gray, None, fx=0.5, fy=0.5, interpolation=cv2.INTER_AREA), 0.5
+    return gray, 1.0
+
+
+def _blur_ksize(scale: float) -> int:
+    ksize = max(int(round(BLUR_KSIZE * scale)), 3)
+    return ksize if ksize % 2 == 1 else ksize + 1
+
+
+def find_markers(gray: np.ndarray, scale: float = 1.0) -> np.ndarray:
+    """在灰階影像上找圓點，回傳 N x 3 整數陣列 (x, y, r)
+
+    scale 為輸入影像相對原圖的比例（例如 binning 後為 0.5），
+    距離與半徑參數會跟著縮放，回傳座標仍是輸入影像的座標。
+    """
+    ksize = _blur_ksize(scale)
+    blurred = cv2.GaussianBlur(gray, (ksize, ksize), 0)
 
     circles = cv2.HoughCircles(
         blurred,
         cv2.HOUGH_GRADIENT,
         dp=1.2,
-        minDist=40,
-        param1=120,
-        param2=40,
-        minRadius=10,
-        maxRadius=80,
+        minDist=MIN_DIST * scale,
+        param1=CANNY_HIGH,
+        param2=ACCUMULATOR_THRESHOLD * scale,  # 圓周像素隨比例變少，票數門檻也跟著降
+        minRadius=max(int(MIN_RADIUS * scale), 1),
+        maxRadius=int(np.ceil(MAX_RADIUS * scale)),
     )
+    if circles is None:
+        return np.empty((0, 3), dtype=int)
+    return np.round(circles[0]).astype(int)
+
+
+def _tile_origins(length: int, tile_size: int, overlap: int) -> list[int]:
+    """沿一個軸切塊的起點，最後一塊貼齊影像邊界"""
+    if length <= tile_size:
+        return [0]
+    step = tile_size - overlap
+    origins = list(range(0, length - tile_size, step))
+    origins.append(length - tile_size)
+    return origins
+
+
+def _detect_tile(gray: np.ndarray, x0: int, y0: int, tile_size: int,
+                 scale: float = 1.0) -> np.ndarray:
+    """偵測單一分塊，只保留完整落在分塊內（不受切邊影響）的圓，座標換回全圖"""
+    height, width = gray.shape[:2]
+    x1, y1 = min(x0 + tile_size, width), min(y0 + tile_size, height)
+    # gray[...] 是 view，不會複製整塊記憶體
+    markers = find_markers(gray[y0:y1, x0:x1], scale)
+    if len(markers) == 0:
+        return markers.reshape(-1, 4)
+
+    x, y, r = markers[:, 0] + x0, markers[:, 1] + y0, markers[:, 2]
+    margin = r + _blur_ksize(scale)
+    # 與分塊邊的距離；分塊邊剛好是影像邊界時不受限制
+    left = np.where(x0 == 0, np.inf, x - x0)
+    top = np.where(y0 == 0, np.inf, y - y0)
+    right = np.where(x1 == width, np.inf, x1 - x)
+    bottom = np.where(y1 == height, np.inf, y1 - y)
+    clearance = np.minimum.reduce([left, top, right, bottom])
+    keep = clearance >= margin
+
+    # 第 4 欄記錄離分塊邊的距離，合併時距離越遠（上下文越完整）越優先
+    score = np.minimum(clearance, float(tile_size))[keep]
+    return np.column_stack([x[keep], y[keep], r[keep], score])
+
+
+def _close_pairs(points: np.ndarray, min_dist: float) -> tuple[np.ndarray, np.ndarray]:
+    """找出所有圓心距離小於 min_dist 的配對 (i, j)，且 i < j
+
+    以邊長 min_dist 的網格分桶後依格子排序，對 3x3 鄰格各做一次 searchsorted，
+    全部以陣列運算完成；配對數只和局部密度有關，不會建立 N x N 矩陣。
+    """
+    cells = np.floor(points / min_dist).astype(np.int64)
+    cells -= cells.min(axis=0) - 1  # 留一格邊界，鄰格的 key 才不會是負數或跨列
+    stride = int(cells[:, 1].max()) + 2
+    keys = cells[:, 0] * stride + cells[:, 1]
+    by_cell = np.argsort(keys, kind="stable")
+    sorted_keys = keys[by_cell]
+    index = np.arange(len(points))
+    firsts, seconds = [], []
+    for dx in (-1, 0, 1):
+        for dy in (-1, 0, 1):
+            target = keys + dx * stride + dy
+            start = np.searchsorted(sorted_keys, target, side="left")
+            counts = np.searchsorted(sorted_keys, target, side="right") - start
+            owner = np.repeat(index, counts)
+            offset = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+            other = by_cell[np.repeat(start, counts) + offset]
+            ahead = other < owner
+            owner, other = owner[ahead], other[ahead]
+            delta = points[owner] - points[other]
+            close = np.einsum("ij,ij->i", delta, delta) < min_dist ** 2
+            firsts.append(other[close])
+            seconds.append(owner[close])
+    return np.concatenate(firsts), np.concatenate(seconds)
+
+
+def suppress_duplicates(candidates: np.ndarray, min_dist: float = MIN_DIST) -> np.ndarray:
+    """貪婪非極大值抑制：依分數由高到低，只和「已保留」的圓比較，圓心距離小於 min_dist 就丟掉
+
+    candidates 為 N x 4 陣列 (x, y, r, score)，回傳 N' x 3 整數陣列 (x, y, r)。
+    先以 _close_pairs 一次找出所有太近的配對，再分輪決定：比自己分數高的鄰居都已被抑制 → 保留；
+    有任一個已保留 → 抑制。每輪都是陣列運算，輪數只和重疊鏈的長度有關，結果與逐一比較的貪婪法相同。
+    被抑制的候選不會再去抑制別人：
+
+    >>> chain = np.array([[100, 0, 10, 3], [130, 0, 10, 2], [160, 0, 10, 1]], dtype=float)
+    >>> suppress_duplicates(chain, 40).tolist()
+    [[100, 0, 10], [160, 0, 10]]
+    """
+    if len(candidates) == 0:
+        return np.empty((0, 3), dtype=int)
+
+    order = np.argsort(-candidates[:, 3], kind="stable")
+    ranked = candidates[order]
+    # higher 的排名在 lower 之前（分數較高）
+    higher, lower = _close_pairs(ranked[:, :2], min_dist)
+    # 0：未決定、1：保留、-1：抑制
+    status = np.zeros(len(ranked), dtype=np.int8)
+    while True:
+        pending = status[lower] == 0
+        higher, lower = higher[pending], lower[pending]
+        undecided = status == 0
+        if not undecided.any():
+            break
+        above = status[higher]
+        suppressed = np.bincount(lower[above == 1], minlength=len(ranked)) > 0
+        waiting = np.bincount(lower[above == 0], minlength=len(ranked)) > 0
+        status[undecided & suppressed] = -1
+        status[undecided & ~suppressed & ~waiting] = 1
+    return ranked[status == 1, :3].astype(int)
+
+
+def find_markers_tiled(
+    gray: np.ndarray,
+    tile_size: int = TILE_SIZE,
+    overlap: int = TILE_OVERLAP,
+    workers: int | None = None,
+    scale: float = 1.0,
+) -> np.ndarray:
+    """把影像切成重疊分塊並行偵測，回傳格式與 find_markers 相同
+
+    HoughCircles 執行時會釋放 GIL，用執行緒池即可吃滿多核心，
+    分塊直接取原圖的 view，不需要為每個 worker 複製影像。
+    """
+    if overlap < 2 * (MAX_RADIUS + BLUR_KSIZE):
+        raise ValueError("overlap 太小，重疊區放不下一個完整的圓")
+
+    height, width = gray.shape[:2]
+    origins = [
+        (x0, y0)
+        for y0 in _tile_origins(height, tile_size, overlap)
+        for x0 in _tile_origins(width, tile_size, overlap)
+    ]
+    workers = workers or os.cpu_count() or 1
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        parts = list(pool.map(lambda origin: _detect_tile(gray, *origin, tile_size, scale), origins))
+
+    candidates = np.concatenate(parts) if parts else np.empty((0, 4))
+    return suppress_duplicates(candidates, MIN_DIST * scale)
+
+
+def detect_markers(
+    gray: np.ndarray,
+    scale: float = 1.0,
+    tiled: bool = False,
+    workers: int | None = None,
+) -> np.ndarray:
+    """灰階原生流程：回傳原圖座標下的 N x 3 整數陣列 (x, y, r)"""
+    if tiled:
+        markers = find_markers_tiled(gray, workers=workers, scale=scale)
+    else:
+        markers = find_markers(gray, scale)
+    if scale != 1.0:
+        markers = np.round(markers / scale).astype(int)
+    return markers
+
+
+def _sample_bilinear(gray: np.ndarray, xs: np.ndarray, ys: np.ndarray) -> np.ndarray:
+    """一次取樣任意形狀座標陣列的灰階值（雙線性內插）"""
+    height, width = gray.shape[:2]
+    xs = np.clip(xs, 0, width - 1.001)
+    ys = np.clip(ys, 0, height - 1.001)
+    x0 = xs.astype(np.intp)
+    y0 = ys.astype(np.intp)
+    fx = (xs - x0).astype(np.float32)
+    fy = (ys - y0).astype(np.float32)
+    top = gray[y0, x0] * (1 - fx) + gray[y0, x0 + 1] * fx
+    bottom = gray[y0 + 1, x0] * (1 - fx) + gray[y0 + 1, x0 + 1] * fx
+    return top * (1 - fy) + bottom * fy
+
+
+def _fit_circles(u: np.ndarray, v: np.ndarray, weight: np.ndarray) -> np.ndarray:
+    """批次代數最小平方法擬合圓（Kasa），u, v, weight 皆為 N x K，回傳 N x 3 (cx, cy, r)"""
+    design = np.stack([u, v, np.ones_like(u)], axis=-1)              # N x K x 3
+    target = u * u + v * v                                            # N x K
+    normal = np.einsum("nk,nki,nkj->nij", weight, design, design)     # N x 3 x 3
+    rhs = np.einsum("nk,nki,nk->ni", weight, design, target)          # N x 3
+    normal += np.eye(3) * 1e-9
+    a, b, c = np.linalg.solve(normal, rhs[..., None])[..., 0].T
+    cx, cy = a / 2, b / 2
+    radius = np.sqrt(np.maximum(c + cx * cx + cy * cy, 0.0))
+    return np.column_stack([cx, cy, radius])
+
+
+def refine_markers(gray: np.ndarray, markers: np.ndarray) -> np.ndarray:
+    """次像素精修：沿放射線找邊緣點，再以批次最小平方法擬合圓
+
+    所有圓點一次完成取樣與擬合（沒有逐一處理的 Python 迴圈），
+    回傳 N x 3 float32 陣列 (x, y, r)；邊緣點不足的圓點保留原始座標。
+    """
+    if len(markers) == 0:
+        return np.empty((0, 3), dtype=np.float32)
+
+    initial = markers[:, :3].astype(np.float64)
+    cx0, cy0, r0 = initial[:, 0:1], initial[:, 1:2], initial[:, 2:3]
+
+    angles = np.linspace(0, 2 * np.pi, REFINE_RAYS, endpoint=False)
+    cos, sin = np.cos(angles)[None, :, None], np.sin(angles)[None, :, None]
+    steps = np.linspace(1 - REFINE_BAND, 1 + REFINE_BAND, REFINE_SAMPLES)
+    radii = r0[:, :, None] * steps[None, None, :]                      # N x 1 x S
+    xs = cx0[:, :, None] + radii * cos                                  # N x K x S
+    ys = cy0[:, :, None] + radii * sin
+    profile = _sample_bilinear(gray, xs, ys)
+
+    # 沿放射線的梯度（[1, 2, 1] 平滑）取最大值，再用拋物線內插到次取樣點
+    grad = np.abs(np.diff(profile, axis=2))
+    grad[..., 1:-1] = grad[..., :-2] * 0.25 + grad[..., 1:-1] * 0.5 + grad[..., 2:] * 0.25
+    peak = np.clip(np.argmax(grad[..., 1:-1], axis=2) + 1, 1, grad.shape[2] - 2)
+    g_left = np.take_along_axis(grad, (peak - 1)[..., None], axis=2)[..., 0]
+    g_mid = np.take_along_axis(grad, peak[..., None], axis=2)[..., 0]
+    g_right = np.take_along_axis(grad, (peak + 1)[..., None], axis=2)[..., 0]
+    denom = g_left - 2 * g_mid + g_right
+    offset = np.where(denom < 0, 0.5 * (g_left - g_right) / np.where(denom < 0, denom, 1), 0.0)
+
+    # diff 的第 i 個值位於第 i 與 i+1 個取樣點中間
+    step = steps[1] - steps[0]
+    edge_radius = r0 * (steps[0] + (peak + 0.5 + offset) * step)
+    u = edge_radius * cos[..., 0]
+    v = edge_radius * sin[..., 0]
+
+    # 梯度太弱的放射線（被遮擋或貼著其他物體）不參與擬合
+    strength = g_mid
+    weight = (strength >= 0.3 * np.median(strength, axis=1, keepdims=True)).astype(np.float64)
+    fitted = _fit_circles(u, v, weight)
+
+    # 去除離群點後再擬合一次
+    residual = np.abs(np.hypot(u - fitted[:, 0:1], v - fitted[:, 1:2]) - fitted[:, 2:3])
+    limit = np.maximum(3 * np.median(residual, axis=1, keepdims=True), 0.5)
+    weight *= residual <= limit
+    fitted = _fit_circles(u, v, weight)
+
+    refined = fitted + np.column_stack([cx0, cy0, np.zeros_like(r0)])
+    valid = (weight.sum(axis=1) >= 6) & (np.abs(fitted[:, 2] - r0[:, 0]) <= REFINE_BAND * r0[:, 0])
+    refined[~valid] = initial[~valid]
+    return refined.astype(np.float32)
+
+
+def draw_markers(gray: np.ndarray, markers: np.ndarray, scale: float = 1.0) -> np.ndarray:
+    """在灰階圖上標示圓點，回傳 BGR 影像（只有需要輸出標註圖時才呼叫）"""
+    annotated = cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR)
+    for circle in np.round(markers * scale).astype(int):
+        center = (circle[0], circle[1])
+        radius = circle[2]
+        cv2.circle(annotated, center, radius, (0, 255, 0), 2)
+        cv2.circle(annotated, center, 4, (0, 0, 255), -1)
+    return annotated
+
+
+def detect_circles(
+    image: np.ndarray,
+    tiled: bool = False,
+    workers: int | None = None,
+) -> tuple[np.ndarray, int]:
+    """使用霍夫變換偵測圓點，並回傳標示後的影像與數量"""
+    gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+    markers = find_markers_tiled(gray, workers=workers) if tiled else find_markers(gray)
 
     annotated = image.copy()
     count = 0
-    if circles is not None:
-        for circle in np.round(circles[0]).astype(int):
-            count += 1
-            center = (circle[0], circle[1])
-            radius = circle[2]
-            cv2.circle(annotated, center, radius, (0, 255, 0), 2)
-            cv2.circle(annotated, center, 4, (255, 0, 0), -1)
+    for circle in markers:
+        count += 1
+        center = (circle[0], circle[1])
+        radius = circle[2]
+        cv2.circle(annotated, center, radius, (0, 255, 0), 2)
+        cv2.circle(annotated, center, 4, (255, 0, 0), -1)
     return annotated, count
 
 
+def run_pipeline(mode: str, annotate: bool = True, tiled: bool = False,
+                 workers: int | None = None) -> tuple[int, np.ndarray | None]:
+    """執行一種流程，回傳 (圓點數量, 標註圖 BGR 或 None)
+
+    - rgb：原本的流程（Bayer → RGB → 灰階），一律輸出標註圖
+    - gray：Bayer 直接去馬賽克成灰階
+    - binning：2x2 合併成半解析度灰階
+    """
+    if mode == "rgb":
+        image = load_raw_image()
+        annotated, count = detect_circles(image, tiled=tiled, workers=workers)
+        return count, cv2.cvtColor(annotated, cv2.COLOR_RGB2BGR)
+
+    gray, scale = load_gray_image(binning=mode == "binning")
+    markers = detect_markers(gray, scale, tiled=tiled, workers=workers)
+    annotated = draw_markers(gray, markers, scale) if annotate else None
+    return len(markers), annotated
+
+
+def benchmark(tiled: bool = False, workers: int | None = None) -> None:
+    """比較各流程的耗時與峰值記憶體（tracemalloc 統計 NumPy / OpenCV 回傳的陣列）"""
+    cases = [("rgb", True), ("gray", False), ("gray", True), ("binning", False)]
+    for mode, annotate in cases:
+        tracemalloc.start()
+        start = time.perf_counter()
+        count, annotated = run_pipeline(mode, annotate, tiled=tiled, workers=workers)
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del annotated
+
+        label = f"{mode}{' + 標註' if annotate else ''}"
+        print(f"{label:<14} 圓點 {count:>4} 個，耗時 {elapsed:6.2f} s，峰值記憶體 {peak / 2**20:8.1f} MB")
+
+
+def run_refinement(binning: bool = False, tiled: bool = False, workers: int | None = None,
+                   repeats: int = 5) -> np.ndarray:
+    """偵測後做次像素精修，輸出 CSV 並顯示每秒可精修的圓點數"""
+    gray, scale = load_gray_image(binning=binning)
+    markers = detect_markers(gray, scale, tiled=tiled, workers=workers)
+
+    # 取多次中最快的一次，避免第一次呼叫的暖機時間影響數字
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        refined = refine_markers(gray, markers * scale) / scale
+        best = min(best, time.perf_counter() - start)
+
+    rate = len(markers) / best if best > 0 else 0.0
+    shift = np.hypot(*(refined[:, :2] - markers[:, :2]).T) if len(markers) else np.zeros(0)
+    print(f"精修 {len(markers)} 個圓點，耗時 {best * 1000:.1f} ms（{rate:,.0f} markers/sec）")
+    if len(shift):
+        print(f"圓心平均位移 {shift.mean():.2f} px，最大 {shift.max():.2f} px")
+
+    csv_path = Path(__file__).resolve().parent / "output" / "markers_subpixel.csv"
+    csv_path.parent.mkdir(parents=True, exist_ok=True)
+    np.savetxt(csv_path, refined, fmt="%.3f", delimiter=",", header="x,y,r", comments="")
+    print(f"次像素座標已輸出到 {csv_path.name}")
+    return refined
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Day4 圓點標記偵測")
+    parser.add_argument("--tiled", action="store_true", help="切成重疊分塊並以多核心偵測")
+    parser.add_argument("--workers", type=int, default=None, help="分塊模式的執行緒數（預設為 CPU 核心數）")
+    parser.add_argument("--mode", choices=["rgb", "gray", "binning"], default="rgb",
+                        help="rgb=原流程；gray=Bayer 直接轉灰階；binning=2x2 合併半解析度")
+    parser.add_argument("--annotate", action="store_true", help="gray / binning 模式下也輸出標註圖")
+    parser.add_argument("--benchmark", action="store_true", help="比較各流程的耗時與峰值記憶體")
+    parser.add_argument("--refine", action="store_true",
+                        help="次像素精修圓心與半徑，輸出 CSV 並顯示 markers/sec（使用灰階流程）")
+    return parser.parse_args()
+
+
 def main() -> None:
-    image = load_raw_image()
-    annotated, count = detect_circles(image)
+    args = parse_args()
+    if args.benchmark:
+        benchmark(tiled=args.tiled, workers=args.workers)
+        return
+    if args.refine:
+        run_refinement(binning=args.mode == "binning", tiled=args.tiled, workers=args.workers)
+        return
+
+    count, annotated = run_pipeline(args.mode, args.annotate, tiled=args.tiled, workers=args.workers)
     print(f"偵測到 {count} 個圓形")
+    if annotated is None:
+        return
 
     output_path = Path(__file__).resolve().parent / "output" / "circle_result.png"
     output_path.parent.mkdir(parents=True, exist_ok=True)
-    cv2.imwrite(str(output_path), cv2.cvtColor(annotated, cv2.COLOR_RGB2BGR))
+    cv2.imwrite(str(output_path), annotated)
     print(f"結果已輸出到 {output_path.name}")
 
 
@@ -0,0 +1,49 @@
+﻿"""Day 6：以圖片內容為 key 快取原始偵測結果，調整門檻時不必重跑模型"""
+from __future__ import annotations
+from collections import OrderedDict
+import hashlib
+
+# Author: harry123180
+
+import numpy as np
+
+# 推論時先用寬鬆的門檻取得「原始」結果，之後由滑桿在 NumPy 中重新篩選；
+# 滑桿的下限 / 上限就是這兩個值
+RAW_CONF = 0.05
+RAW_IOU = 0.95
+CACHE_SIZE = 16
+
+
+def image_digest(image: np.ndarray) -> str:
+    """以像素內容計算雜湊：同一張圖換路徑重新載入也能命中，檔案被修改過則不會誤用舊結果"""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(str(image.shape).encode())
+    digest.update(np.ascontiguousarray(image).data)
+    return digest.hexdigest()
+
+
+class DetectionCache:
+    """最近使用的 CACHE_SIZE 組原始偵測結果（LRU）
+
+    key 同時包含模型與是否切片推論，切換後端或權重時不會拿到另一個模型的結果。
+    """
+
+    def __init__(self, maxsize: int = CACHE_SIZE) -> None:
+        self.maxsize = maxsize
+        self._items: OrderedDict[tuple, np.ndarray] = OrderedDict()
+
+    @staticmethod
+    def key(image_key: str, detector, sliced: bool) -> tuple:
+        return image_key, detector.backend, str(detector.weights), sliced
+
+    def get(self, key: tuple) -> np.ndarray | None:
+        detections = self._items.get(key)
+        if detections is not None:
+            self._items.move_to_end(key)
+        return detections
+
+    def put(self, key: tuple, detections: np.ndarray) -> None:
+        self._items[key] = detections
+        self._items.move_to_end(key)
+        while len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
@@ -0,0 +1,123 @@
+﻿"""Day 6：在背景執行緒執行 YOLO 推論，避免 GUI 卡住"""
+from __future__ import annotations
+from dataclasses import dataclass, field
+from typing import Callable
+import itertools
+import queue
+import threading
+import time
+
+# Author: harry123180
+
+import numpy as np
+
+# 暖機用的假影像大小，與模型輸入一致即可觸發記憶體配置與圖最佳化
+WARMUP_SIZE = 640
+
+
+@dataclass
+class InferenceJob:
+    job_id: int
+    kind: str  # "detect"、"warmup" 或 "load"
+    detector: object
+    image: np.ndarray | None
+    generation: int
+    loader: Callable[[], object] | None = None
+    options: dict = field(default_factory=dict)  # 傳給 detect() 的 conf / iou
+
+
+@dataclass
+class InferenceResult:
+    job_id: int
+    kind: str
+    detector: object
+    detections: np.ndarray | None = None
+    elapsed_ms: float = 0.0
+    error: Exception | None = None
+    skipped: bool = False
+
+
+class InferenceWorker:
+    """單一背景執行緒依序處理推論工作
+
+    GUI 執行緒只負責 submit() 與 poll()：結果放在 queue 裡，由 Tk 的 after() 定時取回，
+    worker 本身從不碰任何 Tk 元件。cancel_pending() 會讓尚未開始的舊工作直接略過；
+    已經在跑的推論無法中斷，但它的結果會被標成 skipped，GUI 收到後丟棄即可。
+    """
+
+    def __init__(self) -> None:
+        self._jobs: queue.Queue[InferenceJob | None] = queue.Queue()
+        self._results: queue.Queue[InferenceResult] = queue.Queue()
+        self._ids = itertools.count(1)
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="inference-worker", daemon=True)
+        self._thread.start()
+
+    def submit(self, detector, image: np.ndarray | None = None, kind: str = "detect", **options) -> int:
+        """排入一個工作並回傳 job_id；kind="warmup" 時以假影像暖機，options 會傳給 detect()"""
+        with self._lock:
+            job = InferenceJob(next(self._ids), kind, detector, image, self._generation, options=options)
+        self._jobs.put(job)
+        return job.job_id
+
+    def warmup(self, detector) -> int:
+        return self.submit(detector, kind="warmup")
+
+    def load(self, loader: Callable[[], object]) -> int:
+        """在背景呼叫 loader() 載入模型（含 import torch 等耗時步驟），結果的 detector 即為回傳值"""
+        with self._lock:
+            job = InferenceJob(next(self._ids), "load", None, None, self._generation, loader)
+        self._jobs.put(job)
+        return job.job_id
+
+    def cancel_pending(self) -> None:
+        """作廢目前所有排隊中與執行中的推論工作（例如使用者換了一張圖）"""
+        with self._lock:
+            self._generation += 1
+
+    def poll(self) -> list[InferenceResult]:
+        """取回目前已完成的所有結果（不會阻塞）"""
+        results = []
+        while True:
+            try:
+                results.append(self._results.get_nowait())
+            except queue.Empty:
+                return results
+
+    def stop(self) -> None:
+        self._jobs.put(None)
+
+    def _is_stale(self, job: InferenceJob) -> bool:
+        # 暖機與載入模型都和圖片無關，不會被作廢
+        if job.kind != "detect":
+            return False
+        with self._lock:
+            return job.generation != self._generation
+
+    def _run(self) -> None:
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                return
+            result = InferenceResult(job.job_id, job.kind, job.detector)
+            if self._is_stale(job):
+                result.skipped = True
+                self._results.put(result)
+                continue
+            image = job.image
+            if job.kind == "warmup":
+                size = getattr(job.detector, "imgsz", WARMUP_SIZE)
+                image = np.zeros((size, size, 3), dtype=np.uint8)
+            start = time.perf_counter()
+            try:
+                if job.kind == "load":
+                    result.detector = job.loader()
+                else:
+                    result.detections = job.detector.detect([image], **job.options)[0]
+            except Exception as exc:  # noqa: BLE001 - 交給 GUI 顯示錯誤訊息
+                result.error = exc
+            result.elapsed_ms = (time.perf_counter() - start) * 1000
+            # 推論途中被作廢的工作，結果一樣標成 skipped
+            result.skipped = self._is_stale(job)
+            self._results.put(result)
@@ -1,17 +1,46 @@
 ﻿"""Day 6：整合 YOLO 與簡易量測的 GUI"""
 from __future__ import annotations
+from functools import partial
 from pathlib import Path
-import customtkinter as ctk
-from tkinter import filedialog, messagebox
-import cv2
-from PIL import Image, ImageTk
+import importlib
+import sys
 
 # Author: harry123180
 
-try:
-    from ultralytics import YOLO
-except ImportError:  # pragma: no cover
-    YOLO = None
+from startup_timing import StartupTimer
+
+# 盡早建立計時器，之後每個 import 的耗時都會記錄下來
+STARTUP = StartupTimer()
+with STARTUP.importing("customtkinter"):
+    import customtkinter as ctk
+from tkinter import filedialog, messagebox
+with STARTUP.importing("cv2"):
+    import cv2
+with STARTUP.importing("PIL"):
+    from PIL import Image, ImageTk
+
+DAY3_DIR = Path(__file__).resolve().parent.parent / "DAY3"
+# 推論後端（Ultralytics / ONNX Runtime）共用 DAY3 的 detectors.py；
+# ultralytics / torch 與 onnxruntime 只在背景載入模型時才 import
+sys.path.append(str(DAY3_DIR))
+with STARTUP.importing("detectors"):
+    from detectors import (DEFAULT_CONF, DEFAULT_IOU, draw_detections,  # noqa: E402
+                           filter_detections, load_detector)
+with STARTUP.importing("sliced_inference"):
+    from sliced_inference import SlicedDetector  # noqa: E402
+with STARTUP.importing("model_registry"):
+    from model_registry import find_model  # noqa: E402
+with STARTUP.importing("detection_cache"):
+    from detection_cache import RAW_CONF, RAW_IOU, DetectionCache, image_digest  # noqa: E402
+with STARTUP.importing("inference_worker"):
+    from inference_worker import InferenceWorker  # noqa: E402
+
+# 選單顯示名稱 → 權重副檔名
+BACKENDS = {"PyTorch (.pt)": ".pt", "ONNX Runtime (.onnx)": ".onnx"}
+# 各後端真正耗時的套件，在背景執行緒 import 並記錄時間
+BACKEND_MODULES = {".pt": "ultralytics", ".onnx": "onnxruntime"}
+# 每隔幾毫秒檢查一次背景推論的結果
+POLL_INTERVAL_MS = 30
 
 
 class SmartInspectionApp(ctk.CTk):
@@ -28,49 +57,162 @@ class SmartInspectionApp(ctk.CTk):
 
         control = ctk.CTkFrame(self)
         control.grid(row=0, column=1, padx=20, pady=20, sticky="nsew")
-        control.grid_rowconfigure(5, weight=1)
+        control.grid_rowconfigure(10, weight=1)
 
         ctk.CTkButton(control, text="載入圖片", command=self.load_image).grid(
             row=0, column=0, padx=10, pady=10, sticky="ew"
         )
-        ctk.CTkButton(control, text="執行 YOLO 推論", command=self.run_inference).grid(
-            row=1, column=0, padx=10, pady=10, sticky="ew"
-        )
+        self.backend_menu = ctk.CTkOptionMenu(control, values=list(BACKENDS),
+                                              command=self._change_backend)
+        self.backend_menu.grid(row=1, column=0, padx=10, pady=10, sticky="ew")
+        # 模型在背景載入完成前先停用，避免使用者按了沒反應
+        self.infer_button = ctk.CTkButton(control, text="執行 YOLO 推論", command=self.run_inference,
+                                          state="disabled")
+        self.infer_button.grid(row=2, column=0, padx=10, pady=10, sticky="ew")
+        # 高解析度圖片上的小物件：切成 640 px 的重疊切片分批推論後再合併
+        self.slice_switch = ctk.CTkSwitch(control, text="切片推論（大圖小物件）")
+        self.slice_switch.grid(row=3, column=0, padx=10, pady=(0, 10), sticky="w")
+        self.progress = ctk.CTkProgressBar(control, mode="indeterminate")
+        self.progress.grid(row=4, column=0, padx=10, pady=(0, 5), sticky="ew")
+        self.progress.set(0)
+        self.status_label = ctk.CTkLabel(control, text="")
+        self.status_label.grid(row=5, column=0, padx=10, pady=(0, 5), sticky="w")
+
+        # 調整門檻只重新篩選快取的原始偵測結果，不會重跑模型
+        thresholds = ctk.CTkFrame(control, fg_color="transparent")
+        thresholds.grid(row=6, column=0, padx=10, pady=(10, 0), sticky="ew")
+        thresholds.grid_columnconfigure(0, weight=1)
+        self.conf_label = ctk.CTkLabel(thresholds, text="")
+        self.conf_label.grid(row=0, column=0, sticky="w")
+        self.conf_slider = ctk.CTkSlider(thresholds, from_=RAW_CONF, to=0.95, number_of_steps=90,
+                                         command=self._on_threshold_change)
+        self.conf_slider.grid(row=1, column=0, sticky="ew")
+        self.conf_slider.set(DEFAULT_CONF)
+        self.iou_label = ctk.CTkLabel(thresholds, text="")
+        self.iou_label.grid(row=2, column=0, sticky="w")
+        self.iou_slider = ctk.CTkSlider(thresholds, from_=0.3, to=RAW_IOU, number_of_steps=65,
+                                        command=self._on_threshold_change)
+        self.iou_slider.grid(row=3, column=0, sticky="ew")
+        self.iou_slider.set(DEFAULT_IOU)
+        self._update_threshold_labels()
 
         ctk.CTkLabel(control, text="像素換算 (mm/pixel)").grid(
-            row=2, column=0, padx=10, pady=(20, 5), sticky="w"
+            row=7, column=0, padx=10, pady=(20, 5), sticky="w"
         )
         self.ratio_entry = ctk.CTkEntry(control, placeholder_text="0.10")
-        self.ratio_entry.grid(row=3, column=0, padx=10, pady=5, sticky="ew")
+        self.ratio_entry.grid(row=8, column=0, padx=10, pady=5, sticky="ew")
+        self.ratio_entry.bind("<KeyRelease>", lambda _event: self._refresh_log())
         ctk.CTkButton(control, text="計算寬度", command=self.calculate_width).grid(
-            row=4, column=0, padx=10, pady=10, sticky="ew"
+            row=9, column=0, padx=10, pady=10, sticky="ew"
         )
 
         self.text_box = ctk.CTkTextbox(control, width=320)
-        self.text_box.grid(row=5, column=0, padx=10, pady=10, sticky="nsew")
+        self.text_box.grid(row=10, column=0, padx=10, pady=10, sticky="nsew")
         self.text_box.insert("1.0", "尚未載入圖片\n")
         self.text_box.configure(state="disabled")
 
         self.current_image_path: Path | None = None
         self.current_bgr = None
         self.last_detections = []
+        # 目前圖片以寬鬆門檻取得的原始結果；滑桿移動時從這裡重新篩選
+        self.image_key: str | None = None
+        self.raw_detections = None
+        self.raw_names: dict[int, str] = {}
+        self.detection_cache = DetectionCache()
+        self.show_widths = False
+
+        # 推論在背景執行緒進行，GUI 只透過 after() 定時取回結果
+        self.worker = InferenceWorker()
+        self.detector = None
+        self.pending_job: int | None = None
+        self.pending_key: tuple | None = None
+        self.pending_load: int | None = None
+        self._busy = False
+        self._startup_reported = False
+        self.protocol("WM_DELETE_WINDOW", self._on_close)
+        self.after(POLL_INTERVAL_MS, self._poll_worker)
+        # 視窗先顯示出來，mainloop 開始後才在背景載入模型
+        self.after(0, self._on_window_shown)
+
+    def _on_window_shown(self) -> None:
+        STARTUP.mark("window_shown")
+        self._request_model(self.backend_menu.get())
+
+    def _request_model(self, backend: str) -> None:
+        """把載入模型排進背景執行緒；載入與暖機完成前停用推論按鈕"""
+        self.detector = None
+        self.infer_button.configure(state="disabled")
+        self.pending_load = self.worker.load(partial(self._build_detector, backend))
+        self._set_busy(True, f"載入 {backend} 模型中…")
+
+    @staticmethod
+    def _build_detector(backend: str):
+        """在背景執行緒執行：import 後端套件、尋找權重、建立 detector（不可操作 Tk 元件）"""
+        suffix = BACKENDS[backend]
+        module = BACKEND_MODULES[suffix]
+        with STARTUP.importing(module):
+            try:
+                importlib.import_module(module)
+            except ImportError:
+                pass  # load_detector 會拋出附安裝提示的 ImportError
+        # 先找 DAY3 自己訓練的 best，再查 models/ 登錄表中檢查碼正確的預訓練權重
+        model_path = find_model(suffix)
+        if model_path is None:
+            hint = "請先執行 Day3 的 export_onnx.py" if suffix == ".onnx" else "請先完成 Day3 的訓練或下載"
+            raise FileNotFoundError(f"找不到 YOLO 權重，{hint}")
+        with STARTUP.measure("model_load"):
+            return load_detector(model_path)
+
+    def _change_backend(self, backend: str) -> None:
+        """切換推論後端時重新載入對應的權重"""
+        self.worker.cancel_pending()
+        self.pending_job = None
+        self._request_model(backend)
+
+    def _on_model_loaded(self, result) -> None:
+        self.pending_load = None
+        if result.error is not None:
+            self._set_busy(False, "模型未載入")
+            if isinstance(result.error, FileNotFoundError):
+                messagebox.showinfo("提醒", str(result.error))
+            elif isinstance(result.error, ImportError):
+                messagebox.showwarning("提示", f"{result.error}，YOLO 相關功能將停用")
+            else:
+                messagebox.showerror("錯誤", f"模型載入失敗：{result.error}")
+            self._report_startup(ready=False)
+            return
 
-        self.yolo_model = self._load_model()
-
-    def _load_model(self):
-        """嘗試載入 YOLO 權重"""
-        if YOLO is None:
-            messagebox.showwarning("提示", "未安裝 ultralytics，YOLO 相關功能將停用")
-            return None
-
-        model_path = Path(__file__).resolve().parent.parent / "DAY3" / "runs" / "demo_yolo11" / "weights" / "best.pt"
-        if not model_path.exists():
-            model_path = Path(__file__).resolve().parent.parent / "DAY3" / "models" / "yolo11n.pt"
-        if not model_path.exists():
-            messagebox.showinfo("提醒", "找不到 YOLO 權重，請先完成 Day3 的訓練或下載")
-            return None
+        self.detector = result.detector
+        self._log(f"已載入 {self.backend_menu.get()}：{self.detector.weights.name}")
+        # 模型載入後先用假影像跑一次，第一次真正推論就不會多等記憶體配置與圖最佳化
+        self.worker.warmup(self.detector)
+        self._set_busy(True, "模型暖機中…")
 
-        return YOLO(str(model_path))
+    def _on_warmup_done(self, result) -> None:
+        self.infer_button.configure(state="normal")
+        if result.error is not None:
+            self._set_busy(self.pending_job is not None, f"暖機失敗：{result.error}")
+        else:
+            STARTUP.durations["warmup"] = round(result.elapsed_ms / 1000, 4)
+            self._set_busy(self.pending_job is not None,
+                           f"暖機完成（{result.elapsed_ms:.0f} ms），可以開始推論")
+        self._report_startup(ready=True)
+
+    def _report_startup(self, ready: bool) -> None:
+        """只在第一次載入模型後記錄啟動時間，之後切換後端不再寫入"""
+        if self._startup_reported:
+            return
+        self._startup_reported = True
+        if ready:
+            STARTUP.mark("model_ready")
+        report = STARTUP.append(backend=self.backend_menu.get(), model_ready=ready)
+        marks = report["marks_s"]
+        text = f"啟動時間：視窗 {marks['window_shown']:.2f} 秒"
+        if ready:
+            text += f"、模型可用 {marks['model_ready']:.2f} 秒"
+        slowest = sorted(report["imports_s"].items(), key=lambda item: -item[1])[:3]
+        text += "\n最慢的 import：" + "、".join(f"{name} {seconds:.2f}s" for name, seconds in slowest)
+        self._log(text)
 
     def load_image(self) -> None:
         """選擇圖片並顯示於主視窗"""
@@ -88,6 +230,14 @@ class SmartInspectionApp(ctk.CTk):
             return
 
         self.last_detections = []
+        self.image_key = image_digest(self.current_bgr)
+        self.raw_detections = None
+        self.show_widths = False
+        # 換圖後，上一張圖還沒完成的推論結果已無意義
+        self.worker.cancel_pending()
+        if self.pending_job is not None:
+            self.pending_job = None
+            self._set_busy(False, "已取消上一張圖的推論")
         self._show_on_panel(self.current_bgr)
         self._log(f"載入圖片：{self.current_image_path.name}")
 
@@ -96,53 +246,126 @@ class SmartInspectionApp(ctk.CTk):
         if self.current_bgr is None:
             messagebox.showinfo("提醒", "請先載入圖片")
             return
-        if self.yolo_model is None:
+        if self.detector is None:
             messagebox.showinfo("提醒", "尚未載入 YOLO 模型")
             return
 
-        results = self.yolo_model.predict(source=self.current_bgr, verbose=False)
-        annotated = self.current_bgr.copy()
-        detections = []
+        # 連按時只保留最後一次：先作廢排隊中的舊工作
+        self.worker.cancel_pending()
+        sliced = bool(self.slice_switch.get())
+        detector = SlicedDetector(self.detector) if sliced else self.detector
+        key = self.detection_cache.key(self.image_key, detector, sliced)
+        cached = self.detection_cache.get(key)
+        if cached is not None:
+            # 同一張圖、同一個模型已經推論過，直接沿用
+            self.pending_job = None
+            self._set_busy(False, "沿用快取的推論結果")
+            self._set_raw_detections(cached, detector.names)
+            return
 
-        for result in results:
-            for box in result.boxes:
-                x1, y1, x2, y2 = box.xyxy[0].tolist()
-                confidence = float(box.conf[0])
-                cls_id = int(box.cls[0])
-                label = self.yolo_model.names.get(cls_id, str(cls_id))
-                detections.append((x1, y1, x2, y2, label, confidence))
+        # 以寬鬆的門檻推論，之後拖動滑桿時只需重新篩選
+        self.pending_key = key
+        self.pending_job = self.worker.submit(detector, self.current_bgr, conf=RAW_CONF, iou=RAW_IOU)
+        self._set_busy(True, "切片推論中…" if sliced else "推論中…")
+
+    def _poll_worker(self) -> None:
+        """在 Tk 主執行緒取回背景推論的結果"""
+        for result in self.worker.poll():
+            if result.kind == "load":
+                # 連續切換後端時只採用最後一次的載入結果
+                if result.job_id == self.pending_load:
+                    self._on_model_loaded(result)
+            elif result.kind == "warmup":
+                if result.detector is self.detector:
+                    self._on_warmup_done(result)
+            elif result.job_id == self.pending_job and not result.skipped:
+                self.pending_job = None
+                if result.error is not None:
+                    self._set_busy(False, "推論失敗")
+                    messagebox.showerror("錯誤", f"推論失敗：{result.error}")
+                else:
+                    self.detection_cache.put(self.pending_key, result.detections)
+                    self._set_raw_detections(result.detections, result.detector.names)
+                    self._set_busy(False, f"推論完成：{result.elapsed_ms:.0f} ms")
+        self.after(POLL_INTERVAL_MS, self._poll_worker)
+
+    def _set_busy(self, busy: bool, text: str) -> None:
+        """切換進度條動畫並更新狀態文字"""
+        if busy and not self._busy:
+            self.progress.start()
+        elif not busy and self._busy:
+            self.progress.stop()
+            self.progress.set(0)
+        self._busy = busy
+        self.status_label.configure(text=text)
+
+    def _set_raw_detections(self, raw, names: dict[int, str]) -> None:
+        self.raw_detections = raw
+        self.raw_names = names
+        self._apply_thresholds()
+
+    def _on_threshold_change(self, _value: float) -> None:
+        self._update_threshold_labels()
+        self._apply_thresholds()
+
+    def _update_threshold_labels(self) -> None:
+        self.conf_label.configure(text=f"信心度門檻：{self.conf_slider.get():.2f}")
+        self.iou_label.configure(text=f"NMS IoU：{self.iou_slider.get():.2f}")
+
+    def _apply_thresholds(self) -> None:
+        """以滑桿目前的門檻重新篩選原始結果並重畫，全部在 NumPy 完成"""
+        if self.raw_detections is None or self.current_bgr is None:
+            return
+        boxes = filter_detections(self.raw_detections, self.conf_slider.get(), self.iou_slider.get())
+        self._show_detections(boxes, self.raw_names)
 
-                cv2.rectangle(annotated, (int(x1), int(y1)), (int(x2), int(y2)), (0, 255, 0), 2)
-                caption = f"{label} {confidence:.2f}"
-                cv2.putText(annotated, caption, (int(x1), int(y1) - 8),
-                            cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
+    def _show_detections(self, boxes, names: dict[int, str]) -> None:
+        # 每一列為 (x1, y1, x2, y2, conf, cls)，兩種後端格式相同
+        detections = [
+            (x1, y1, x2, y2, names.get(int(cls_id), str(int(cls_id))), confidence)
+            for x1, y1, x2, y2, confidence, cls_id in boxes.tolist()
+        ]
+        annotated = draw_detections(self.current_bgr, boxes, names)
 
         self.last_detections = detections
         self._show_on_panel(annotated)
-
-        if detections:
-            self._log(f"偵測到 {len(detections)} 個物件")
-        else:
-            self._log("未偵測到任何物件")
+        self._refresh_log()
 
     def calculate_width(self) -> None:
-        """根據框線估算寬度"""
+        """根據框線估算寬度；之後調整門檻或換算比例時，寬度表會即時更新"""
         if not self.last_detections:
             messagebox.showinfo("提醒", "請先執行 YOLO 推論")
             return
+        if self._read_ratio() is None:
+            messagebox.showerror("錯誤", "請輸入正確的數值 (mm/pixel)")
+            return
+        self.show_widths = True
+        self._refresh_log()
 
+    def _read_ratio(self) -> float | None:
         try:
-            ratio = float(self.ratio_entry.get() or 0.10)
+            return float(self.ratio_entry.get() or 0.10)
         except ValueError:
-            messagebox.showerror("錯誤", "請輸入正確的數值 (mm/pixel)")
-            return
+            return None
 
-        logs = []
-        for index, (x1, _, x2, _, label, _) in enumerate(self.last_detections, start=1):
-            pixel_width = abs(x2 - x1)
-            mm_width = pixel_width * ratio
-            logs.append(f"#{index} {label}: {pixel_width:.1f} px ≈ {mm_width:.2f} mm")
+    def _refresh_log(self) -> None:
+        """偵測摘要，按過「計算寬度」後再附上各物件的寬度"""
+        if self.raw_detections is None:
+            return
+        if not self.last_detections:
+            self._log("未偵測到任何物件")
+            return
 
+        logs = [f"偵測到 {len(self.last_detections)} 個物件"
+                f"（信心度 > {self.conf_slider.get():.2f}，IoU {self.iou_slider.get():.2f}）"]
+        ratio = self._read_ratio()
+        if self.show_widths and ratio is None:
+            logs.append("mm/pixel 數值不正確")
+        elif self.show_widths:
+            for index, (x1, _, x2, _, label, _) in enumerate(self.last_detections, start=1):
+                pixel_width = abs(x2 - x1)
+                mm_width = pixel_width * ratio
+                logs.append(f"#{index} {label}: {pixel_width:.1f} px ≈ {mm_width:.2f} mm")
         self._log("\n".join(logs))
 
     def _show_on_panel(self, bgr_image) -> None:
@@ -153,6 +376,10 @@ class SmartInspectionApp(ctk.CTk):
         self.image_panel.configure(image=photo)
         self.image_panel.image = photo
 
+    def _on_close(self) -> None:
+        self.worker.stop()
+        self.destroy()
+
     def _log(self, text: str) -> None:
         self.text_box.configure(state="normal")
         self.text_box.delete("1.0", "end")
@@ -13,7 +13,7 @@ datas += tmp_ret[0]; binaries += tmp_ret[1]; hiddenimports += tmp_ret[2]
 
 a = Analysis(
     ['smart_inspection_app.py'],
-    pathex=[],
+    pathex=['../DAY3'],
     binaries=binaries,
     datas=datas,
     hiddenimports=hiddenimports,
@@ -0,0 +1,73 @@
+﻿"""Day 6：記錄 GUI 啟動各階段耗時（import、視窗出現、模型可用）"""
+from __future__ import annotations
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+import json
+import sys
+import time
+
+# Author: harry123180
+
+
+def default_report_path() -> Path:
+    """打包成執行檔時寫在 exe 旁邊，否則寫在程式所在資料夾"""
+    if getattr(sys, "frozen", False):
+        return Path(sys.executable).resolve().parent / "startup_timing.jsonl"
+    return Path(__file__).resolve().parent / "startup_timing.jsonl"
+
+
+class StartupTimer:
+    """以 perf_counter 記錄從主程式開始 import 到模型可用的各個時間點
+
+    每次啟動在 JSONL 檔附加一行，方便比較不同版本（或打包前後）的啟動時間。
+    """
+
+    def __init__(self) -> None:
+        self.start = time.perf_counter()
+        self.imports: dict[str, float] = {}
+        self.marks: dict[str, float] = {}
+        self.durations: dict[str, float] = {}
+
+    @contextmanager
+    def importing(self, name: str):
+        """with timer.importing("cv2"): import cv2 —— 記錄單一模組的 import 時間"""
+        already_loaded = name in sys.modules
+        start = time.perf_counter()
+        yield
+        # 已被其他模組載入過的不算時間，避免誤以為它很便宜
+        if not already_loaded:
+            self.imports[name] = round(time.perf_counter() - start, 4)
+
+    @contextmanager
+    def measure(self, name: str):
+        start = time.perf_counter()
+        yield
+        self.durations[name] = round(time.perf_counter() - start, 4)
+
+    def mark(self, name: str) -> float:
+        """記錄從開始到現在經過的秒數"""
+        elapsed = round(time.perf_counter() - self.start, 4)
+        self.marks[name] = elapsed
+        return elapsed
+
+    def report(self, **extra) -> dict:
+        return {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "frozen": bool(getattr(sys, "frozen", False)),
+            "python": sys.version.split()[0],
+            **extra,
+            "imports_s": self.imports,
+            "durations_s": self.durations,
+            "marks_s": self.marks,
+        }
+
+    def append(self, path: Path | None = None, **extra) -> dict:
+        report = self.report(**extra)
+        path = path or default_report_path()
+        try:
+            with open(path, "a", encoding="utf-8") as file:
+                file.write(json.dumps(report, ensure_ascii=False) + "\n")
+        except OSError:
+            pass  # 唯讀位置（例如安裝在 Program Files）就只在畫面上顯示
+        return report
@@ -0,0 +1,335 @@
+"""共享記憶體影像匯流排：一個行程擷取畫面，多個分析行程零複製讀取
+
+使用方式：
+    # 1) 啟動生產者（開攝影機或影片，把畫面寫進共享記憶體）
+    python frame_bus.py produce --source 0 --name cam0
+
+    # 2) 其他程式改從匯流排讀取，例如
+    python tool01_camera_basic.py bus:cam0
+    python ../DAY2/pose_live_demo.py bus:cam0
+    python tool04_coin_pipeline.py bus:cam0
+
+    # 3) 延遲測試：1、2、4 個消費者行程
+    python frame_bus.py benchmark --consumers 1 2 4
+"""
+from __future__ import annotations
+from dataclasses import dataclass
+from multiprocessing import Process, Queue, parent_process, shared_memory
+import argparse
+import os
+import signal
+import time
+import cv2
+import numpy as np
+
+# 標頭：magic, 版本, 寬, 高, 通道, 槽數, 最新序號（皆為 int64）
+_HEADER_FIELDS = 7
+_MAGIC = 0x46524D42  # "FRMB"
+_VERSION = 1
+_IDX_WRITE_SEQ = 6
+
+BUS_PREFIX = "bus:"
+# BusReader.read() 複製途中畫面被覆寫時，最多改讀新畫面幾次
+MAX_READ_RETRIES = 8
+
+
+def _layout(slots: int) -> tuple[int, int]:
+    """回傳 (槽序號表的位移, 畫面資料的位移)"""
+    header_bytes = _HEADER_FIELDS * 8
+    # 每個槽記錄序號 (int64) 與擷取時間 (float64)
+    table_bytes = slots * 16
+    data_offset = (header_bytes + table_bytes + 63) // 64 * 64
+    return header_bytes, data_offset
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    """連接既有的共享記憶體，但不讓本行程結束時把它刪掉"""
+    shm = shared_memory.SharedMemory(name=name)
+    # Python 3.12 以前，resource_tracker 會在消費者結束時誤刪共享記憶體；
+    # 由 multiprocessing 啟動的子行程與父行程共用 tracker，交給父行程處理即可
+    if os.name == "posix" and parent_process() is None:
+        from multiprocessing import resource_tracker
+        try:
+            resource_tracker.unregister(shm._name, "shared_memory")  # type: ignore[attr-defined]
+        except Exception:
+            pass
+    return shm
+
+
+@dataclass
+class BusFrame:
+    """匯流排上的一張畫面；image 直接指向共享記憶體（零複製）"""
+
+    image: np.ndarray
+    seq: int
+    timestamp: float
+    slot: int
+
+
+class FrameBus:
+    """固定大小畫面的環狀共享記憶體緩衝區
+
+    生產者寫入順序：先把槽序號設為 0（寫入中）→ 複製畫面 → 寫入時間與序號 → 更新最新序號。
+    消費者只要確認讀取前後槽序號相同，就能確定拿到的是完整畫面。
+    """
+
+    def __init__(self, shm: shared_memory.SharedMemory, owner: bool) -> None:
+        self.shm = shm
+        self.owner = owner
+        header = np.ndarray((_HEADER_FIELDS,), dtype=np.int64, buffer=shm.buf)
+        if header[0] != _MAGIC or header[1] != _VERSION:
+            raise RuntimeError(f"{shm.name} 不是可用的影像匯流排")
+        self._header = header
+        width, height, channels, slots = (int(v) for v in header[2:6])
+        self.shape = (height, width, channels) if channels > 1 else (height, width)
+        self.slots = slots
+
+        table_offset, data_offset = _layout(slots)
+        self._slot_seq = np.ndarray((slots,), dtype=np.int64, buffer=shm.buf, offset=table_offset)
+        self._slot_time = np.ndarray((slots,), dtype=np.float64, buffer=shm.buf,
+                                     offset=table_offset + slots * 8)
+        self._frames = np.ndarray((slots, *self.shape), dtype=np.uint8, buffer=shm.buf,
+                                  offset=data_offset)
+
+    @classmethod
+    def create(cls, name: str, shape: tuple[int, ...], slots: int = 8) -> "FrameBus":
+        """建立新的匯流排（生產者呼叫）"""
+        height, width = shape[:2]
+        channels = shape[2] if len(shape) == 3 else 1
+        _, data_offset = _layout(slots)
+        size = data_offset + slots * height * width * channels
+        shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        header = np.ndarray((_HEADER_FIELDS,), dtype=np.int64, buffer=shm.buf)
+        header[:] = (_MAGIC, _VERSION, width, height, channels, slots, 0)
+        return cls(shm, owner=True)
+
+    @classmethod
+    def connect(cls, name: str, timeout: float = 10.0) -> "FrameBus":
+        """連接既有的匯流排（消費者呼叫），生產者還沒啟動時會等待"""
+        deadline = time.perf_counter() + timeout
+        while True:
+            try:
+                return cls(_attach(name), owner=False)
+            except FileNotFoundError:
+                if time.perf_counter() > deadline:
+                    raise RuntimeError(f"找不到影像匯流排 {name}，請先啟動 frame_bus.py produce") from None
+                time.sleep(0.1)
+
+    @property
+    def latest_seq(self) -> int:
+        return int(self._header[_IDX_WRITE_SEQ])
+
+    def write(self, image: np.ndarray, timestamp: float | None = None) -> int:
+        """寫入一張畫面，回傳它的序號"""
+        seq = self.latest_seq + 1
+        slot = seq % self.slots
+        self._slot_seq[slot] = 0
+        self._frames[slot][...] = image
+        self._slot_time[slot] = time.perf_counter() if timestamp is None else timestamp
+        self._slot_seq[slot] = seq
+        self._header[_IDX_WRITE_SEQ] = seq
+        return seq
+
+    def read_latest(self, after_seq: int = 0) -> BusFrame | None:
+        """取最新一張序號大於 after_seq 的畫面；沒有新畫面時回傳 None"""
+        seq = self.latest_seq
+        if seq <= after_seq:
+            return None
+        slot = seq % self.slots
+        timestamp = float(self._slot_time[slot])
+        if self._slot_seq[slot] != seq:
+            return None  # 正好被覆寫，下次再讀
+        return BusFrame(self._frames[slot], seq, timestamp, slot)
+
+    def is_valid(self, frame: BusFrame) -> bool:
+        """確認零複製的畫面在使用期間沒有被生產者覆寫"""
+        return int(self._slot_seq[frame.slot]) == frame.seq
+
+    def close(self) -> None:
+        # 先放掉所有指向共享記憶體的 numpy view，才能關閉
+        del self._header, self._slot_seq, self._slot_time, self._frames
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+class BusReader:
+    """以 cv2.VideoCapture 相同介面讀取匯流排，並統計丟失的畫面"""
+
+    def __init__(self, name: str, poll_interval: float = 0.0005, timeout: float = 2.0) -> None:
+        self.bus = FrameBus.connect(name)
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self.last_seq = 0
+        self.dropped = 0
+        self.last_timestamp = 0.0
+
+    def isOpened(self) -> bool:  # noqa: N802 - 與 cv2.VideoCapture 相同命名
+        return True
+
+    def read_frame(self) -> BusFrame | None:
+        """等待下一張新畫面（零複製），逾時回傳 None"""
+        deadline = time.perf_counter() + self.timeout
+        while True:
+            frame = self.bus.read_latest(self.last_seq)
+            if frame is not None:
+                if self.last_seq and frame.seq > self.last_seq + 1:
+                    self.dropped += frame.seq - self.last_seq - 1
+                self.last_seq = frame.seq
+                self.last_timestamp = frame.timestamp
+                return frame
+            if time.perf_counter() > deadline:
+                return None
+            time.sleep(self.poll_interval)
+
+    def read(self) -> tuple[bool, np.ndarray | None]:
+        """與 VideoCapture.read() 相同；回傳複本，呼叫端可以放心修改
+
+        連續 MAX_READ_RETRIES 次都在複製途中被覆寫（讀取端遠比生產者慢）時回傳 (False, None)。
+        """
+        for _ in range(MAX_READ_RETRIES):
+            frame = self.read_frame()
+            if frame is None:
+                return False, None
+            image = frame.image.copy()
+            if self.bus.is_valid(frame):
+                return True, image
+            # 複製途中被覆寫，改讀更新的畫面
+        return False, None
+
+    def release(self) -> None:
+        self.bus.close()
+
+
+def open_source(spec: str | int | None = None, default: int = 0):
+    """依參數開啟畫面來源：`bus:名稱` 讀取匯流排，數字為攝影機，其餘視為影片路徑"""
+    if spec is None:
+        spec = default
+    if isinstance(spec, str) and spec.startswith(BUS_PREFIX):
+        return BusReader(spec[len(BUS_PREFIX):])
+    if isinstance(spec, str) and spec.isdigit():
+        spec = int(spec)
+    return cv2.VideoCapture(spec)
+
+
+def _raise_interrupt(signum, frame) -> None:
+    raise KeyboardInterrupt
+
+
+def produce(source: int | str, name: str, slots: int) -> None:
+    """從攝影機或影片擷取畫面並持續寫入匯流排（Ctrl+C 結束）"""
+    cap = cv2.VideoCapture(source)
+    if not cap.isOpened():
+        raise RuntimeError(f"無法開啟來源 {source}")
+    ok, frame = cap.read()
+    if not ok:
+        raise RuntimeError("讀取第一張畫面失敗")
+
+    is_file = isinstance(source, str)
+    interval = 1.0 / cap.get(cv2.CAP_PROP_FPS) if is_file and cap.get(cv2.CAP_PROP_FPS) > 0 else 0.0
+    bus = FrameBus.create(name, frame.shape, slots)
+    # 被 kill / 關閉終端機時也要走到 finally，才會刪除共享記憶體
+    signal.signal(signal.SIGTERM, _raise_interrupt)
+    print(f"匯流排 {name} 已建立：{frame.shape[1]}x{frame.shape[0]}，{slots} 個槽，按 Ctrl+C 結束")
+    try:
+        while ok:
+            bus.write(frame)
+            if interval:
+                time.sleep(interval)  # 影片檔依原始 FPS 播放
+            ok, frame = cap.read()
+            if not ok and is_file:
+                cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                ok, frame = cap.read()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        cap.release()
+        bus.close()
+        print(f"匯流排 {name} 已關閉")
+
+
+def _benchmark_consumer(name: str, frames: int, results: Queue) -> None:
+    reader = BusReader(name, timeout=5.0)
+    latencies = []
+    torn = 0
+    while reader.last_seq < frames:
+        frame = reader.read_frame()
+        if frame is None:
+            break
+        # 模擬輕量分析：直接在共享記憶體上取樣計算，不複製畫面
+        float(frame.image[::16, ::16].mean())
+        latencies.append(time.perf_counter() - frame.timestamp)
+        torn += not reader.bus.is_valid(frame)
+    results.put((latencies, reader.dropped, torn))
+    reader.release()
+
+
+def benchmark(consumer_counts: list[int], frames: int, width: int, height: int,
+              fps: float, slots: int) -> None:
+    """以合成畫面測量不同消費者數量下的讀取延遲"""
+    rng = np.random.default_rng(0)
+    patterns = rng.integers(0, 255, size=(4, height, width, 3), dtype=np.uint8)
+    interval = 1.0 / fps
+
+    for count in consumer_counts:
+        name = f"bench_{os.getpid()}_{count}"
+        bus = FrameBus.create(name, patterns[0].shape, slots)
+        results: Queue = Queue()
+        consumers = [Process(target=_benchmark_consumer, args=(name, frames, results))
+                     for _ in range(count)]
+        for process in consumers:
+            process.start()
+        time.sleep(1.0)  # 等消費者連上
+
+        next_time = time.perf_counter()
+        for index in range(frames + 10):
+            bus.write(patterns[index % len(patterns)])
+            next_time += interval
+            delay = next_time - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+        collected = [results.get(timeout=30) for _ in consumers]
+        for process in consumers:
+            process.join()
+        bus.close()
+
+        for index, (latencies, dropped, torn) in enumerate(collected, start=1):
+            ms = np.array(latencies) * 1000
+            if len(ms) == 0:
+                print(f"{count} 個消費者 / #{index}：沒有收到畫面")
+                continue
+            print(f"{count} 個消費者 / #{index}：收到 {len(ms)} 張、丟失 {dropped} 張、覆寫 {torn} 張，"
+                  f"延遲 p50 {np.percentile(ms, 50):.2f} ms / p95 {np.percentile(ms, 95):.2f} ms")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="共享記憶體影像匯流排")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    produce_parser = sub.add_parser("produce", help="擷取畫面並寫入匯流排")
+    produce_parser.add_argument("--source", default="0", help="攝影機編號或影片路徑")
+    produce_parser.add_argument("--name", default="cam0", help="匯流排名稱")
+    produce_parser.add_argument("--slots", type=int, default=8, help="環狀緩衝區槽數")
+
+    bench_parser = sub.add_parser("benchmark", help="測量 1 / 2 / 4 個消費者的延遲")
+    bench_parser.add_argument("--consumers", type=int, nargs="+", default=[1, 2, 4])
+    bench_parser.add_argument("--frames", type=int, default=300)
+    bench_parser.add_argument("--size", default="1920x1080", help="畫面尺寸 寬x高")
+    bench_parser.add_argument("--fps", type=float, default=60.0)
+    bench_parser.add_argument("--slots", type=int, default=8)
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    if args.command == "produce":
+        source = int(args.source) if args.source.isdigit() else args.source
+        produce(source, args.name, args.slots)
+    else:
+        width, height = (int(v) for v in args.size.lower().split("x"))
+        benchmark(args.consumers, args.frames, width, height, args.fps, args.slots)
+
+
+if __name__ == "__main__":
+    main()
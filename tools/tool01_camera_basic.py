@@ -1,5 +1,8 @@
+import sys
 import cv2
-攝影機 = cv2.VideoCapture(0)
+from frame_bus import open_source
+# 可加參數改用其他來源，例如 bus:cam0（共享記憶體匯流排）或影片路徑
+攝影機 = open_source(sys.argv[1] if len(sys.argv) > 1 else 0)
 while True:
     成功擷取,畫面 = 攝影機.read()
     if not 成功擷取:
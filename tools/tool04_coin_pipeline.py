@@ -1,6 +1,8 @@
+import sys
 import cv2
 import numpy as np
 import math
+from frame_bus import open_source
 
 def stack_images(imgs, cols=3, scale=0.9):
     """把多張影像等尺寸拼成網格方便觀察"""
@@ -28,7 +30,11 @@ def stack_images(imgs, cols=3, scale=0.9):
 
 def main():
     # Windows 常見：用 CAP_DSHOW 可避免開啟延遲；你有多顆鏡頭就把 0 改 1、2...
-    cap = cv2.VideoCapture(0, cv2.CAP_DSHOW)
+    # 也可指定其他來源，例如 bus:cam0 與其他程式共用同一支攝影機
+    if len(sys.argv) > 1:
+        cap = open_source(sys.argv[1])
+    else:
+        cap = cv2.VideoCapture(0, cv2.CAP_DSHOW)
     # 想固定解析度可解除註解
     # cap.set(cv2.CAP_PROP_FRAME_WIDTH, 1280)
     # cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 720)